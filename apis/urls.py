@@ -8,4 +8,8 @@ urlpatterns = [
     path("orbat/section/<int:section_id>/slot/", SectionSlotAPI.as_view()),
     path("orbat/section/<int:section_id>/role_options/", SectionRoleOptions.as_view()),
     path("orbat/section/<int:section_id>/members/", SectionMembersAPI.as_view()),
+    path("orbat/graph/", OrbatGraphAPI.as_view()),
+    path("timeline/activity/", TimelineActivityAPI.as_view()),
+    path("timeline/fragment_stats/", TimelineFragmentStatsAPI.as_view()),
+    path("training/qualification/<int:qualification_id>/grades/", QualificationGradingAPI.as_view()),
 ]
\ No newline at end of file
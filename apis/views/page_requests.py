@@ -1,10 +1,24 @@
-from django.db.models import Count
+from datetime import MAXYEAR, MINYEAR, date, timedelta
+from uuid import UUID
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.response import Response
 
 from apis.views import BaseAPIView
+from core.cache import bump_cache_version
+from orbat.export import EXPORT_FORMATS, ORBAT_NAMESPACE, get_orbat_export
 from orbat.models import SectionSlot, RoleSlotAssignment, SectionAssignment, Role, Section
+from orbat.role_catalogue import get_role_catalogue, get_section_role_state, validate_slot_roles
+from timeline.fragments import get_fragment_stats, reset_fragment_stats
+from timeline.models import TimelineTypes
+from timeline.rollup import get_daily_activity
+from training.models import Qualification
+from training.services import can_grade_qualification, get_grading_grid, grade_criteria
 
 
 class SectionSlotAPI(BaseAPIView):
@@ -29,6 +43,48 @@ class SectionSlotAPI(BaseAPIView):
         }
         return data
 
+    def _requested_role_ids(self):
+        """
+        Role ids sent by the slot panel: a list of non-rank `roles` plus an optional `rank`
+        (either an id or a serialized role). Returns None when the request doesn't touch roles.
+        Raises TypeError/ValueError for ids that aren't integers.
+        """
+        if "roles" not in self.request.data and "rank" not in self.request.data:
+            return None
+        role_ids = [int(role_id) for role_id in self.request.data.get("roles") or []]
+        rank = self.request.data.get("rank")
+        if isinstance(rank, dict):
+            rank = rank.get("id")
+        if rank:
+            role_ids.append(int(rank))
+        return role_ids
+
+    def _sync_roles(self, slot, role_ids):
+        """End assignments for roles no longer held and create the new ones."""
+        active = RoleSlotAssignment.objects.filter(section_slot=slot, end_date__isnull=True)
+        if active.exclude(role_id__in=role_ids).update(end_date=timezone.now()):
+            # update() bypasses the model signals that invalidate the ORBAT export
+            transaction.on_commit(lambda: bump_cache_version(ORBAT_NAMESPACE))
+        held = set(active.values_list("role_id", flat=True))
+        for role_id in role_ids:
+            if role_id not in held:
+                RoleSlotAssignment.objects.create(section_slot=slot, role_id=role_id)
+
+    def _clean_roles(self, section_id, slot_id=None):
+        """
+        The requested role ids, validated for the slot, and an error response if they aren't valid.
+        Role ids are None when the request doesn't touch roles.
+        """
+        try:
+            role_ids = self._requested_role_ids()
+            if role_ids is not None:
+                validate_slot_roles(section_id, role_ids, slot_id=slot_id)
+        except (TypeError, ValueError):
+            return None, Response({"roles": ["Role ids must be integers."]}, status=status.HTTP_400_BAD_REQUEST)
+        except ValidationError as e:
+            return None, Response({"roles": e.messages}, status=status.HTTP_400_BAD_REQUEST)
+        return role_ids, None
+
     def context_check(self, request, method, user, *args, **kwargs):
         # Allow GET to anyone
         if method == "GET":
@@ -72,11 +128,18 @@ class SectionSlotAPI(BaseAPIView):
 
         section = get_object_or_404(Section, pk=section_id)
 
-        slot = SectionSlot.objects.create(
-            section=section,
-            name=request.data.get("name", ""),
-            user_id=request.data.get("member") or None
-        )
+        role_ids, error = self._clean_roles(section.id)
+        if error:
+            return error
+
+        with transaction.atomic():
+            slot = SectionSlot.objects.create(
+                section=section,
+                name=request.data.get("name", ""),
+                user_id=request.data.get("member") or None
+            )
+            if role_ids:
+                self._sync_roles(slot, role_ids)
 
         return Response(self._serialize_slot(slot), status=status.HTTP_201_CREATED)
 
@@ -93,7 +156,14 @@ class SectionSlotAPI(BaseAPIView):
         if member_id is not None:
             slot.user_id = member_id
 
-        slot.save()
+        role_ids, error = self._clean_roles(slot.section_id, slot_id=slot.id)
+        if error:
+            return error
+
+        with transaction.atomic():
+            slot.save()
+            if role_ids is not None:
+                self._sync_roles(slot, role_ids)
 
         return Response(self._serialize_slot(slot), status=status.HTTP_200_OK)
 
@@ -109,49 +179,27 @@ class SectionRoleOptions(BaseAPIView):
         if not section:
             return Response({"detail": "Section not found"}, status=status.HTTP_404_NOT_FOUND)
 
+        role_counts, slot_roles = get_section_role_state(section.id)
 
         # Optional: allow ?slot_id=123 to account for inline roles in this slot
         slot_id = request.query_params.get("slot_id")
-        inline_role_ids = set()
-        if slot_id:
-            role_assignments = RoleSlotAssignment.objects.filter(
-                section_slot__pk=slot_id, end_date__isnull=True
-            ).select_related("role")
+        inline_role_ids = slot_roles.get(int(slot_id), set()) if slot_id and slot_id.isdigit() else set()
 
-            inline_role_ids = {r.role.id for r in role_assignments}
-
-        roles = Role.objects.all().prefetch_related("allowed_sections", "incompatible_roles")
-
-        section_role_counts = (
-            RoleSlotAssignment.objects
-            .filter(section_slot__section=section, end_date__isnull=True)
-            .values("role")
-            .annotate(count=Count("id"))
-        )
-
-        role_counts = {entry["role"]: entry["count"] for entry in section_role_counts}
+        catalogue = get_role_catalogue()
+        capacity_mask = catalogue.capacity_mask(role_counts, exclude_mask=catalogue.mask(inline_role_ids))
+        allowed_ids = catalogue.ids(catalogue.allowed_mask(section.id))
 
         role_options = []
-        for r in roles:
-            # If no allowed_sections, role is globally allowed
-            if r.allowed_sections.count() == 0 or r.allowed_sections.filter(pk=section_id).exists():
-
-                current_count = role_counts.get(r.id, 0)
-
-                is_capacity = False
-                if r.max_per_section is not None and current_count >= r.max_per_section:
-                    # If role not already selected inline for this slot, it's at capacity
-                    if r.id not in inline_role_ids:
-                        is_capacity = True
-
-                role_options.append({
-                    "id": r.id,
-                    "name": r.name,
-                    "shorthand": r.shorthand,
-                    "is_rank": r.is_rank,
-                    "is_capacity": is_capacity,
-                    "conflicts": list(r.incompatible_roles.values_list("id", flat=True)),
-                })
+        for r in Role.objects.filter(id__in=allowed_ids):
+            role_bit = catalogue.mask([r.id])
+            role_options.append({
+                "id": r.id,
+                "name": r.name,
+                "shorthand": r.shorthand,
+                "is_rank": r.is_rank,
+                "is_capacity": bool(capacity_mask & role_bit),
+                "conflicts": catalogue.ids(catalogue.conflicts_mask(role_bit)),
+            })
 
         return Response(role_options)
 
@@ -169,4 +217,150 @@ class SectionMembersAPI(BaseAPIView):
             }
             for a in active_assignments if a.user
         ]
-        return Response(members)
\ No newline at end of file
+        return Response(members)
+
+
+class OrbatGraphAPI(BaseAPIView):
+    """
+    The full Platoon -> Section -> Slot -> Role graph in one response.
+    ?output=json (default) or ?output=dot for Graphviz.
+    """
+    content_types = {
+        "json": "application/json",
+        "dot": "text/vnd.graphviz; charset=utf-8",
+    }
+
+    def get(self, request):
+        export_format = request.query_params.get("output", "json")
+        if export_format not in EXPORT_FORMATS:
+            return Response({"detail": f"Unsupported output '{export_format}'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        etag, content = get_orbat_export(export_format)
+        if request.headers.get("If-None-Match") == etag:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(content, content_type=self.content_types[export_format])
+        response["ETag"] = etag
+        return response
+
+
+class TimelineActivityAPI(BaseAPIView):
+    """
+    Daily timeline activity for calendar heatmaps.
+    Defaults to the last year; ?year=2025 for a calendar year.
+    Optional ?section=<id>, ?user=<uuid> and ?types=SECTION_JOINED,ROLE_ASSIGNED filters.
+    """
+    def get(self, request):
+        year = request.query_params.get("year")
+        if year:
+            if not year.isdigit() or not MINYEAR <= int(year) <= MAXYEAR:
+                return Response({"detail": "Invalid year"}, status=status.HTTP_400_BAD_REQUEST)
+            start, end = date(int(year), 1, 1), date(int(year), 12, 31)
+        else:
+            end = timezone.localdate()
+            start = end - timedelta(days=364)
+
+        user = request.query_params.get("user")
+        if user:
+            try:
+                user = UUID(user)
+            except ValueError:
+                return Response({"detail": "Invalid user"}, status=status.HTTP_400_BAD_REQUEST)
+
+        types = request.query_params.get("types")
+        event_types = [t for t in types.split(",") if t in TimelineTypes.values] if types else None
+        section = request.query_params.get("section")
+
+        days = get_daily_activity(
+            start,
+            end,
+            section=int(section) if section and section.isdigit() else None,
+            user=user or None,
+            event_types=event_types,
+        )
+        return Response({
+            "start": start,
+            "end": end,
+            "total": sum(days.values()),
+            "days": {day.isoformat(): count for day, count in sorted(days.items())},
+        })
+
+
+class TimelineFragmentStatsAPI(BaseAPIView):
+    """
+    Hit/miss counters for the cached timeline fragments. Staff only.
+    DELETE resets the counters.
+    """
+    def context_check(self, request, method, user, *args, **kwargs):
+        return user.is_staff
+
+    def get(self, request):
+        return Response(get_fragment_stats())
+
+    def delete(self, request):
+        reset_fragment_stats()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class QualificationGradingAPI(BaseAPIView):
+    """
+    Student x criterion grid for one qualification.
+    GET returns {"criteria": [...], "grades": {user_id: [criterion ids]}}, optionally for ?user=<uuid>&user=...
+    POST takes {"grades": {user_id: [completed criterion ids]}} and writes the difference,
+    promoting students who have completed every criterion.
+    """
+    qualification = None
+
+    def _get_qualification(self, qualification_id):
+        if self.qualification is None:
+            self.qualification = get_object_or_404(Qualification, pk=qualification_id)
+        return self.qualification
+
+    def context_check(self, request, method, user, *args, **kwargs):
+        return can_grade_qualification(user, self._get_qualification(kwargs.get("qualification_id")))
+
+    def _parse_user_ids(self, values):
+        try:
+            return [UUID(str(value)) for value in values]
+        except ValueError:
+            return None
+
+    def get(self, request, qualification_id):
+        user_ids = None
+        if "user" in request.query_params:
+            user_ids = self._parse_user_ids(request.query_params.getlist("user"))
+            if user_ids is None:
+                return Response({"detail": "Invalid user"}, status=status.HTTP_400_BAD_REQUEST)
+
+        qualification = self._get_qualification(qualification_id)
+        criteria = qualification.criteria.order_by("order").values("id", "name", "order")
+        grades = get_grading_grid(qualification, user_ids)
+        return Response({
+            "criteria": list(criteria),
+            "grades": {str(user_id): sorted(completed) for user_id, completed in grades.items()},
+        })
+
+    def post(self, request, qualification_id):
+        grades = request.data.get("grades")
+        if not isinstance(grades, dict):
+            return Response({"grades": ["Expected an object of user id to criterion ids."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        user_ids = self._parse_user_ids(grades.keys())
+        if user_ids is None:
+            return Response({"grades": ["Invalid user id."]}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            grid = {
+                user_id: {int(criterion_id) for criterion_id in criterion_ids}
+                for user_id, criterion_ids in zip(user_ids, grades.values())
+            }
+            graded_by = request.user if request.user.is_authenticated else getattr(request.api_key, "user", None)
+            result = grade_criteria(self._get_qualification(qualification_id), grid, graded_by=graded_by)
+        except (TypeError, ValueError):
+            return Response({"grades": ["Criterion ids must be lists of integers."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        except ValidationError as e:
+            return Response({"grades": e.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+        result["promoted"] = [str(user_id) for user_id in result["promoted"]]
+        return Response(result)
@@ -0,0 +1,34 @@
+from django.core.cache import cache
+
+
+def _version_key(namespace):
+    return f"unithub:version:{namespace}"
+
+
+def get_cache_version(namespace):
+    """
+    Current version number for a cached namespace (e.g. "orbat", "timeline").
+    Cache keys built with this version go stale as soon as the namespace is bumped.
+    """
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_cache_version(namespace):
+    """Invalidate everything cached under a namespace by moving to the next version."""
+    key = _version_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, timeout=None)
+        return 2
+
+
+def versioned_key(namespace, *parts):
+    """Build a cache key that is tied to the current version of a namespace."""
+    suffix = ":".join(str(part) for part in parts)
+    return f"unithub:{namespace}:v{get_cache_version(namespace)}:{suffix}"
@@ -0,0 +1,104 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder cuts datetimes and times to milliseconds, which would make a keyset
+    cursor skip rows within the same millisecond. Cursors keep the full microseconds.
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    """Encode a list of ordering values into an opaque, url-safe cursor string."""
+    raw = json.dumps(list(values), cls=CursorEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, length):
+    """
+    Decode a cursor produced by encode_cursor.
+    Returns None for missing or malformed cursors so callers fall back to the first page.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+def keyset_filter(ordering, values, nullable=()):
+    """
+    Build the "rows after this one" filter for an ordering such as ["-timestamp", "-id"].
+    (a, b) > (x, y) is expanded to a > x OR (a = x AND b > y) so every backend can use the index.
+    Fields in nullable sort their NULLs last, after every value in either direction.
+    """
+    condition = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip("-")
+        if values[i] is None:
+            # Nothing sorts after NULL in this field, only ties carry on to the next one
+            continue
+        lookup = "lt" if field.startswith("-") else "gt"
+        step = Q(**{f"{name}__{lookup}": values[i]})
+        if name in nullable:
+            step |= Q(**{f"{name}__isnull": True})
+        for prev_field, prev_value in zip(ordering[:i], values[:i]):
+            prev_name = prev_field.lstrip("-")
+            step &= Q(**{f"{prev_name}__isnull": True}) if prev_value is None else Q(**{prev_name: prev_value})
+        condition |= step
+    return condition
+
+
+def _nullable_fields(model, ordering):
+    nullable = set()
+    for field in ordering:
+        name = field.lstrip("-")
+        try:
+            if model._meta.get_field(name).null:
+                nullable.add(name)
+        except FieldDoesNotExist:
+            pass
+    return nullable
+
+
+def keyset_paginate(queryset, ordering, cursor=None, page_size=50):
+    """
+    Return (items, next_cursor) for one page of queryset ordered by `ordering`.
+    The last ordering field must be unique so the cursor is unambiguous.
+    Nullable model fields are ordered with NULLs last, so ascending orderings
+    still walk a plain (field, ...) index on PostgreSQL.
+    """
+    nullable = _nullable_fields(queryset.model, ordering)
+    queryset = queryset.order_by(*(
+        (F(field[1:]).desc(nulls_last=True) if field.startswith("-") else F(field).asc(nulls_last=True))
+        if field.lstrip("-") in nullable else field
+        for field in ordering
+    ))
+    values = decode_cursor(cursor, len(ordering))
+    if values is not None:
+        queryset = queryset.filter(keyset_filter(ordering, values, nullable))
+
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, field.lstrip("-")) for field in ordering)
+    return items, next_cursor
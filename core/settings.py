@@ -95,6 +95,9 @@ ROOT_URLCONF = 'core.urls'
 ENABLE_EVENTS = env.bool("ENABLE_EVENTS", default=False)
 ENABLE_TRAINING = env.bool("ENABLE_TRAINING", default=False)
 
+# Timeline entries older than this are moved to the archive table by the archive_timeline command
+TIMELINE_ARCHIVE_AFTER_DAYS = env.int("TIMELINE_ARCHIVE_AFTER_DAYS", default=365)
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
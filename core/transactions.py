@@ -0,0 +1,41 @@
+from django.db import transaction
+
+
+def get_commit_buffer(name, factory, using=None):
+    """
+    The buffer collecting work for the savepoint level that is open on the connection,
+    flushed by buffer.flush() when the transaction commits. Must be called in an atomic block.
+
+    There is one buffer per savepoint level and its flush is queued with on_commit inside
+    that savepoint, so rolling the savepoint back drops the callback and the buffered work
+    with it. The flush is only queued again when the buffer is empty or other callbacks were
+    queued after it, keeping the commit queue short however much is buffered. Buffers must
+    be falsy when empty. buffer.parent is the buffer of the enclosing level, if there is one.
+    """
+    connection = transaction.get_connection(using)
+    state = getattr(connection, name, None)
+    if state is None or state["queue"] is not connection.run_on_commit:
+        # Django replaces the queue on commit, rollback and savepoint rollback;
+        # keep only the buffers whose flush is still queued
+        queued = {getattr(callback, "__self__", None) for _, callback, _ in connection.run_on_commit}
+        buffers = state["buffers"] if state else {}
+        state = {
+            "queue": connection.run_on_commit,
+            "buffers": {sids: buffer for sids, buffer in buffers.items() if buffer in queued},
+        }
+        setattr(connection, name, state)
+
+    sids = tuple(connection.savepoint_ids)
+    buffer = state["buffers"].get(sids)
+    if buffer is None:
+        buffer = factory()
+        buffer.parent = next(
+            (state["buffers"][sids[:depth]] for depth in range(len(sids) - 1, -1, -1) if sids[:depth] in state["buffers"]),
+            None,
+        )
+        state["buffers"][sids] = buffer
+    queue = connection.run_on_commit
+    if not buffer or not queue or getattr(queue[-1][1], "__self__", None) is not buffer:
+        # The first flush to run writes everything; later ones find the buffer empty
+        transaction.on_commit(buffer.flush, using=using)
+    return buffer
@@ -25,6 +25,7 @@ urlpatterns = [
     path("orbat/", include("orbat.urls")),
     path("training/", include("training.urls")),
     path("events/", include("events.urls")),
+    path("timeline/", include("timeline.urls")),
     path("api/", include("apis.urls")),
     path("auth/", include("external_auth.urls")),
     path("", include("users.urls")),
@@ -1,49 +1,113 @@
 import datetime
 
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
 from attendance.models import Attendance
 from events.models import Event
 
 
+PRESENCE_JOIN = "join"
+PRESENCE_LEAVE = "leave"
+
+
+def _event_bounds(event):
+    return (
+        datetime.datetime.combine(event.date, event.start_time, tzinfo=datetime.timezone.utc),
+        datetime.datetime.combine(event.date, event.end_time, tzinfo=datetime.timezone.utc),
+    )
+
+
 class AttendanceManager(models.Manager):
     def mark_user_join(self, user, timestamp=None):
-        if timestamp is None:
-            timestamp = timezone.now()
-        today_events = Event.objects.filter(date=timestamp.date())
-        for event in today_events:
-            attendance, created = Attendance.objects.get_or_create(
-                event=event,
-                user=user,
-                defaults={"first_join": timestamp, "last_seen": timestamp}
-            )
-            if not created:
-                # Already present, maybe reconnecting mid-event
-                if timestamp < attendance.first_join:
-                    attendance.first_join = timestamp
-                if timestamp > attendance.last_seen:
-                    attendance.last_seen = timestamp
-                attendance.save()
+        return self.ingest_presence([(user, timestamp or timezone.now(), PRESENCE_JOIN)])
 
     def mark_user_leave(self, user, timestamp=None):
-        if timestamp is None:
-            timestamp = timezone.now()
-        today_events = Event.objects.filter(date=timestamp.date())
-        for event in today_events:
-            try:
-                attendance = Attendance.objects.get(event=event, user=user)
-            except Attendance.DoesNotExist:
-                continue
-
-            if timestamp < datetime.datetime.combine(event.date, event.start_time, tzinfo=timezone.utc):
-                # Left before event started
-                attendance.delete()
-            else:
-                attendance.last_seen = timestamp
-                if timestamp < datetime.datetime.combine(event.date, event.end_time, tzinfo=timezone.utc):
-                    attendance.left_early = True
-                attendance.save()
+        return self.ingest_presence([(user, timestamp or timezone.now(), PRESENCE_LEAVE)])
+
+    def ingest_presence(self, presence_events):
+        """
+        Apply a batch of (user, timestamp, PRESENCE_JOIN|PRESENCE_LEAVE) events to the attendance
+        of every event held on each timestamp's day.
+        The batch is replayed in memory in timestamp order: joins widen first_join/last_seen,
+        leaves move last_seen (flagging left_early before the end) and drop entries left
+        before the event started. Events and existing entries are read in one query each and
+        the result is written with one upsert on (event, user) plus one delete, all in one
+        transaction holding a lock on the events, so concurrent batches merge rather than race.
+        Returns {"upserted": n, "deleted": n}.
+        """
+        presence_events = sorted(presence_events, key=lambda presence: presence[1])
+        if not presence_events:
+            return {"upserted": 0, "deleted": 0}
+
+        with transaction.atomic():
+            events_by_date = {}
+            # Locking the events serialises batches for the same event, so one can't overwrite the
+            # min/max merge of another with values it read before that one committed
+            locked_events = Event.objects.select_for_update().filter(
+                date__in={timestamp.date() for _, timestamp, _ in presence_events},
+            ).order_by("id")
+            for event in locked_events:
+                events_by_date.setdefault(event.date, []).append(event)
+            if not events_by_date:
+                return {"upserted": 0, "deleted": 0}
+
+            users = {user.pk: user for user, _, _ in presence_events}
+            existing = {
+                (attendance.event_id, attendance.user_id): attendance
+                for attendance in Attendance.objects.select_for_update().filter(
+                    event__in=[event for events in events_by_date.values() for event in events],
+                    user_id__in=list(users),
+                )
+            }
+
+            current = dict(existing)
+            changed = set()
+            for user, timestamp, action in presence_events:
+                for event in events_by_date.get(timestamp.date(), ()):
+                    key = (event.id, user.pk)
+                    attendance = current.get(key)
+                    if action == PRESENCE_JOIN:
+                        if attendance is None:
+                            attendance = Attendance(event=event, user=user, first_join=timestamp, last_seen=timestamp)
+                            current[key] = attendance
+                        else:
+                            # Already present, maybe reconnecting mid-event
+                            attendance.first_join = min(filter(None, (attendance.first_join, timestamp)))
+                            attendance.last_seen = max(filter(None, (attendance.last_seen, timestamp)))
+                        changed.add(key)
+                    elif action == PRESENCE_LEAVE and attendance is not None:
+                        start, end = _event_bounds(event)
+                        if timestamp < start:
+                            # Left before event started
+                            del current[key]
+                            changed.discard(key)
+                        else:
+                            attendance.last_seen = max(filter(None, (attendance.last_seen, timestamp)))
+                            if timestamp < end:
+                                attendance.left_early = True
+                            changed.add(key)
+
+            deleted = [attendance.id for key, attendance in existing.items() if key not in current]
+            if deleted:
+                Attendance.objects.filter(id__in=deleted).delete()
+            # Fresh instances so existing rows are matched on (event, user) rather than inserted by id
+            Attendance.objects.bulk_create(
+                [
+                    Attendance(
+                        event_id=event_id,
+                        user_id=user_id,
+                        first_join=current[event_id, user_id].first_join,
+                        last_seen=current[event_id, user_id].last_seen,
+                        left_early=current[event_id, user_id].left_early,
+                    )
+                    for event_id, user_id in changed
+                ],
+                update_conflicts=True,
+                unique_fields=["event", "user"],
+                update_fields=["first_join", "last_seen", "left_early"],
+            )
+        return {"upserted": len(changed), "deleted": len(deleted)}
 
     def mark_manual_attendance(self, user, event, first_join=None, last_seen=None):
         """
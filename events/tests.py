@@ -1,3 +1,49 @@
+import datetime
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
 
-# Create your tests here.
+from attendance.models import Attendance
+from events.managers import AttendanceManager, PRESENCE_JOIN, PRESENCE_LEAVE
+from events.models import Event
+
+
+class PresenceIngestionTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.day = datetime.date(2025, 6, 1)
+        self.event = Event.objects.create(
+            name="Operation", date=self.day, start_time=datetime.time(19), end_time=datetime.time(22), type="OP",
+        )
+        self.users = [User.objects.create(username=f"player_{i}", display_name=f"Player {i}") for i in range(3)]
+        self.manager = AttendanceManager()
+        self.manager.model = Attendance
+
+    def at(self, hour, minute=0):
+        return datetime.datetime.combine(self.day, datetime.time(hour, minute), tzinfo=datetime.timezone.utc)
+
+    def test_batch_is_replayed_and_upserted_in_constant_queries(self):
+        self.manager.mark_user_join(self.users[0], self.at(19, 30))
+        early, stayer, dropout = self.users
+        batch = [
+            (stayer, self.at(19, 5), PRESENCE_JOIN),
+            (stayer, self.at(20), PRESENCE_LEAVE),
+            (stayer, self.at(20, 10), PRESENCE_JOIN),
+            (stayer, self.at(22, 5), PRESENCE_LEAVE),
+            (early, self.at(18, 50), PRESENCE_JOIN),
+            (early, self.at(21), PRESENCE_LEAVE),
+            (dropout, self.at(18), PRESENCE_JOIN),
+            (dropout, self.at(18, 30), PRESENCE_LEAVE),
+        ] * 20
+        # Savepoint, locked events, locked existing entries, upsert, release
+        with self.assertNumQueries(5):
+            result = self.manager.ingest_presence(batch)
+
+        self.assertEqual(result, {"upserted": 2, "deleted": 0})
+        rows = {row.user_id: row for row in Attendance.objects.filter(event=self.event)}
+        self.assertEqual(set(rows), {early.id, stayer.id})
+        self.assertEqual((rows[early.id].first_join, rows[early.id].last_seen, rows[early.id].left_early),
+                         (self.at(18, 50), self.at(21), True))
+        self.assertEqual((rows[stayer.id].first_join, rows[stayer.id].last_seen), (self.at(19, 5), self.at(22, 5)))
+        # The stayer's mid-event disconnect still counts as leaving early
+        self.assertTrue(rows[stayer.id].left_early)
@@ -1,12 +1,14 @@
 from django.contrib import admin, messages
 from django.contrib.admin import SimpleListFilter
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 from django.forms import ModelForm, ModelChoiceField, Form
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import path, reverse
 from django.utils.html import format_html
 
 from orbat.models import *
+from orbat.role_catalogue import validate_slot_roles
 from core.mixins.admin_mixin import OrderedModelAdminMixin, OrderedAdminMixin
 
 
@@ -97,10 +99,34 @@ class SectionSlotInline(OrderedModelAdminMixin, admin.TabularInline):
     extra = 0
     can_delete = False
 
-#TODO Add RoleSlotAssignmentInlineForm to limit selection of section slots. Only one rank etc
+class RoleSlotAssignmentForm(ModelForm):
+    """Checks the slot's resulting role set against the role catalogue (one rank, incompatibilities, limits)."""
+    class Meta:
+        model = RoleSlotAssignment
+        fields = "__all__"
+
+    def clean(self):
+        cleaned_data = super().clean()
+        role = cleaned_data.get("role") or getattr(self.instance, "role", None)
+        slot = cleaned_data.get("section_slot")
+        if not role or not slot or cleaned_data.get("end_date"):
+            return cleaned_data
+
+        held = set(
+            RoleSlotAssignment.objects
+            .filter(section_slot=slot, end_date__isnull=True)
+            .exclude(pk=self.instance.pk)
+            .values_list("role_id", flat=True)
+        )
+        try:
+            validate_slot_roles(slot.section_id, held | {role.id}, slot_id=slot.id)
+        except ValidationError as e:
+            raise ValidationError(e.messages)
+        return cleaned_data
 
 class RoleSlotAssignementInline(admin.TabularInline):
     model = RoleSlotAssignment
+    form = RoleSlotAssignmentForm
     fields = ['section_slot']
     extra = 0
     can_delete = False
@@ -219,6 +245,7 @@ class SectionSlotAdmin(OrderedAdminMixin, admin.ModelAdmin):
 
 @admin.register(RoleSlotAssignment)
 class RoleSlotAssignmentAdmin(admin.ModelAdmin):
+    form = RoleSlotAssignmentForm
     list_display = ("display_name", "role", "section_slot", "start_date", "end_date",)
 
     def display_name(self, obj):
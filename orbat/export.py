@@ -0,0 +1,144 @@
+import json
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from core.cache import get_cache_version, versioned_key
+from orbat.models import Platoon, Section, SectionSlot, RoleSlotAssignment, SectionAssignment
+
+
+ORBAT_NAMESPACE = "orbat"
+EXPORT_FORMATS = ("json", "dot")
+
+
+def build_orbat_graph():
+    """
+    The whole unit structure as one document:
+    Platoon -> Section -> SectionSlot -> roles/member, plus each section's members.
+    Always five queries, however large the ORBAT is.
+    """
+    slots_by_section = {}
+    slots_by_id = {}
+    for slot in SectionSlot.objects.select_related("user").order_by("section_id", "order"):
+        slot_data = {
+            "id": slot.id,
+            "name": slot.name,
+            "colour": slot.colour,
+            "order": slot.order,
+            "member": {"id": str(slot.user.id), "name": slot.user.get_ranked_name()} if slot.user else None,
+            "roles": [],
+        }
+        slots_by_id[slot.id] = slot_data
+        slots_by_section.setdefault(slot.section_id, []).append(slot_data)
+
+    role_assignments = RoleSlotAssignment.objects.filter(end_date__isnull=True).select_related("role")
+    for assignment in role_assignments.order_by("section_slot_id", "role_id"):
+        slot_data = slots_by_id.get(assignment.section_slot_id)
+        if slot_data is not None:
+            slot_data["roles"].append({
+                "id": assignment.role.id,
+                "name": assignment.role.name,
+                "shorthand": assignment.role.shorthand,
+                "is_rank": assignment.role.is_rank,
+            })
+
+    members_by_section = {}
+    slotted = set()
+    for section_id, slots in slots_by_section.items():
+        slotted.update((section_id, slot["member"]["id"]) for slot in slots if slot["member"])
+    assignments = SectionAssignment.objects.filter(end_date__isnull=True).select_related("user")
+    for assignment in assignments.order_by("section_id", "user__display_name"):
+        user_id = str(assignment.user_id)
+        members_by_section.setdefault(assignment.section_id, []).append({
+            "id": user_id,
+            "name": assignment.user.get_ranked_name(),
+            "is_slotted": (assignment.section_id, user_id) in slotted,
+        })
+
+    sections_by_platoon = {}
+    for section in Section.objects.order_by("platoon_id", "order"):
+        sections_by_platoon.setdefault(section.platoon_id, []).append({
+            "id": section.id,
+            "name": section.name,
+            "shorthand": section.shorthand,
+            "type": section.type,
+            "max_size": section.max_size,
+            "leader": str(section.leader_id) if section.leader_id else None,
+            "slots": slots_by_section.get(section.id, []),
+            "members": members_by_section.get(section.id, []),
+        })
+
+    platoons = [
+        {
+            "id": platoon.id,
+            "name": platoon.name,
+            "description": platoon.description,
+            "sections": sections_by_platoon.get(platoon.id, []),
+        }
+        for platoon in Platoon.objects.order_by("order")
+    ]
+
+    return {
+        "version": get_cache_version(ORBAT_NAMESPACE),
+        "generated_at": timezone.now().isoformat(),
+        "platoons": platoons,
+        "unassigned_sections": sections_by_platoon.get(None, []),
+    }
+
+
+def _dot_quote(value):
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+
+def graph_to_dot(graph):
+    """Render the ORBAT graph as a Graphviz digraph."""
+    lines = [
+        "digraph orbat {",
+        "  rankdir=TB;",
+        "  node [shape=box, fontname=\"Helvetica\"];",
+        f"  unit [label={_dot_quote('Unit')}, shape=doubleoctagon];",
+    ]
+
+    def add_section(parent, section):
+        section_node = f"section_{section['id']}"
+        lines.append(f"  {section_node} [label={_dot_quote(section['name'])}, shape=folder];")
+        lines.append(f"  {parent} -> {section_node};")
+        for slot in section["slots"]:
+            slot_node = f"slot_{slot['id']}"
+            label_parts = [slot["name"]]
+            if slot["roles"]:
+                label_parts.append(", ".join(role["shorthand"] for role in slot["roles"]))
+            label_parts.append(slot["member"]["name"] if slot["member"] else "(vacant)")
+            lines.append(f"  {slot_node} [label={_dot_quote(chr(10).join(label_parts))}];")
+            lines.append(f"  {section_node} -> {slot_node};")
+
+    for platoon in graph["platoons"]:
+        platoon_node = f"platoon_{platoon['id']}"
+        lines.append(f"  {platoon_node} [label={_dot_quote(platoon['name'])}, shape=tab];")
+        lines.append(f"  unit -> {platoon_node};")
+        for section in platoon["sections"]:
+            add_section(platoon_node, section)
+    for section in graph["unassigned_sections"]:
+        add_section("unit", section)
+
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def get_orbat_export(export_format="json"):
+    """
+    Return (etag, content) for the serialized ORBAT graph.
+    The rendered document is cached until the ORBAT version changes.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    version = get_cache_version(ORBAT_NAMESPACE)
+    etag = f'"orbat-{version}-{export_format}"'
+    key = versioned_key(ORBAT_NAMESPACE, "graph", export_format)
+    content = cache.get(key)
+    if content is None:
+        graph = build_orbat_graph()
+        content = graph_to_dot(graph) if export_format == "dot" else json.dumps(graph)
+        cache.set(key, content, timeout=None)
+    return etag, content
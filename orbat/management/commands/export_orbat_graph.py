@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from orbat.export import EXPORT_FORMATS, get_orbat_export
+
+
+class Command(BaseCommand):
+    help = "Export the whole ORBAT (platoons, sections, slots, roles and members) as JSON or Graphviz DOT."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default="json")
+        parser.add_argument("--output", help="File to write to. Defaults to stdout.")
+
+    def handle(self, *args, **options):
+        _etag, content = get_orbat_export(options["format"])
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as handle:
+                handle.write(content)
+            self.stdout.write(self.style.SUCCESS(f"ORBAT written to {options['output']}"))
+        else:
+            self.stdout.write(content, ending="")
@@ -95,6 +95,12 @@ class BaseHistoryModel(models.Model):
 class HistorySectionAssignment(BaseHistoryModel):
     section = models.ForeignKey(Section, on_delete=models.CASCADE)
 
+    class Meta(BaseHistoryModel.Meta):
+        indexes = [
+            models.Index(fields=["section", "start_date"], name="hist_section_start_idx"),
+            models.Index(fields=["section", "end_date"], name="hist_section_end_idx"),
+        ]
+
 class HistoryRoleAssignment(BaseHistoryModel):
     role = models.ForeignKey(Role, on_delete=models.SET_NULL, null=True)
     role_name_at_assignment = models.CharField(max_length=50, blank=True)
@@ -102,6 +108,11 @@ class HistoryRoleAssignment(BaseHistoryModel):
 
     non_overlapping_fields = ["role"]  # ensures same role does not overlap
 
+    class Meta(BaseHistoryModel.Meta):
+        indexes = [
+            models.Index(fields=["section", "user", "start_date"], name="hist_role_section_user_idx"),
+        ]
+
 class HistoryUsername(BaseHistoryModel):
     username = models.CharField(max_length=50)
 
@@ -131,7 +142,7 @@ def get_display_name_on_date(user, date):
         .first()
     )
 
-    display_name = name_record.display_name if name_record else user.display_name
+    display_name = name_record.username if name_record else user.display_name
 
     section = get_section_on_date(user, date.date())
     section_shorthand = getattr(section, "shorthand", None)
@@ -0,0 +1,191 @@
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+
+from core.cache import get_cache_version, bump_cache_version, versioned_key
+from orbat.models import Role, RoleSlotAssignment
+
+
+CATALOGUE_NAMESPACE = "role_catalogue"
+
+# Per-process copy so a request doesn't unpickle the catalogue from the cache backend every time
+_local_catalogue = {"version": None, "catalogue": None}
+
+
+def iter_bits(mask):
+    """Yield the index of every set bit in mask."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class RoleCatalogue:
+    """
+    The role catalogue compiled into integer bitsets.
+    Each role gets a bit, so a slot's role set is a single int and
+    incompatibility/section/rank checks are a handful of bitwise operations.
+    """
+
+    def __init__(self, roles, incompatible_pairs, allowed_pairs):
+        self.role_ids = [role["id"] for role in roles]
+        self.bit = {role_id: index for index, role_id in enumerate(self.role_ids)}
+        self.names = {role["id"]: role["name"] for role in roles}
+
+        self.rank_mask = 0
+        self.max_per_section = {}
+        for role in roles:
+            if role["is_rank"]:
+                self.rank_mask |= 1 << self.bit[role["id"]]
+            if role["max_per_section"] is not None:
+                self.max_per_section[role["id"]] = role["max_per_section"]
+
+        self.incompatible = [0] * len(self.role_ids)
+        for role_id, other_id in incompatible_pairs:
+            self.incompatible[self.bit[role_id]] |= 1 << self.bit[other_id]
+            self.incompatible[self.bit[other_id]] |= 1 << self.bit[role_id]
+
+        # Roles without allowed_sections may be used anywhere
+        restricted = 0
+        self.section_masks = {}
+        for role_id, section_id in allowed_pairs:
+            role_bit = 1 << self.bit[role_id]
+            restricted |= role_bit
+            self.section_masks[section_id] = self.section_masks.get(section_id, 0) | role_bit
+        self.unrestricted_mask = ((1 << len(self.role_ids)) - 1) & ~restricted
+
+    @classmethod
+    def build(cls):
+        roles = list(Role.objects.order_by("id").values("id", "name", "is_rank", "max_per_section"))
+        incompatible_pairs = Role.incompatible_roles.through.objects.values_list("from_role_id", "to_role_id")
+        allowed_pairs = Role.allowed_sections.through.objects.values_list("role_id", "section_id")
+        return cls(roles, list(incompatible_pairs), list(allowed_pairs))
+
+    # --- Conversions ---
+    def mask(self, role_ids):
+        result = 0
+        for role_id in role_ids:
+            if role_id in self.bit:
+                result |= 1 << self.bit[role_id]
+        return result
+
+    def ids(self, mask):
+        return [self.role_ids[index] for index in iter_bits(mask)]
+
+    # --- Queries ---
+    def allowed_mask(self, section_id):
+        """Roles that may be used in the given section."""
+        return self.unrestricted_mask | self.section_masks.get(section_id, 0)
+
+    def conflicts_mask(self, mask):
+        """Roles that are incompatible with any role in mask."""
+        result = 0
+        for index in iter_bits(mask):
+            result |= self.incompatible[index]
+        return result
+
+    def capacity_mask(self, role_counts, exclude_mask=0):
+        """
+        Roles that have reached max_per_section given {role_id: active count}.
+        The limit applies to every role that sets one, rank or not, so a section with a
+        one-medic limit can't have a second slot take Medic.
+        Roles in exclude_mask (already held by the slot being edited) are never at capacity for it.
+        """
+        result = 0
+        for role_id, max_count in self.max_per_section.items():
+            if role_counts.get(role_id, 0) >= max_count:
+                result |= 1 << self.bit[role_id]
+        return result & ~exclude_mask
+
+    def available_mask(self, section_id, slot_role_ids=(), role_counts=None):
+        """Roles that could still be added to a slot holding slot_role_ids."""
+        slot_mask = self.mask(slot_role_ids)
+        available = self.allowed_mask(section_id) & ~slot_mask
+        available &= ~self.conflicts_mask(slot_mask)
+        available &= ~self.capacity_mask(role_counts or {}, exclude_mask=slot_mask)
+        if slot_mask & self.rank_mask:
+            available &= ~self.rank_mask
+        return available
+
+    def suggest(self, section_id, slot_role_ids=(), role_counts=None):
+        return self.ids(self.available_mask(section_id, slot_role_ids, role_counts))
+
+    def validate(self, section_id, role_ids, role_counts=None, current_role_ids=()):
+        """
+        Validate a complete role set for a slot in a section.
+        role_counts are the active assignments per role across the section and
+        current_role_ids the roles the slot already holds (those don't count against capacity).
+        Raises ValidationError listing every problem found.
+        """
+        unknown = [role_id for role_id in role_ids if role_id not in self.bit]
+        mask = self.mask(role_ids)
+        errors = [f"Unknown role {role_id}." for role_id in unknown]
+
+        for role_id in self.ids(mask & ~self.allowed_mask(section_id)):
+            errors.append(f"{self.names[role_id]} is not allowed in this section.")
+
+        clashing = mask & self.conflicts_mask(mask)
+        if clashing:
+            names = ", ".join(self.names[role_id] for role_id in self.ids(clashing))
+            errors.append(f"Incompatible roles selected: {names}.")
+
+        if (mask & self.rank_mask).bit_count() > 1:
+            errors.append("A slot can only hold one rank.")
+
+        full = mask & self.capacity_mask(role_counts or {}, exclude_mask=self.mask(current_role_ids))
+        for role_id in self.ids(full):
+            errors.append(f"{self.names[role_id]} has reached its limit for this section.")
+
+        if errors:
+            raise ValidationError(errors)
+
+
+def get_section_role_state(section_id):
+    """
+    Active role assignments in a section, in one query.
+    Returns ({role_id: count}, {slot_id: {role_id, ...}}).
+    """
+    role_counts = {}
+    slot_roles = {}
+    assignments = RoleSlotAssignment.objects.filter(
+        section_slot__section_id=section_id,
+        end_date__isnull=True,
+    ).values_list("section_slot_id", "role_id")
+    for slot_id, role_id in assignments:
+        role_counts[role_id] = role_counts.get(role_id, 0) + 1
+        slot_roles.setdefault(slot_id, set()).add(role_id)
+    return role_counts, slot_roles
+
+
+def validate_slot_roles(section_id, role_ids, slot_id=None):
+    """
+    Validate the full set of roles a slot should hold.
+    Shared by the slot API, the admin and model forms. Raises ValidationError.
+    """
+    role_counts, slot_roles = get_section_role_state(section_id)
+    get_role_catalogue().validate(
+        section_id,
+        role_ids,
+        role_counts=role_counts,
+        current_role_ids=slot_roles.get(slot_id, ()),
+    )
+
+
+def get_role_catalogue():
+    """Return the compiled catalogue for the current catalogue version."""
+    version = get_cache_version(CATALOGUE_NAMESPACE)
+    if _local_catalogue["version"] == version:
+        return _local_catalogue["catalogue"]
+
+    key = versioned_key(CATALOGUE_NAMESPACE, "compiled")
+    catalogue = cache.get(key)
+    if catalogue is None:
+        catalogue = RoleCatalogue.build()
+        cache.set(key, catalogue, timeout=None)
+
+    _local_catalogue["version"] = version
+    _local_catalogue["catalogue"] = catalogue
+    return catalogue
+
+
+def invalidate_role_catalogue():
+    bump_cache_version(CATALOGUE_NAMESPACE)
@@ -1,9 +1,16 @@
 from django.db.models import Q
-from django.db.models.signals import post_save, post_delete, pre_save
+from django.db.models.signals import post_save, post_delete, pre_save, m2m_changed
 from django.dispatch import receiver
 from django.utils import timezone
 
-from orbat.models import SectionAssignment, SectionSlot, RoleSlotAssignment
+from core.cache import bump_cache_version
+from orbat.export import ORBAT_NAMESPACE
+from orbat.models import SectionAssignment, SectionSlot, RoleSlotAssignment, Role, Section, Platoon, \
+    HistorySectionAssignment, HistoryRoleAssignment
+from orbat.role_catalogue import invalidate_role_catalogue
+from orbat.utils import HISTORY_NAMESPACE
+from timeline.models import TimelineTypes
+from timeline.writer import record_entry
 from users.models import UserStatus, CustomUser
 
 
@@ -38,19 +45,60 @@ def update_user_section_fields(user: CustomUser):
     user.save(update_fields=["rank", "section_name"])
 
 def cache_old_user(instance):
+    instance._was_active = False
     if instance.pk:
         Model = type(instance)
         try:
             old_instance = Model.objects.get(pk=instance.pk)
             instance._old_user = old_instance.user if old_instance else None
+            instance._was_active = getattr(old_instance, "end_date", None) is None
         except Model.DoesNotExist:
             instance._old_user = None
     else:
         instance._old_user = None
 
 
+def _was_active_for(user, obj):
+    """Whether obj already applied to user before this change."""
+    if getattr(obj, "_deleted", False):
+        return obj.end_date is None
+    return getattr(obj, "_old_user", None) == user and getattr(obj, "_was_active", False)
+
+
 def log_assignment_change(user, action, source, obj):
-    pass
+    """
+    Turn an assignment change into timeline entries.
+    Entries are queued on the transaction's timeline writer, so repeated signals for
+    the same change are written once, together, when the transaction commits.
+    """
+    deleted = getattr(obj, "_deleted", False)
+
+    if source == "SectionAssignment":
+        was_active = _was_active_for(user, obj) if action == "added" else getattr(obj, "_was_active", False)
+        is_active = action == "added" and not deleted and obj.end_date is None
+        if is_active and not was_active:
+            record_entry(TimelineTypes.SECTION_JOINED, user, section=obj.section,
+                         timestamp=obj.start_date, related_object=obj)
+        elif was_active and not is_active:
+            record_entry(TimelineTypes.SECTION_LEFT, user, section=obj.section,
+                         timestamp=obj.end_date, related_object=obj)
+
+    elif action == "added" and not deleted:
+        # A role is assigned when an active role is added to a slot or a member takes over a slot
+        role_assignments = []
+        if source == "RoleSlotAssignment":
+            section = obj.section_slot.section
+            if obj.end_date is None and not _was_active_for(user, obj):
+                role_assignments = [obj]
+        elif source == "SectionSlot" and getattr(obj, "_old_user", None) != user:
+            section = obj.section
+            role_assignments = RoleSlotAssignment.objects.filter(
+                section_slot=obj, end_date__isnull=True,
+            ).select_related("role")
+
+        for assignment in role_assignments:
+            record_entry(TimelineTypes.ROLE_ASSIGNED, user, section=section,
+                         description=assignment.role.name, related_object=assignment)
 
 
 def handle_user_update(instance, source=None, new_user=None):
@@ -73,7 +121,8 @@ def cache_old_user_section_assignment(sender, instance, **kwargs):
     cache_old_user(instance)
 
 @receiver([post_save, post_delete], sender=SectionAssignment)
-def update_user_on_section_assignment(sender, instance, **kwargs):
+def update_user_on_section_assignment(sender, instance, signal, **kwargs):
+    instance._deleted = signal is post_delete
     handle_user_update(instance, source="SectionAssignment")
 
 # --- SectionSlot ---
@@ -83,22 +132,85 @@ def cache_old_user_section_slot(sender, instance, **kwargs):
     cache_old_user(instance)
 
 @receiver([post_save, post_delete], sender=SectionSlot)
-def update_user_on_section_slot_change(sender, instance, **kwargs):
+def update_user_on_section_slot_change(sender, instance, signal, **kwargs):
+    instance._deleted = signal is post_delete
     handle_user_update(instance, source="SectionSlot")
 
 # --- RoleSlotAssignment ---
 
 @receiver(pre_save, sender=RoleSlotAssignment)
 def cache_old_user_on_role_slot(sender, instance, **kwargs):
+    instance._was_active = False
     if instance.pk:  # existing row
         try:
             old_instance = RoleSlotAssignment.objects.get(pk=instance.pk)
             instance._old_user = old_instance.section_slot.user if old_instance.section_slot else None
+            instance._was_active = old_instance.end_date is None
         except RoleSlotAssignment.DoesNotExist:
             instance._old_user = None
 
 @receiver([post_save, post_delete], sender=RoleSlotAssignment)
-def update_user_on_role_slot(sender, instance, **kwargs):
+def update_user_on_role_slot(sender, instance, signal, **kwargs):
+    instance._deleted = signal is post_delete
     section_slot = instance.section_slot
     new_user = section_slot.user if section_slot and section_slot.user else None
     handle_user_update(instance, source="RoleSlotAssignment", new_user=new_user)
+
+# --- Unit membership ---
+
+@receiver(pre_save, sender=CustomUser)
+def cache_old_user_status(sender, instance, update_fields=None, **kwargs):
+    instance._old_status = None
+    if update_fields is not None and "status" not in update_fields:
+        instance._old_status = instance.status
+    elif not instance._state.adding:
+        instance._old_status = CustomUser.objects.filter(pk=instance.pk).values_list("status", flat=True).first()
+
+@receiver(post_save, sender=CustomUser)
+def log_unit_membership_change(sender, instance, created, **kwargs):
+    old_status = getattr(instance, "_old_status", None)
+    if old_status == instance.status:
+        return
+    if instance.status == UserStatus.RETIRED:
+        if not created:
+            record_entry(TimelineTypes.UNIT_LEFT, instance)
+    elif created or old_status == UserStatus.RETIRED:
+        record_entry(TimelineTypes.UNIT_JOINED, instance, timestamp=instance.date_joined if created else None)
+
+# --- Role catalogue ---
+
+@receiver([post_save, post_delete], sender=Role)
+@receiver(post_delete, sender=Section)
+def invalidate_catalogue_on_role_change(sender, instance, **kwargs):
+    invalidate_role_catalogue()
+
+@receiver(m2m_changed, sender=Role.incompatible_roles.through)
+@receiver(m2m_changed, sender=Role.allowed_sections.through)
+def invalidate_catalogue_on_role_relation_change(sender, instance, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        invalidate_role_catalogue()
+
+# --- History ---
+
+@receiver([post_save, post_delete], sender=HistorySectionAssignment)
+@receiver([post_save, post_delete], sender=HistoryRoleAssignment)
+def invalidate_history_summaries(sender, instance, **kwargs):
+    bump_cache_version(HISTORY_NAMESPACE)
+
+# --- ORBAT export ---
+
+@receiver([post_save, post_delete], sender=Platoon)
+@receiver([post_save, post_delete], sender=Section)
+@receiver([post_save, post_delete], sender=SectionSlot)
+@receiver([post_save, post_delete], sender=RoleSlotAssignment)
+@receiver([post_save, post_delete], sender=SectionAssignment)
+@receiver([post_save, post_delete], sender=Role)
+def invalidate_orbat_export(sender, instance, **kwargs):
+    bump_cache_version(ORBAT_NAMESPACE)
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_orbat_export_on_user_change(sender, instance, update_fields=None, **kwargs):
+    # Logins touch last_login only, which isn't part of the export
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    bump_cache_version(ORBAT_NAMESPACE)
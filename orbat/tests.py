@@ -1,3 +1,298 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 from django.test import TestCase
+from django.urls import reverse
+
+from apis.views import SectionSlotAPI
+from orbat.models import Section, Role, SectionSlot, RoleSlotAssignment, SectionAssignment
+from orbat.models.history import HistoryRoleAssignment, HistorySectionAssignment
+from orbat.role_catalogue import get_role_catalogue, validate_slot_roles
+from orbat.utils import get_section_history_page, get_section_history_summary
+from orbat.views import ORBATMemberView
+from timeline.models import TimelineEntry, TimelineTypes
+from users.models import UserStatus
+
+
+class MemberListTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        for i in range(5):
+            User.objects.create(username=f"active_{i}", display_name=f"Active {i}", section_name="Alpha")
+        User.objects.create(username="reserve", display_name="Reserve", status=UserStatus.RESERVES)
+
+    def test_keyset_pages_cover_every_member_once(self):
+        url = reverse("orbat_members")
+        query = "sort=name"
+        seen = []
+        ORBATMemberView.page_size = 2
+        try:
+            while query:
+                response = self.client.get(f"{url}?{query}", HTTP_HX_REQUEST="true")
+                seen.extend(member.display_name for member in response.context["members"])
+                query = response.context["next_page_query"]
+        finally:
+            ORBATMemberView.page_size = 50
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(len(seen), 6)
+
+    def test_rank_and_section_pages_put_members_without_one_last(self):
+        User = get_user_model()
+        User.objects.filter(display_name__in=["Active 1", "Active 3"]).update(rank="CPL")
+        User.objects.filter(display_name="Active 4").update(rank="")
+        User.objects.create(username="bravo", display_name="Bravo", section_name="Bravo")
+        User.objects.filter(display_name="Active 0").update(rank=None)
+
+        url = reverse("orbat_members")
+        ORBATMemberView.page_size = 2
+        try:
+            for sort, expected in (
+                ("rank", ["Active 4", "Active 1", "Active 3", "Active 2", "Bravo", "Reserve", "Active 0"]),
+                ("section", ["Active 0", "Active 1", "Active 2", "Active 3", "Active 4", "Bravo", "Reserve"]),
+            ):
+                query, seen = f"sort={sort}", []
+                while query:
+                    response = self.client.get(f"{url}?{query}", HTTP_HX_REQUEST="true")
+                    seen.extend(member.display_name for member in response.context["members"])
+                    query = response.context["next_page_query"]
+                self.assertEqual(seen, expected, sort)
+        finally:
+            ORBATMemberView.page_size = 50
+
+    def test_filters_and_facets(self):
+        response = self.client.get(reverse("orbat_members"), {"section": "Alpha"})
+        self.assertEqual(len(response.context["members"]), 5)
+        self.assertEqual(response.context["member_total"], 5)
+        self.assertIn((UserStatus.ACTIVE.value, "Active", 5), response.context["status_facets"])
+
+
+class RoleCatalogueTests(TestCase):
+    def setUp(self):
+        self.alpha = Section.objects.create(name="Alpha", shorthand="A", type="infantry", max_size=8)
+        self.bravo = Section.objects.create(name="Bravo", shorthand="B", type="infantry", max_size=8)
+        self.pvt = Role.objects.create(name="Private", shorthand="PVT", is_rank=True)
+        self.cpl = Role.objects.create(name="Corporal", shorthand="CPL", is_rank=True, max_per_section=1)
+        self.medic = Role.objects.create(name="Medic", shorthand="MED")
+        self.at = Role.objects.create(name="Anti-Tank", shorthand="AT")
+        self.at.incompatible_roles.add(self.medic)
+        self.medic.allowed_sections.add(self.alpha)
+
+    def test_catalogue_is_rebuilt_after_role_changes(self):
+        catalogue = get_role_catalogue()
+        self.assertIn(self.medic.id, catalogue.ids(catalogue.conflicts_mask(catalogue.mask([self.at.id]))))
+        self.at.incompatible_roles.remove(self.medic)
+        catalogue = get_role_catalogue()
+        self.assertEqual(catalogue.conflicts_mask(catalogue.mask([self.at.id])), 0)
+
+    def test_validate_reports_each_rule(self):
+        catalogue = get_role_catalogue()
+        with self.assertRaises(ValidationError) as ctx:
+            catalogue.validate(self.bravo.id, [self.pvt.id, self.cpl.id, self.medic.id, self.at.id])
+        messages = " ".join(ctx.exception.messages)
+        self.assertIn("Medic is not allowed", messages)
+        self.assertIn("Incompatible roles", messages)
+        self.assertIn("only hold one rank", messages)
+
+        catalogue.validate(self.alpha.id, [self.cpl.id, self.medic.id])
+
+    def test_capacity_ignores_roles_already_held_by_the_slot(self):
+        slot = SectionSlot.objects.create(name="1IC", section=self.alpha)
+        RoleSlotAssignment.objects.create(section_slot=slot, role=self.cpl)
+        validate_slot_roles(self.alpha.id, [self.cpl.id], slot_id=slot.id)
+
+        other = SectionSlot.objects.create(name="Rifleman", section=self.alpha)
+        with self.assertRaises(ValidationError):
+            validate_slot_roles(self.alpha.id, [self.cpl.id], slot_id=other.id)
+
+        suggested = get_role_catalogue().suggest(self.alpha.id, [self.pvt.id], {self.cpl.id: 1})
+        self.assertEqual(set(suggested), {self.medic.id, self.at.id})
+
+    def test_non_rank_roles_are_held_to_max_per_section(self):
+        self.medic.max_per_section = 1
+        self.medic.save()
+        medic_slot = SectionSlot.objects.create(name="Medic", section=self.alpha)
+        RoleSlotAssignment.objects.create(section_slot=medic_slot, role=self.medic)
+        other = SectionSlot.objects.create(name="Rifleman", section=self.alpha)
+        self.client.force_login(get_user_model().objects.create(username="staff", display_name="Staff", is_staff=True))
+
+        url = f"/api/orbat/section/{self.alpha.id}/slot/{other.id}/"
+        response = self.client.put(url, {"roles": [self.medic.id]}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Medic has reached its limit", response.json()["roles"][0])
+
+        options = self.client.get(f"/api/orbat/section/{self.alpha.id}/role_options/?slot_id={other.id}").json()
+        self.assertTrue(next(option for option in options if option["id"] == self.medic.id)["is_capacity"])
+        options = self.client.get(f"/api/orbat/section/{self.alpha.id}/role_options/?slot_id={medic_slot.id}").json()
+        self.assertFalse(next(option for option in options if option["id"] == self.medic.id)["is_capacity"])
+
+    def test_slot_api_rejects_role_ids_that_are_not_integers(self):
+        slot = SectionSlot.objects.create(name="Rifleman", section=self.alpha)
+        self.client.force_login(get_user_model().objects.create(username="staff", display_name="Staff", is_staff=True))
+
+        url = f"/api/orbat/section/{self.alpha.id}/slot/{slot.id}/"
+        for payload in ({"roles": ["medic"]}, {"rank": "cpl"}, {"rank": {"id": "x"}}, {"roles": 5}):
+            response = self.client.put(url, payload, content_type="application/json")
+            self.assertEqual(response.status_code, 400, payload)
+        response = self.client.post(f"/api/orbat/section/{self.alpha.id}/slot/", {"name": "New", "roles": ["x"]},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(SectionSlot.objects.filter(name="New").exists())
+
+
+class OrbatExportTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="export", display_name="Exporter")
+        self.section = Section.objects.create(name="Alpha", shorthand="A", type="infantry", max_size=8)
+        slot = SectionSlot.objects.create(name="SL", section=self.section, user=self.user)
+        RoleSlotAssignment.objects.create(section_slot=slot, role=Role.objects.create(name="Medic", shorthand="MED"))
+        self.client.force_login(self.user)
+
+    def test_graph_is_served_with_etag_until_orbat_changes(self):
+        response = self.client.get("/api/orbat/graph/")
+        section = response.json()["unassigned_sections"][0]
+        self.assertEqual(section["slots"][0]["roles"][0]["shorthand"], "MED")
+
+        etag = response["ETag"]
+        self.assertEqual(self.client.get("/api/orbat/graph/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.section.name = "Bravo"
+        self.section.save()
+        response = self.client.get("/api/orbat/graph/?output=dot", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('"Bravo"', response.content.decode())
+
+    def test_removing_a_role_through_the_slot_api_changes_the_graph(self):
+        self.user.is_staff = True
+        self.user.save()
+        etag = self.client.get("/api/orbat/graph/")["ETag"]
+
+        slot = SectionSlot.objects.get(section=self.section)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(
+                f"/api/orbat/section/{self.section.id}/slot/{slot.id}/", {"roles": []}, content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get("/api/orbat/graph/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["unassigned_sections"][0]["slots"][0]["roles"], [])
+
+    def test_ending_role_assignments_in_bulk_changes_the_graph(self):
+        slot = SectionSlot.objects.get(section=self.section)
+        etag = self.client.get("/api/orbat/graph/")["ETag"]
+        # The slot API ends removed roles with update(), which skips the model signals
+        with self.captureOnCommitCallbacks(execute=True):
+            SectionSlotAPI()._sync_roles(slot, [])
+        self.assertEqual(self.client.get("/api/orbat/graph/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class BulkMoveTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.alpha = Section.objects.create(name="Alpha", shorthand="A", type="infantry", max_size=8)
+        self.bravo = Section.objects.create(name="Bravo", shorthand="B", type="infantry", max_size=8)
+        self.users = [User.objects.create(username=f"move_{i}", display_name=f"Move {i}") for i in range(3)]
+        for user in self.users:
+            SectionAssignment.objects.create(user=user, section=self.alpha)
+        self.admin = User.objects.create(username="admin", display_name="Admin", is_superuser=True)
+        self.client.force_login(self.admin)
+
+    def test_bulk_move_writes_timeline_in_one_insert(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("bulk_user_action"), {
+                "user_ids[]": [str(user.id) for user in self.users],
+                "action": "move",
+                "section_id": self.bravo.id,
+            })
+        self.assertEqual(response.json()["updated"], 3)
+        self.assertEqual(SectionAssignment.objects.filter(section=self.bravo, end_date__isnull=True).count(), 3)
+        self.assertFalse(SectionAssignment.objects.filter(section=self.alpha, end_date__isnull=True).exists())
+        self.assertEqual(
+            TimelineEntry.objects.filter(event_type=TimelineTypes.SECTION_JOINED, section=self.bravo).count(), 3
+        )
+        self.assertEqual(
+            TimelineEntry.objects.filter(event_type=TimelineTypes.SECTION_LEFT, section=self.alpha).count(), 3
+        )
+
+
+class AssignmentTimelineTests(TestCase):
+    def test_section_changes_are_logged_once_per_transaction(self):
+        section = Section.objects.create(name="Alpha", shorthand="A", type="infantry", max_size=8)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user = get_user_model().objects.create(username="joiner", display_name="Joiner")
+            assignment = SectionAssignment.objects.create(user=user, section=section)
+            assignment.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            assignment.delete()
+
+        events = list(TimelineEntry.objects.filter(user=user).order_by("id").values_list("event_type", flat=True))
+        self.assertEqual(events, [TimelineTypes.UNIT_JOINED, TimelineTypes.SECTION_JOINED, TimelineTypes.SECTION_LEFT])
+
+
+class SectionHistoryTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.section = Section.objects.create(name="Alpha", shorthand="A", type="infantry", max_size=8)
+        self.role = Role.objects.create(name="Rifleman")
+        self.users = [User.objects.create(username=f"history_{i}", display_name=f"History {i}") for i in range(4)]
+        self.tenures = []
+        for i, user in enumerate(self.users):
+            start = datetime.date(2024, 1, 1) + datetime.timedelta(days=30 * i)
+            end = start + datetime.timedelta(days=20) if i < 2 else None
+            self.tenures.append(HistorySectionAssignment.objects.create(
+                user=user, section=self.section, start_date=start, end_date=end,
+            ))
+        HistoryRoleAssignment.objects.create(
+            user=self.users[0], section=self.section, role=self.role,
+            start_date=datetime.date(2024, 1, 5), end_date=datetime.date(2024, 1, 15),
+        )
+
+    def test_pages_are_newest_first_and_continue_from_the_cursor(self):
+        first = get_section_history_page(self.section, page_size=3)
+        self.assertEqual([row["user"] for row in first["rows"]], self.users[:0:-1])
+        self.assertIsNotNone(first["next_cursor"])
+
+        second = get_section_history_page(self.section, cursor=first["next_cursor"], page_size=3)
+        self.assertEqual([row["user"] for row in second["rows"]], [self.users[0]])
+        self.assertIsNone(second["next_cursor"])
+        self.assertEqual([role["name"] for role in second["rows"][0]["roles"]], ["Rifleman"])
+
+    def test_summary_counts(self):
+        summary = get_section_history_summary(self.section)
+        self.assertEqual(summary["tenures"], 4)
+        self.assertEqual(summary["members"], 4)
+        self.assertEqual(summary["current_members"], 2)
+        self.assertEqual(summary["first_date"], datetime.date(2024, 1, 1))
+        self.assertEqual(summary["role_tenures"], 1)
+        self.assertEqual(summary["roles"], 1)
+
+    def test_summary_is_cached_until_a_history_row_changes(self):
+        get_section_history_summary(self.section)
+        with self.assertNumQueries(0):
+            get_section_history_summary(self.section)
+
+        tenure = self.tenures[-1]
+        tenure.end_date = tenure.start_date + datetime.timedelta(days=10)
+        tenure.save()
+        self.assertEqual(get_section_history_summary(self.section)["current_members"], 1)
+
+        HistorySectionAssignment.objects.create(
+            user=self.users[0], section=self.section, start_date=datetime.date(2025, 6, 1),
+        )
+        summary = get_section_history_summary(self.section)
+        self.assertEqual(summary["tenures"], 5)
+        self.assertEqual(summary["current_members"], 2)
+
+    def test_history_view(self):
+        response = self.client.get(reverse("orbat_section_history", args=[self.section.name]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "History 3")
 
-# Create your tests here.
+    def test_unknown_section_is_404(self):
+        response = self.client.get(reverse("orbat_section_history", args=["Nope"]))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse("orbat_section_history", args=["Nope"]), HTTP_HX_REQUEST="true")
+        self.assertEqual(response.status_code, 404)
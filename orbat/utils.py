@@ -1,6 +1,20 @@
 from collections import Counter
 
-from orbat.models import RoleSlotAssignment, SectionSlot, Role, SectionAssignment, Section
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q, Count, Min
+from django.utils import timezone
+
+from core.cache import versioned_key, bump_cache_version
+from core.pagination import keyset_paginate
+from orbat.models import RoleSlotAssignment, SectionSlot, Role, SectionAssignment, Section, \
+    HistorySectionAssignment, HistoryRoleAssignment
+from orbat.role_catalogue import get_role_catalogue
+from timeline.models import TimelineTypes
+from timeline.writer import record_entry
+
+
+HISTORY_NAMESPACE = "orbat_history"
 
 
 def is_section_owner(user):
@@ -28,30 +42,19 @@ def get_section_slot_context(section):
     )
     slotted_ids = [slot.user.id for slot in section_slots if slot.user]
 
-    # Preload role metadata
-    all_roles = list(Role.objects.all())
-    role_allowed_sections_map = {
-        r.id: set(r.allowed_sections.all()) for r in all_roles
-    }
-    role_incompatibles_map = {
-        r.id: {ir.id for ir in r.incompatible_roles.all()} for r in all_roles
-    }
+    # Role rules come from the compiled catalogue, a few bitwise ops instead of per-role queries
+    catalogue = get_role_catalogue()
+    allowed_mask = catalogue.allowed_mask(section.id)
+    disabled_mask = (
+        catalogue.conflicts_mask(catalogue.mask(role_counts))
+        | catalogue.capacity_mask(role_counts)
+    )
 
     # --- Roles context ---
     roles_ctx = {}
-    for role in all_roles:
-        if role.allowed_sections.exists() and not role.allowed_sections.contains(section):
-            continue
+    for role in Role.objects.filter(id__in=catalogue.ids(allowed_mask)):
         max_count = role.max_per_section
         current_count = role_counts.get(role.id, 0) if role.is_rank else 0
-        max_reached = max_count is not None and current_count >= max_count
-        allowed = not role_allowed_sections_map[role.id] or section in role_allowed_sections_map[role.id]
-        has_incompatible = any(
-            rid in role_incompatibles_map[role.id]
-            for rid in role_counts.keys()
-        )
-
-        disabled = max_reached or not allowed or has_incompatible
 
         roles_ctx[role.id] = {
             "id": role.id,
@@ -61,7 +64,7 @@ def get_section_slot_context(section):
             "is_rank": role.is_rank,
             "max_count": max_count,
             "current_count": current_count,
-            "disabled": disabled,
+            "disabled": bool(disabled_mask & catalogue.mask([role.id])),
         }
 
     context['roles'] = roles_ctx
@@ -109,4 +112,162 @@ def get_section_slot_context(section):
     context["members_json"] = members_json
     context["has_unallocated_members"] = any(not m["is_assigned"] for m in members)
 
-    return context
\ No newline at end of file
+    return context
+
+
+def overlapping_range(queryset, start_date=None, end_date=None):
+    """Filter history intervals to those overlapping [start_date, end_date]."""
+    if end_date:
+        queryset = queryset.filter(start_date__lte=end_date)
+    if start_date:
+        queryset = queryset.filter(Q(end_date__isnull=True) | Q(end_date__gte=start_date))
+    return queryset
+
+
+def get_section_history_summary(section):
+    """
+    Headline numbers for a section's history.
+    Memoized per section until any history row changes.
+    """
+    key = versioned_key(HISTORY_NAMESPACE, "section_summary", section.pk)
+    summary = cache.get(key)
+    if summary is not None:
+        return summary
+
+    summary = HistorySectionAssignment.objects.filter(section=section).aggregate(
+        tenures=Count("id"),
+        members=Count("user", distinct=True),
+        current_members=Count("id", filter=Q(end_date__isnull=True)),
+        first_date=Min("start_date"),
+    )
+    summary.update(HistoryRoleAssignment.objects.filter(section=section).aggregate(
+        role_tenures=Count("id"),
+        roles=Count("role", distinct=True),
+    ))
+    cache.set(key, summary, timeout=None)
+    return summary
+
+
+def _timeline_bar(start, end, range_start, span_days):
+    """Left offset and width (percent) of an interval on a tenure timeline."""
+    start = max(start, range_start)
+    left = (start - range_start).days / span_days * 100
+    width = max((end - start).days, 1) / span_days * 100
+    return round(left, 2), round(min(width, 100 - left), 2)
+
+
+def get_section_history_page(section, start_date=None, end_date=None, cursor=None, page_size=25):
+    """
+    One page of member tenures for a section, newest first, with the role tenures
+    each member held in the section during that period.
+    Three queries per page regardless of how much history the section has.
+    """
+    tenures = overlapping_range(
+        HistorySectionAssignment.objects.filter(section=section).select_related("user"),
+        start_date, end_date,
+    )
+    page, next_cursor = keyset_paginate(tenures, ["-start_date", "-id"], cursor=cursor, page_size=page_size)
+
+    role_tenures = {}
+    if page:
+        roles_qs = overlapping_range(
+            HistoryRoleAssignment.objects.filter(section=section, user_id__in={t.user_id for t in page}),
+            start_date, end_date,
+        ).select_related("role").order_by("start_date")
+        for role_tenure in roles_qs:
+            role_tenures.setdefault(role_tenure.user_id, []).append(role_tenure)
+
+    today = timezone.now().date()
+    range_end = end_date or today
+    range_start = start_date or get_section_history_summary(section)["first_date"] or today
+    span_days = max((range_end - range_start).days, 1)
+
+    rows = []
+    for tenure in page:
+        tenure_end = min(tenure.end_date or range_end, range_end)
+        roles = []
+        for role_tenure in role_tenures.get(tenure.user_id, []):
+            # Only show roles held during this particular stint in the section
+            if role_tenure.start_date > tenure_end or (role_tenure.end_date and role_tenure.end_date < tenure.start_date):
+                continue
+            role_end = min(role_tenure.end_date or range_end, range_end)
+            roles.append({
+                "name": role_tenure.role.name if role_tenure.role else role_tenure.role_name_at_assignment,
+                "start_date": role_tenure.start_date,
+                "end_date": role_tenure.end_date,
+                "bar": _timeline_bar(role_tenure.start_date, role_end, range_start, span_days),
+            })
+        rows.append({
+            "user": tenure.user,
+            "start_date": tenure.start_date,
+            "end_date": tenure.end_date,
+            "days": ((tenure.end_date or today) - tenure.start_date).days,
+            "bar": _timeline_bar(tenure.start_date, tenure_end, range_start, span_days),
+            "roles": roles,
+        })
+
+    return {
+        "rows": rows,
+        "next_cursor": next_cursor,
+        "range_start": range_start,
+        "range_end": range_end,
+    }
+
+
+def move_users_to_section(users, section):
+    """
+    Move a group of users into a section in a fixed number of queries.
+    Ends their other active section assignments, vacates their slots elsewhere and
+    writes the matching SECTION_LEFT/SECTION_JOINED timeline entries in one insert on commit.
+    Returns the users that were moved.
+    """
+    from orbat.export import ORBAT_NAMESPACE
+    from training.coverage import schedule_coverage_refresh
+    from users.models import CustomUser, UserStatus
+
+    now = timezone.now()
+    users = list(users)
+    users_by_id = {user.pk: user for user in users}
+
+    with transaction.atomic():
+        previous = list(
+            SectionAssignment.objects
+            .filter(user_id__in=users_by_id, end_date__isnull=True)
+            .select_related("section")
+        )
+        already_in_section = {a.user_id for a in previous if a.section_id == section.id}
+        leaving = [a for a in previous if a.section_id != section.id]
+
+        SectionAssignment.objects.filter(pk__in=[a.pk for a in leaving]).update(end_date=now)
+        moved_ids = [user_id for user_id in users_by_id if user_id not in already_in_section]
+        joined = SectionAssignment.objects.bulk_create(
+            SectionAssignment(section=section, user_id=user_id, start_date=now) for user_id in moved_ids
+        )
+        SectionSlot.objects.filter(user_id__in=moved_ids).exclude(section=section).update(user=None)
+        CustomUser.objects.filter(pk__in=moved_ids).exclude(status=UserStatus.RETIRED).update(
+            section_name=section.name, rank="PVT",
+        )
+
+        for assignment in leaving:
+            record_entry(
+                TimelineTypes.SECTION_LEFT,
+                users_by_id[assignment.user_id],
+                section=assignment.section,
+                timestamp=now,
+                related_object=assignment,
+            )
+        for assignment in joined:
+            record_entry(
+                TimelineTypes.SECTION_JOINED,
+                users_by_id[assignment.user_id],
+                section=section,
+                timestamp=now,
+                related_object=assignment,
+            )
+
+        # update()/bulk_create() bypass the model signals
+        transaction.on_commit(lambda: bump_cache_version(ORBAT_NAMESPACE))
+        if moved_ids:
+            schedule_coverage_refresh(section_ids={section.id, *(a.section_id for a in leaving)})
+
+    return [users_by_id[user_id] for user_id in moved_ids]
@@ -1,6 +1,8 @@
 from django.http import JsonResponse
 from django.views import View
 
+from orbat.models import Section
+from orbat.utils import move_users_to_section
 from users.models import CustomUser
 
 
@@ -11,4 +13,13 @@ class BulkUserActionView(View):
 
         users = CustomUser.objects.filter(id__in=user_ids)
 
+        if action == "move":
+            section = Section.objects.filter(pk=request.POST.get("section_id")).first()
+            if not section:
+                return JsonResponse({"status": "error", "detail": "Section not found"}, status=400)
+            if not (request.user.is_authenticated and request.user.has_permission("modify", module="orbat", scope=section)):
+                return JsonResponse({"status": "error", "detail": "Insufficient permissions"}, status=403)
+            moved = move_users_to_section(users, section)
+            return JsonResponse({"status": "ok", "updated": len(moved)})
+
         return JsonResponse({"status": "ok", "updated": users.count()})
@@ -1,11 +1,14 @@
-from collections import defaultdict
+from collections import defaultdict, Counter
+from urllib.parse import urlencode
 
-from django.db.models import Q
+from django.db.models import Q, Count
 from django.shortcuts import render
 from django.utils import timezone
 
+from core.pagination import keyset_paginate
 from orbat.models import SectionAssignment, Section, SectionSlot
 from orbat.views.orbat_base_views import ORBATBaseView
+from training.coverage import get_section_coverage
 from users.models import CustomUser, UserStatus
 
 
@@ -26,6 +29,7 @@ class ORBATOverviewView(ORBATBaseView):
 
         grouped = defaultdict(list)
         section_groups = []
+        coverage = get_section_coverage()
         for section in Section.objects.order_by('platoon__order', 'order'):
             if active_assignments.filter(section=section).exists():
                 section_slots = (SectionSlot.objects.filter(section=section).select_related('user').order_by('order'))
@@ -47,6 +51,7 @@ class ORBATOverviewView(ORBATBaseView):
                 section_groups.append({
                     'section': section,
                     "assignments": section_assignments,
+                    "coverage": coverage.get(section.id, []),
                 })
                 platoon = section.platoon or "no_platoon"
                 grouped[platoon].append(section)
@@ -77,6 +82,81 @@ class ORBATOverviewView(ORBATBaseView):
 
 class ORBATMemberView(ORBATBaseView):
     template_name = "orbat_members.html"
+    partial_template_name = "partials/members_table.html"
+    page_size = 50
+
+    # Keyset orderings on the indexed columns, the trailing unique display_name makes every
+    # cursor unambiguous. Members without a rank or section come last.
+    order_map = {
+        "rank": ["rank", "display_name"],
+        "name": ["display_name"],
+        "section": ["section_name", "display_name"],
+        "status": ["status", "display_name"],
+    }
+    filter_params = {
+        "status": "status",
+        "section": "section_name",
+        "rank": "rank",
+    }
+
+    def get_active_filters(self):
+        return {
+            param: self.request.GET.get(param)
+            for param in self.filter_params
+            if self.request.GET.get(param)
+        }
+
+    def get_facets(self, active_filters):
+        """
+        Count members per status, section and rank in a single grouped query.
+        Each facet is counted against the other active filters, so the numbers
+        shown next to an option match what selecting it would return.
+        """
+        combos = (
+            CustomUser.objects
+            .values("status", "section_name", "rank")
+            .annotate(count=Count("id"))
+            .order_by()
+        )
+
+        facets = {param: Counter() for param in self.filter_params}
+        total = 0
+        for row in combos:
+            row_values = {param: row[field] for param, field in self.filter_params.items()}
+            for param in self.filter_params:
+                if all(
+                    row_values[other] == value
+                    for other, value in active_filters.items() if other != param
+                ):
+                    facets[param][row_values[param]] += row["count"]
+            if all(row_values[param] == value for param, value in active_filters.items()):
+                total += row["count"]
+        return facets, total
+
+    def get_members_context(self):
+        sort = self.request.GET.get("sort", "name")
+        if sort not in self.order_map:
+            sort = "name"
+        active_filters = self.get_active_filters()
+
+        members = CustomUser.objects.filter(**{self.filter_params[param]: value for param, value in active_filters.items()})
+
+        page, next_cursor = keyset_paginate(
+            members,
+            self.order_map[sort],
+            cursor=self.request.GET.get("cursor"),
+            page_size=self.page_size,
+        )
+
+        context = {
+            "members": page,
+            "sort": sort,
+            "active_filters": active_filters,
+            "next_page_query": None,
+        }
+        if next_cursor:
+            context["next_page_query"] = urlencode({**active_filters, "sort": sort, "cursor": next_cursor})
+        return context
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -85,21 +165,27 @@ class ORBATMemberView(ORBATBaseView):
             {"name": "Members", "url": None},
         ]
 
-        sort = self.request.GET.get("sort", "name")
-        order_map = {
-            "rank": "rank",
-            "name": "display_name",
-            "section": "section_name",
-        }
-
-        order_field = order_map.get(sort, "display_name")
+        context.update(self.get_members_context())
 
-        members = CustomUser.objects.all().order_by(order_field)
-        context['members'] = members
+        facets, total = self.get_facets(context["active_filters"])
+        status_labels = dict(UserStatus.choices)
+        context["member_total"] = total
+        context["status_facets"] = [
+            (value, status_labels.get(value, value), count)
+            for value, count in sorted(facets["status"].items(), key=lambda item: str(item[0]))
+        ]
+        context["section_facets"] = sorted(
+            ((value, count) for value, count in facets["section"].items() if value),
+        )
+        context["rank_facets"] = sorted(
+            ((value, count) for value, count in facets["rank"].items() if value),
+        )
+        context["move_sections"] = Section.objects.order_by("name").values("id", "name")
 
         return context
 
-    def render_to_response(self, context, **response_kwargs):
-        if self.request.headers.get("HX-Request") == "true":
-            return render(self.request, "partials/members_table.html", context, **response_kwargs)
-        return super().render_to_response(context, **response_kwargs)
\ No newline at end of file
+    def get(self, request, *args, **kwargs):
+        # HTMX refreshes and "load more" requests only need the table rows
+        if request.headers.get("HX-Request") == "true":
+            return render(request, self.partial_template_name, self.get_members_context())
+        return super().get(request, *args, **kwargs)
@@ -1,12 +1,16 @@
 import json
+from urllib.parse import urlencode
 
 from django.contrib import messages
 from django.core.exceptions import ObjectDoesNotExist
-from django.shortcuts import redirect
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
+from django.utils.dateparse import parse_date
 
 from orbat.models import Section
-from orbat.utils import get_section_slot_context
+from orbat.utils import get_section_slot_context, get_section_history_page, get_section_history_summary
 from orbat.views import ORBATBaseView
+from training.coverage import get_section_coverage
 
 
 class ORBATSectionDetailView(ORBATBaseView):
@@ -36,10 +40,67 @@ class ORBATSectionDetailView(ORBATBaseView):
             context["can_manage"] = user.has_permission("modify", module="orbat", scope=self.section_obj)
         section_context = get_section_slot_context(self.section_obj)
         context.update(section_context)
+        context["coverage"] = get_section_coverage([self.section_obj.id]).get(self.section_obj.id, [])
         return context
 
-class ORBATSectionHistoryView(ORBATBaseView):
-    pass
+class ORBATSectionHistoryView(ORBATSectionDetailView):
+    template_name = 'orbat_section_history.html'
+    partial_template_name = 'partials/section_history_rows.html'
+    page_size = 25
+
+    def dispatch(self, request, *args, **kwargs):
+        # Linked to directly and fetched by infinite scroll, so no redirect for an unknown section
+        self.section_obj = get_object_or_404(Section, name=self.kwargs.get('section_name'))
+        return super(ORBATSectionDetailView, self).dispatch(request, *args, **kwargs)
+
+    def _get_date_param(self, name):
+        try:
+            return parse_date(self.request.GET.get(name) or "")
+        except ValueError:
+            return None
+
+    def get_history_context(self):
+        start_date = self._get_date_param("from")
+        end_date = self._get_date_param("to")
+
+        history = get_section_history_page(
+            self.section_obj,
+            start_date=start_date,
+            end_date=end_date,
+            cursor=self.request.GET.get("cursor"),
+            page_size=self.page_size,
+        )
+        history["section"] = self.section_obj
+        history["next_page_query"] = None
+        if history["next_cursor"]:
+            params = {"cursor": history["next_cursor"]}
+            if start_date:
+                params["from"] = start_date.isoformat()
+            if end_date:
+                params["to"] = end_date.isoformat()
+            history["next_page_query"] = urlencode(params)
+        return history
+
+    def get_context_data(self, **kwargs):
+        context = super(ORBATSectionDetailView, self).get_context_data(**kwargs)
+        context["breadcrumbs"] = [
+            {"name": "ORBAT", "url": "/orbat/"},
+            {"name": "Sections", "url": "/orbat/"},
+            {"name": self.section_obj.name, "url": reverse("orbat_section_detail", args=[self.section_obj.name])},
+            {"name": "History", "url": None},
+        ]
+        context["section"] = self.section_obj
+        context["summary"] = get_section_history_summary(self.section_obj)
+        context["filter_from"] = self.request.GET.get("from", "")
+        context["filter_to"] = self.request.GET.get("to", "")
+        context.update(self.get_history_context())
+        return context
+
+    def get(self, request, *args, **kwargs):
+        # Infinite scroll only needs the next batch of rows
+        if request.headers.get("HX-Request") == "true":
+            return render(request, self.partial_template_name, self.get_history_context())
+        return super().get(request, *args, **kwargs)
 
 class ORBATSectionEditView(ORBATBaseView):
     pass
\ No newline at end of file
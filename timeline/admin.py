@@ -1,9 +1,15 @@
 from django.contrib import admin
 
-from timeline.models import TimelineEntry
+from timeline.models import TimelineEntry, ArchivedTimelineEntry
 
 
 # Register your models here.
 @admin.register(TimelineEntry)
 class TimelineEntryAdmin(admin.ModelAdmin):
-    list_display = ('user', 'section', 'event_type', 'snapshot_name', 'timestamp')
\ No newline at end of file
+    list_display = ('user', 'section', 'event_type', 'snapshot_name', 'timestamp')
+
+@admin.register(ArchivedTimelineEntry)
+class ArchivedTimelineEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'section', 'event_type', 'snapshot_name', 'timestamp', 'merged_count')
+    exclude = ('compressed_description',)
+    readonly_fields = ('description',)
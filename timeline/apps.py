@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class TimelineConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'timeline'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from timeline.search import create_search_index
+
+        import timeline.signals  # noqa
+        post_migrate.connect(create_search_index, sender=self)
@@ -0,0 +1,129 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from timeline.models import TimelineEntry, TimelineTypes, ArchivedTimelineEntry
+from timeline.search import remove_entries
+from timeline.utils import invalidate_timeline_caches
+
+
+# Status changes that flip back and forth, each with the change that undoes it
+OPPOSITE_TYPES = {
+    TimelineTypes.UNIT_JOINED: TimelineTypes.UNIT_LEFT,
+    TimelineTypes.UNIT_LEFT: TimelineTypes.UNIT_JOINED,
+    TimelineTypes.SECTION_JOINED: TimelineTypes.SECTION_LEFT,
+    TimelineTypes.SECTION_LEFT: TimelineTypes.SECTION_JOINED,
+}
+COMPACTED_TYPES = set(OPPOSITE_TYPES)
+
+
+def get_archive_cutoff():
+    return timezone.now() - timedelta(days=settings.TIMELINE_ARCHIVE_AFTER_DAYS)
+
+
+def _archive_row(entry, merged_count=1):
+    return ArchivedTimelineEntry(
+        id=entry.id,
+        user_id=entry.user_id,
+        section_id=entry.section_id,
+        timestamp=entry.timestamp,
+        event_type=entry.event_type,
+        snapshot_name=entry.snapshot_name,
+        snapshot_section=entry.snapshot_section,
+        description=entry.description,
+        content_type_id=entry.content_type_id,
+        object_id=entry.object_id,
+        merged_count=merged_count,
+    )
+
+
+def compact_entries(entries):
+    """
+    Turn hot entries into archive rows.
+    A member's status changes for a section on the same day are reduced to their net effect:
+    a change followed by the one that undoes it (joined then left, or left then joined) cancels
+    out, and what is left collapses into its last entry, with merged_count recording how many
+    entries it stands for. A day that ends where it started leaves no row at all, so a rollup
+    rebuilt from the archive no longer counts it.
+    Returns (archived, merged_ids), merged_ids being the entries that no longer have a row.
+    """
+    archived = []
+    merged_ids = []
+    # (member, section, kind of change, day) -> [entries still standing, entries seen]
+    groups = {}
+    for entry in sorted(entries, key=lambda entry: (entry.timestamp, entry.id)):
+        if entry.event_type not in COMPACTED_TYPES:
+            archived.append(_archive_row(entry))
+            continue
+
+        kind = min(entry.event_type, OPPOSITE_TYPES[entry.event_type])
+        key = (entry.user_id, entry.section_id, kind, timezone.localdate(entry.timestamp))
+        standing, seen = groups.setdefault(key, ([], []))
+        seen.append(entry)
+        if standing and standing[-1].event_type == OPPOSITE_TYPES[entry.event_type]:
+            standing.pop()
+        else:
+            standing.append(entry)
+
+    for standing, seen in groups.values():
+        # Whatever survives the cancelling is a run of the same change
+        last = standing[-1] if standing else None
+        if last is not None:
+            archived.append(_archive_row(last, merged_count=len(seen)))
+        merged_ids.extend(entry.id for entry in seen if entry is not last)
+    return archived, merged_ids
+
+
+def _delete_hot_entries(entry_ids, batch_size=500):
+    """
+    Delete archived entries from the hot table without post_delete: they are still
+    counted in the daily rollup and stay in the search index under the same id.
+    """
+    table = connection.ops.quote_name(TimelineEntry._meta.db_table)
+    with connection.cursor() as cursor:
+        for start in range(0, len(entry_ids), batch_size):
+            batch = entry_ids[start:start + batch_size]
+            placeholders = ", ".join(["%s"] * len(batch))
+            cursor.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", batch)
+
+
+def _next_chunk(old_entries, chunk_size):
+    """The oldest chunk_size entries, extended to the end of the last one's day so a day is never split."""
+    chunk = list(old_entries.order_by("timestamp", "id")[:chunk_size])
+    if len(chunk) < chunk_size:
+        return chunk
+    last = chunk[-1]
+    day_end = timezone.make_aware(datetime.combine(timezone.localdate(last.timestamp) + timedelta(days=1), time.min))
+    chunk += old_entries.filter(
+        Q(timestamp__gt=last.timestamp) | Q(timestamp=last.timestamp, id__gt=last.id),
+        timestamp__lt=day_end,
+    ).order_by("timestamp", "id")
+    return chunk
+
+
+def archive_timeline(cutoff=None, chunk_size=1000):
+    """
+    Move entries older than cutoff (default: TIMELINE_ARCHIVE_AFTER_DAYS ago) into the archive,
+    compacting same-day status changes to their net effect as they go. Each chunk is moved in its own transaction.
+    Returns (moved, archived): entries taken out of the hot table and archive rows written.
+    """
+    old_entries = TimelineEntry.objects.filter(timestamp__lt=cutoff or get_archive_cutoff())
+    moved = written = 0
+    while True:
+        with transaction.atomic():
+            chunk = _next_chunk(old_entries, chunk_size)
+            if not chunk:
+                break
+            archived, merged_ids = compact_entries(chunk)
+            ArchivedTimelineEntry.objects.bulk_create(archived, batch_size=chunk_size)
+            _delete_hot_entries([entry.id for entry in chunk])
+            remove_entries(merged_ids)
+        moved += len(chunk)
+        written += len(archived)
+
+    if moved:
+        invalidate_timeline_caches()
+    return moved, written
@@ -0,0 +1,93 @@
+import hashlib
+import time
+from datetime import date, datetime
+
+from django.core.cache import cache
+from django.db.models import Model, QuerySet
+from django.utils.safestring import mark_safe
+
+from core.cache import versioned_key
+from timeline.utils import TIMELINE_NAMESPACE
+
+
+FRAGMENT_TIMEOUT = 60 * 10
+# How long a render may hold the lock before another request is allowed to try
+FRAGMENT_LOCK_TIMEOUT = 30
+FRAGMENT_LOCK_POLLS = 20
+FRAGMENT_LOCK_WAIT = 0.05
+
+FRAGMENT_STATS = ("hits", "misses", "waits")
+
+
+def _stats_key(stat):
+    return f"unithub:{TIMELINE_NAMESPACE}:fragment_stats:{stat}"
+
+
+def _count(stat):
+    key = _stats_key(stat)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def get_fragment_stats():
+    """Hit/miss counters for the timeline fragment cache since the last reset."""
+    counts = cache.get_many([_stats_key(stat) for stat in FRAGMENT_STATS])
+    stats = {stat: counts.get(_stats_key(stat), 0) for stat in FRAGMENT_STATS}
+    served = sum(stats.values())
+    stats["hit_rate"] = round((stats["hits"] + stats["waits"]) / served, 3) if served else None
+    return stats
+
+
+def reset_fragment_stats():
+    cache.delete_many([_stats_key(stat) for stat in FRAGMENT_STATS])
+
+
+def _scope_part(value):
+    if isinstance(value, QuerySet):
+        return str(value.query)
+    if isinstance(value, Model):
+        return f"{value._meta.label}:{value.pk}"
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def fragment_key(name, *scope):
+    """Cache key for a rendered fragment, tied to the current timeline version."""
+    digest = hashlib.md5("|".join(_scope_part(part) for part in scope).encode()).hexdigest()
+    return versioned_key(TIMELINE_NAMESPACE, "fragment", name, digest)
+
+
+def get_or_render_fragment(name, scope, render):
+    """
+    Return the cached HTML for a fragment, rendering it with render() on a miss.
+    Only one request renders a missing fragment at a time: the others wait briefly
+    for its result and render it themselves if it doesn't arrive.
+    """
+    key = fragment_key(name, *scope)
+    html = cache.get(key)
+    if html is not None:
+        _count("hits")
+        return mark_safe(html)
+
+    lock_key = f"{key}:lock"
+    if not cache.add(lock_key, 1, timeout=FRAGMENT_LOCK_TIMEOUT):
+        for _ in range(FRAGMENT_LOCK_POLLS):
+            time.sleep(FRAGMENT_LOCK_WAIT)
+            html = cache.get(key)
+            if html is not None:
+                _count("waits")
+                return mark_safe(html)
+        _count("misses")
+        return mark_safe(render())
+
+    try:
+        html = render()
+        cache.set(key, str(html), timeout=FRAGMENT_TIMEOUT)
+    finally:
+        cache.delete(lock_key)
+    _count("misses")
+    return mark_safe(html)
@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from timeline.archive import archive_timeline, get_archive_cutoff
+
+
+class Command(BaseCommand):
+    help = (
+        "Move timeline entries older than TIMELINE_ARCHIVE_AFTER_DAYS into the archive table, "
+        "reducing each member's same-day joins and leaves to their net effect: a join and a leave "
+        "cancel out and repeats are merged into one row."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="Archive entries older than this many days instead.")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        cutoff = get_archive_cutoff()
+        if options["days"] is not None:
+            cutoff = timezone.now() - timedelta(days=options["days"])
+
+        moved, archived = archive_timeline(cutoff, chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {moved} timeline entries before {cutoff:%Y-%m-%d} into {archived} rows."
+        ))
@@ -0,0 +1,114 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from orbat.models import HistorySectionAssignment, HistoryRoleAssignment, HistoryUserStatus
+from timeline.models import TimelineEntry, TimelineTypes
+from timeline.utils import get_archive_boundary, refresh_timeline_snapshots
+from timeline.writer import TimelineWriter
+from users.models import UserStatus
+
+
+def _as_datetime(date):
+    return timezone.make_aware(datetime.combine(date, time.min))
+
+
+class Command(BaseCommand):
+    help = (
+        "Derive timeline entries (section joins/leaves, role assignments, unit joins/leaves) "
+        "from the ORBAT history tables. Events the timeline already has for that user and day are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.chunk_size = options["chunk_size"]
+
+        sections = HistorySectionAssignment.objects.select_related("user", "section")
+        created = self.backfill(sections, self.section_events)
+
+        roles = HistoryRoleAssignment.objects.select_related("user", "section", "role")
+        created += self.backfill(roles, self.role_events)
+
+        self.previous_status = {}
+        statuses = HistoryUserStatus.objects.select_related("user").order_by("user_id", "start_date", "id")
+        created += self.backfill(statuses, self.status_events, ordered=True)
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {created} timeline entries."))
+
+    def backfill(self, queryset, derive, ordered=False):
+        """
+        Stream a history table in chunks and write the derived entries one bulk insert per chunk.
+        """
+        if not ordered:
+            queryset = queryset.order_by("id")
+
+        created = 0
+        chunk = []
+        for row in queryset.iterator(chunk_size=self.chunk_size):
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                created += self.write_chunk(chunk, derive)
+                chunk = []
+        if chunk:
+            created += self.write_chunk(chunk, derive)
+        return created
+
+    def write_chunk(self, rows, derive):
+        # Archived days may have been compacted, so the rows merged away can't be recognised; leave them be
+        archive_boundary = get_archive_boundary()
+        candidates = [
+            (row, event_type, timestamp, kwargs)
+            for row in rows
+            for event_type, timestamp, kwargs in derive(row)
+            if archive_boundary is None or timestamp > archive_boundary
+        ]
+        if not candidates:
+            return 0
+
+        # Live entries point at the SectionAssignment/RoleSlotAssignment/UserStatus rather than the
+        # history row and carry the time of day, so match on what the entry says happened that day
+        timestamps = [timestamp for _, _, timestamp, _ in candidates]
+        existing = {
+            (user_id, event_type, section_id, description, timezone.localdate(timestamp))
+            for user_id, event_type, section_id, description, timestamp in TimelineEntry.objects.filter(
+                user_id__in={row.user_id for row, _, _, _ in candidates},
+                event_type__in={event_type for _, event_type, _, _ in candidates},
+                timestamp__gte=min(timestamps),
+                timestamp__lt=max(timestamps) + timedelta(days=1),
+            ).values_list("user_id", "event_type", "section_id", "description", "timestamp")
+        }
+        writer = TimelineWriter(batch_size=self.chunk_size)
+        for row, event_type, timestamp, kwargs in candidates:
+            section = kwargs.get("section")
+            key = (
+                row.user_id, event_type, section.pk if section else None,
+                kwargs.get("description", ""), timezone.localdate(timestamp),
+            )
+            if key not in existing:
+                existing.add(key)
+                writer.add(event_type, row.user, timestamp=timestamp, related_object=row, **kwargs)
+        created = writer.flush()
+        # Names and sections as they were on the day, not as they are now
+        refresh_timeline_snapshots(TimelineEntry.objects.filter(pk__in=[entry.pk for entry in created]))
+        return len(created)
+
+    def section_events(self, row):
+        yield TimelineTypes.SECTION_JOINED, _as_datetime(row.start_date), {"section": row.section}
+        if row.end_date:
+            yield TimelineTypes.SECTION_LEFT, _as_datetime(row.end_date), {"section": row.section}
+
+    def role_events(self, row):
+        name = row.role_name_at_assignment or (row.role.name if row.role else "")
+        yield TimelineTypes.ROLE_ASSIGNED, _as_datetime(row.start_date), {"section": row.section, "description": name}
+
+    def status_events(self, row):
+        # Rows arrive ordered by user then start date, so the previous row is the user's previous status
+        previous = self.previous_status.get(row.user_id)
+        self.previous_status[row.user_id] = row.status
+        if row.status == UserStatus.RETIRED and previous is not None:
+            yield TimelineTypes.UNIT_LEFT, _as_datetime(row.start_date), {}
+        elif row.status != UserStatus.RETIRED and previous in (None, UserStatus.RETIRED):
+            yield TimelineTypes.UNIT_JOINED, _as_datetime(row.start_date), {}
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from timeline.models import TimelineEntry
+from timeline.utils import refresh_timeline_snapshots
+
+
+class Command(BaseCommand):
+    help = "Fill TimelineEntry.snapshot_name and snapshot_section from the ORBAT history tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--all", action="store_true", help="Re-resolve entries that already have snapshots.")
+
+    def handle(self, *args, **options):
+        entries = TimelineEntry.objects.all()
+        if not options["all"]:
+            entries = entries.filter(Q(snapshot_name__isnull=True) | Q(snapshot_section__isnull=True))
+
+        updated = refresh_timeline_snapshots(entries, chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Updated snapshots for {updated} timeline entries."))
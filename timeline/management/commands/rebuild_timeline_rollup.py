@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from timeline.rollup import rebuild_daily_counts
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily timeline activity rollup from all timeline entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rows = rebuild_daily_counts(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt timeline rollup with {rows} rows."))
@@ -1,3 +1,5 @@
+import zlib
+
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.db import models
 from django.utils import timezone
@@ -21,13 +23,91 @@ class TimelineEntry(models.Model):
     timestamp = models.DateTimeField(default=timezone.now)
     event_type = models.CharField(max_length=50, choices=TimelineTypes.choices)
     snapshot_name = models.CharField(max_length=100, null=True, blank=True)
+    snapshot_section = models.CharField(max_length=10, null=True, blank=True)
     description = models.TextField(blank=True)
     content_type = models.ForeignKey('contenttypes.ContentType', on_delete=models.SET_NULL, null=True, blank=True)
     object_id = models.PositiveIntegerField(null=True, blank=True)
     related_object = GenericForeignKey('content_type', 'object_id')
 
     class Meta:
-        ordering = ['-timestamp']
+        ordering = ['-timestamp', '-id']
+        indexes = [
+            models.Index(fields=["-timestamp", "-id"], name="timeline_ts_idx"),
+            models.Index(fields=["user", "-timestamp", "-id"], name="timeline_user_ts_idx"),
+            models.Index(fields=["section", "-timestamp", "-id"], name="timeline_section_ts_idx"),
+            models.Index(fields=["event_type", "-timestamp", "-id"], name="timeline_type_ts_idx"),
+        ]
+
+    def __str__(self):
+        return f'{self.snapshot_name or self.user.display_name} {self.get_event_type_display()}'
+
+
+class TimelineDailyCount(models.Model):
+    """
+    Number of timeline entries per day, event type and section, for calendars and heatmaps.
+    Kept up to date as entries are written; rebuild with the rebuild_timeline_rollup command.
+    """
+    date = models.DateField()
+    event_type = models.CharField(max_length=50, choices=TimelineTypes.choices)
+    section = models.ForeignKey('orbat.Section', null=True, blank=True, on_delete=models.SET_NULL)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["date", "section"], name="timeline_daily_date_idx"),
+        ]
+        # One row per key; unit-wide rows (no section) get their own constraint since
+        # NULLs never clash in a plain unique constraint and not every backend has nulls_distinct
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "event_type", "section"],
+                condition=models.Q(section__isnull=False),
+                name="timeline_daily_section_uniq",
+            ),
+            models.UniqueConstraint(
+                fields=["date", "event_type"],
+                condition=models.Q(section__isnull=True),
+                name="timeline_daily_unit_uniq",
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.date} {self.event_type}: {self.count}'
+
+
+class ArchivedTimelineEntry(models.Model):
+    """
+    A timeline entry older than the archive horizon, moved out of TimelineEntry by the
+    archive_timeline command. Keeps the original id so cursors and the search index carry over.
+    Repeated same-day status changes are merged into one row, merged_count records how many.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    section = models.ForeignKey('orbat.Section', null=True, blank=True, on_delete=models.SET_NULL)
+    timestamp = models.DateTimeField()
+    event_type = models.CharField(max_length=50, choices=TimelineTypes.choices)
+    snapshot_name = models.CharField(max_length=100, null=True, blank=True)
+    snapshot_section = models.CharField(max_length=10, null=True, blank=True)
+    compressed_description = models.BinaryField(blank=True, default=b"")
+    content_type = models.ForeignKey('contenttypes.ContentType', on_delete=models.SET_NULL, null=True, blank=True)
+    object_id = models.PositiveIntegerField(null=True, blank=True)
+    related_object = GenericForeignKey('content_type', 'object_id')
+    merged_count = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        ordering = ['-timestamp', '-id']
+        indexes = [
+            models.Index(fields=["-timestamp", "-id"], name="timeline_archive_ts_idx"),
+            models.Index(fields=["user", "-timestamp", "-id"], name="timeline_archive_user_ts_idx"),
+        ]
 
     def __str__(self):
-        return f'{self.user.display_name} {self.get_event_type_display()}'
+        return f'{self.snapshot_name or self.user.display_name} {self.get_event_type_display()}'
+
+    @property
+    def description(self):
+        return zlib.decompress(self.compressed_description).decode() if self.compressed_description else ""
+
+    @description.setter
+    def description(self, value):
+        self.compressed_description = zlib.compress(value.encode()) if value else b""
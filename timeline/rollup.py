@@ -0,0 +1,100 @@
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from timeline.models import TimelineEntry, TimelineDailyCount, ArchivedTimelineEntry
+
+
+def _rollup_key(entry):
+    return timezone.localdate(entry.timestamp), entry.event_type, entry.section_id
+
+
+def update_daily_counts(entries, sign=1):
+    """
+    Add (sign=1) or remove (sign=-1) entries from the daily rollup.
+    One update per distinct (date, event_type, section) in the batch, plus a create for new days
+    that falls back to the update if another transaction created the row in the meantime.
+    """
+    deltas = Counter(_rollup_key(entry) for entry in entries)
+    with transaction.atomic():
+        for (date, event_type, section_id), count in deltas.items():
+            rows = TimelineDailyCount.objects.filter(date=date, event_type=event_type, section_id=section_id)
+            if sign < 0:
+                rows.filter(count__gte=count).update(count=F("count") - count)
+            elif not rows.update(count=F("count") + count):
+                try:
+                    with transaction.atomic():
+                        TimelineDailyCount.objects.create(
+                            date=date, event_type=event_type, section_id=section_id, count=count,
+                        )
+                except IntegrityError:
+                    # A concurrent flush created the row first; the unique constraints make this an upsert
+                    rows.update(count=F("count") + count)
+
+
+def _grouped_counts(queryset, count):
+    return (
+        queryset
+        .annotate(date=TruncDate("timestamp"))
+        .values_list("date", "event_type", "section")
+        .annotate(count=count)
+        .order_by()
+    )
+
+
+def rebuild_daily_counts(batch_size=1000):
+    """
+    Recompute the whole rollup from TimelineEntry and the archive, one grouped query each.
+    Merged archive rows count once for every entry they replaced.
+    """
+    counts = Counter()
+    for queryset, count in (
+        (TimelineEntry.objects.all(), Count("id")),
+        (ArchivedTimelineEntry.objects.all(), Sum("merged_count")),
+    ):
+        for date, event_type, section_id, total in _grouped_counts(queryset, count).iterator(chunk_size=batch_size):
+            counts[date, event_type, section_id] += total
+
+    with transaction.atomic():
+        TimelineDailyCount.objects.all().delete()
+        rows = TimelineDailyCount.objects.bulk_create(
+            (
+                TimelineDailyCount(date=date, event_type=event_type, section_id=section_id, count=total)
+                for (date, event_type, section_id), total in counts.items()
+            ),
+            batch_size=batch_size,
+        )
+    return len(rows)
+
+
+def get_daily_activity(start_date, end_date, section=None, user=None, event_types=None):
+    """
+    {date: count} of timeline activity between two dates (inclusive).
+    Unit and section activity comes from the rollup in one query; a single member's
+    activity is grouped from their own entries and archived entries, which the
+    (user, timestamp) indexes keep cheap.
+    """
+    if user is None:
+        rows = TimelineDailyCount.objects.filter(date__gte=start_date, date__lte=end_date)
+        if section is not None:
+            rows = rows.filter(section=section)
+        if event_types:
+            rows = rows.filter(event_type__in=event_types)
+        rows = rows.values(day=F("date")).annotate(total=Sum("count"))
+        return {row["day"]: row["total"] for row in rows.order_by()}
+
+    # Compare raw timestamps rather than timestamp__date so the index can be used
+    start = timezone.make_aware(datetime.combine(start_date, time.min))
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min))
+    days = Counter()
+    for model, count in ((TimelineEntry, Count("id")), (ArchivedTimelineEntry, Sum("merged_count"))):
+        rows = model.objects.filter(user=user, timestamp__gte=start, timestamp__lt=end)
+        if event_types:
+            rows = rows.filter(event_type__in=event_types)
+        rows = rows.annotate(day=TruncDate("timestamp")).values("day").annotate(total=count)
+        days.update({row["day"]: row["total"] for row in rows.order_by()})
+    return dict(days)
@@ -0,0 +1,222 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from timeline.models import TimelineEntry, ArchivedTimelineEntry
+
+
+SEARCH_TABLE = "timeline_search"
+SEARCH_PAGE_SIZE = 20
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def search_terms(query):
+    """Split a free-text query into plain word terms, dropping any search syntax."""
+    return _TERM_RE.findall(query or "")[:10]
+
+
+def _document(entry):
+    """The text fields indexed for an entry, in column order."""
+    return (
+        entry.description or "",
+        entry.snapshot_name or "",
+        entry.user.display_name if entry.user_id else "",
+        entry.section.name if entry.section_id else "",
+    )
+
+
+class SQLiteSearchBackend:
+    """FTS5 virtual table keyed by the entry id (rowid), ranked with bm25."""
+
+    def setup(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+            "USING fts5(description, snapshot_name, user_name, section_name, tokenize='unicode61')"
+        )
+
+    def index(self, cursor, entries):
+        self.remove(cursor, [entry.pk for entry in entries])
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, description, snapshot_name, user_name, section_name) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            [(entry.pk, *_document(entry)) for entry in entries],
+        )
+
+    def remove(self, cursor, entry_ids):
+        if entry_ids:
+            placeholders = ", ".join(["%s"] * len(entry_ids))
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", list(entry_ids))
+
+    def clear(self, cursor):
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+
+    def search(self, cursor, terms, limit, offset):
+        match = " ".join(f'"{term}"*' for term in terms)
+        cursor.execute(
+            f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+            f"ORDER BY bm25({SEARCH_TABLE}, 1.0, 2.0, 2.0, 1.0) LIMIT %s OFFSET %s",
+            [match, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend:
+    """tsvector column with a GIN index, names weighted above descriptions and ranked with ts_rank."""
+
+    document_sql = (
+        "setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'A') || "
+        "setweight(to_tsvector('simple', %s), 'B') || setweight(to_tsvector('simple', %s), 'C')"
+    )
+
+    def setup(self, cursor):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} "
+            "(entry_id bigint PRIMARY KEY, document tsvector NOT NULL)"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx ON {SEARCH_TABLE} USING GIN (document)"
+        )
+
+    def index(self, cursor, entries):
+        rows = []
+        for entry in entries:
+            description, snapshot_name, user_name, section_name = _document(entry)
+            rows.append((entry.pk, snapshot_name, user_name, section_name, description))
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (entry_id, document) VALUES (%s, {self.document_sql}) "
+            "ON CONFLICT (entry_id) DO UPDATE SET document = EXCLUDED.document",
+            rows,
+        )
+
+    def remove(self, cursor, entry_ids):
+        if entry_ids:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE entry_id = ANY(%s)", [list(entry_ids)])
+
+    def clear(self, cursor):
+        cursor.execute(f"TRUNCATE {SEARCH_TABLE}")
+
+    def search(self, cursor, terms, limit, offset):
+        tsquery = " & ".join(f"{term}:*" for term in terms)
+        cursor.execute(
+            f"SELECT entry_id FROM {SEARCH_TABLE}, to_tsquery('simple', %s) AS query "
+            "WHERE document @@ query ORDER BY ts_rank(document, query) DESC, entry_id DESC LIMIT %s OFFSET %s",
+            [tsquery, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class FallbackSearchBackend:
+    """Unranked icontains search for databases without a full-text index."""
+
+    def setup(self, cursor):
+        pass
+
+    def index(self, cursor, entries):
+        pass
+
+    def remove(self, cursor, entry_ids):
+        pass
+
+    def clear(self, cursor):
+        pass
+
+    def search(self, cursor, terms, limit, offset):
+        entries = TimelineEntry.objects.all()
+        for term in terms:
+            entries = entries.filter(
+                Q(description__icontains=term) | Q(snapshot_name__icontains=term) |
+                Q(user__display_name__icontains=term) | Q(section__name__icontains=term)
+            )
+        return list(entries.order_by("-timestamp", "-id").values_list("id", flat=True)[offset:offset + limit])
+
+
+SEARCH_BACKENDS = {
+    "sqlite": SQLiteSearchBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+
+def get_search_backend():
+    return SEARCH_BACKENDS.get(connection.vendor, FallbackSearchBackend)()
+
+
+def create_search_index(**kwargs):
+    """post_migrate hook: the index is raw SQL, so it lives outside the model migrations."""
+    with connection.cursor() as cursor:
+        get_search_backend().setup(cursor)
+
+
+def index_entries(entries):
+    """Add or refresh entries in the search index. Entries need user and section loaded or loadable."""
+    entries = [entry for entry in entries if entry.pk]
+    if entries:
+        with connection.cursor() as cursor:
+            get_search_backend().index(cursor, entries)
+
+
+def remove_entries(entry_ids):
+    with connection.cursor() as cursor:
+        get_search_backend().remove(cursor, list(entry_ids))
+
+
+def _index_in_chunks(backend, cursor, filters, chunk_size):
+    indexed = 0
+    for model in (TimelineEntry, ArchivedTimelineEntry):
+        chunk = []
+        entries = model.objects.filter(**filters).select_related("user", "section")
+        for entry in entries.iterator(chunk_size=chunk_size):
+            chunk.append(entry)
+            if len(chunk) >= chunk_size:
+                backend.index(cursor, chunk)
+                indexed += len(chunk)
+                chunk = []
+        if chunk:
+            backend.index(cursor, chunk)
+            indexed += len(chunk)
+    return indexed
+
+
+def rebuild_search_index(chunk_size=1000):
+    """Re-index every entry, archived ones included, streaming the tables in chunks. Returns the number indexed."""
+    backend = get_search_backend()
+    with connection.cursor() as cursor:
+        backend.setup(cursor)
+        backend.clear(cursor)
+        return _index_in_chunks(backend, cursor, {}, chunk_size)
+
+
+def reindex_entries(chunk_size=1000, **filters):
+    """
+    Refresh the entries matching filters, archived ones included, e.g. user=... after a rename,
+    since the index holds the user's and section's current names. Returns the number indexed.
+    """
+    with connection.cursor() as cursor:
+        return _index_in_chunks(get_search_backend(), cursor, filters, chunk_size)
+
+
+def search_timeline(query, page=1, page_size=SEARCH_PAGE_SIZE):
+    """
+    One page of entries matching query, best match first.
+    Returns (entries, has_next).
+    """
+    from timeline.utils import prefetch_related_objects_for
+
+    terms = search_terms(query)
+    if not terms:
+        return [], False
+
+    offset = (max(page, 1) - 1) * page_size
+    with connection.cursor() as cursor:
+        entry_ids = get_search_backend().search(cursor, terms, page_size + 1, offset)
+
+    has_next = len(entry_ids) > page_size
+    entry_ids = entry_ids[:page_size]
+    # Archived entries keep their ids and stay in the index, so look up any that aren't in the hot table
+    entries = TimelineEntry.objects.select_related("user", "section").in_bulk(entry_ids)
+    archived_ids = [entry_id for entry_id in entry_ids if entry_id not in entries]
+    if archived_ids:
+        entries.update(ArchivedTimelineEntry.objects.select_related("user", "section").in_bulk(archived_ids))
+    results = [entries[entry_id] for entry_id in entry_ids if entry_id in entries]
+    return prefetch_related_objects_for(results), has_next
@@ -0,0 +1,60 @@
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from orbat.models import Section
+from timeline.models import TimelineEntry
+from timeline.rollup import update_daily_counts
+from timeline.search import index_entries, reindex_entries, remove_entries
+from timeline.utils import invalidate_timeline_caches
+from users.models import CustomUser
+
+
+@receiver([post_save, post_delete], sender=TimelineEntry)
+def invalidate_timeline_on_entry_change(sender, instance, **kwargs):
+    invalidate_timeline_caches()
+
+@receiver(post_save, sender=TimelineEntry)
+def count_created_entry(sender, instance, created, **kwargs):
+    if created:
+        update_daily_counts([instance])
+
+@receiver(post_delete, sender=TimelineEntry)
+def uncount_deleted_entry(sender, instance, **kwargs):
+    update_daily_counts([instance], sign=-1)
+
+@receiver(post_save, sender=TimelineEntry)
+def index_saved_entry(sender, instance, **kwargs):
+    index_entries([instance])
+
+@receiver(post_delete, sender=TimelineEntry)
+def unindex_deleted_entry(sender, instance, **kwargs):
+    remove_entries([instance.pk])
+
+# The search index holds the current user and section names, so renames refresh their entries
+
+def _cache_old_name(sender, instance, field, update_fields):
+    instance._old_search_name = None
+    if instance.pk and (update_fields is None or field in update_fields):
+        instance._old_search_name = sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+def _renamed(instance, field):
+    old_name = getattr(instance, "_old_search_name", None)
+    return old_name is not None and old_name != getattr(instance, field)
+
+@receiver(pre_save, sender=CustomUser)
+def cache_old_display_name(sender, instance, update_fields=None, **kwargs):
+    _cache_old_name(sender, instance, "display_name", update_fields)
+
+@receiver(post_save, sender=CustomUser)
+def reindex_renamed_user(sender, instance, **kwargs):
+    if _renamed(instance, "display_name"):
+        reindex_entries(user=instance)
+
+@receiver(pre_save, sender=Section)
+def cache_old_section_name(sender, instance, update_fields=None, **kwargs):
+    _cache_old_name(sender, instance, "name", update_fields)
+
+@receiver(post_save, sender=Section)
+def reindex_renamed_section(sender, instance, **kwargs):
+    if _renamed(instance, "name"):
+        reindex_entries(section=instance)
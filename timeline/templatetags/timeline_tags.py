@@ -1,33 +1,56 @@
+import re
 from datetime import timedelta
+from functools import lru_cache
 
 from django import template
-from django.contrib.auth import get_user_model
-from django.contrib.contenttypes.models import ContentType
-from django.urls import reverse
+from django.contrib.admin.utils import quote as admin_quote
+from django.template.loader import render_to_string
+from django.urls import reverse, NoReverseMatch
 from django.utils import timezone
-from django.utils.html import format_html
+from django.utils.html import format_html, escape
+from django.utils.safestring import mark_safe
 
+from timeline.fragments import get_or_render_fragment
 from timeline.models import TimelineEntry, TimelineTypes
-from timeline.utils import get_timeline_entries, get_recent_training_timeline, build_timeline_context, \
-    group_timeline_entries, get_active_context, get_user_query, get_start_date_query, get_section_query
+from timeline.search import search_terms
+from timeline.utils import build_timeline_context, get_active_context, get_user_query, get_start_date_query, \
+    get_section_query, get_timeline_feed_context
 
 
 register = template.Library()
 
+ADMIN_PK_PLACEHOLDER = "__pk__"
+
+@lru_cache(maxsize=None)
+def _admin_change_url_template(app_label, model_name):
+    """The admin change URL for a model with a placeholder for the pk, or None if it isn't registered."""
+    try:
+        return reverse(f"admin:{app_label}_{model_name}_change", args=[ADMIN_PK_PLACEHOLDER])
+    except NoReverseMatch:
+        return None
+
+def get_admin_change_url(obj):
+    """Admin change URL for obj; reverse() runs once per model rather than once per object."""
+    opts = obj._meta
+    template = _admin_change_url_template(opts.app_label, opts.model_name)
+    return template.replace(ADMIN_PK_PLACEHOLDER, admin_quote(str(obj.pk))) if template else None
+
+@register.filter
+def object_link(obj):
+    return get_object_link(obj)
+
 def get_object_link(obj):
+    if obj is None:
+        return ""
+
     if hasattr(obj, 'get_absolute_url'):
         return format_html('<a href="{}">{}</a>', obj.get_absolute_url(), str(obj))
 
-    # Fallback: use the admin change page if object has a ContentType
-    try:
-        ct = ContentType.objects.get_for_model(obj.__class__)
-        url = reverse(
-            f"admin:{ct.app_label}_{ct.model}_change",
-            args=[obj.pk],
-        )
+    # Fallback: use the admin change page
+    url = get_admin_change_url(obj)
+    if url:
         return format_html('<a href="{}">{}</a>', url, str(obj))
-    except Exception:
-        return str(obj)
+    return str(obj)
 
 
 @register.filter
@@ -40,17 +63,29 @@ def timeline_label(entry: TimelineEntry):
 
     return str(entry)
 
+@register.filter
+def highlight(value, query):
+    """Wrap words starting with any of the search terms in <mark>."""
+    text = escape(value or "")
+    terms = search_terms(query)
+    if not terms:
+        return mark_safe(text)
+    # The lookbehind keeps entities produced by escape() (e.g. &amp;) intact
+    pattern = re.compile(r"(?<![&#])\b(" + "|".join(re.escape(term) for term in terms) + r")\w*", re.IGNORECASE)
+    return mark_safe(pattern.sub(lambda match: f"<mark>{match.group(0)}</mark>", text))
+
 @register.filter
 def underscore_to_space(value):
     """Replace underscores with spaces."""
     return str(value).replace("_", " ")
 
-@register.inclusion_tag("timeline_list.html", takes_context=True)
+def _render_timeline_list(context):
+    return render_to_string("timeline_list.html", context)
+
+@register.simple_tag(takes_context=True)
 def render_orbat_timeline(context, user_qs=None, section=None):
     request = context.get("request")
 
-    context = {}
-
     active_context = get_active_context(request)
     user_query = get_user_query(user_qs, active_context["active_timeline_user"])
     section_query = get_section_query(section, active_context["active_timeline_section"])
@@ -58,49 +93,39 @@ def render_orbat_timeline(context, user_qs=None, section=None):
     default_date_range = None
     start_date_query = get_start_date_query(default_date_range, active_context["active_timeline_range"])
 
-    entries = get_timeline_entries(
-        user_qs=user_query,
-        section=section_query,
-        start_date=start_date_query,
-        exclude_types=[TimelineTypes.TRAINING_COMPLETED],
-    )
+    def render():
+        context = dict(active_context)
+        context.update(build_timeline_context("orbat", user_query, section_query, start_date_query))
+        context.update(get_timeline_feed_context("orbat", user_query, section_query, start_date_query))
+        return _render_timeline_list(context)
 
-    context.update(active_context)
-    context.update(build_timeline_context(entries))
-    context["entries"] = group_timeline_entries(entries)
-    return context
+    scope = (*active_context.values(), user_query, section_query, start_date_query)
+    return get_or_render_fragment("orbat", scope, render)
 
-@register.inclusion_tag("timeline_list.html", takes_context=True)
+@register.simple_tag(takes_context=True)
 def render_training_timeline(context, user_qs=None, section=None):
 
-    active_context = get_active_context(context)
-    active_user = active_context.get("active_timeline_user")
-    if active_user:
-        User = get_user_model()
-        active_user = User.objects.get(id=active_user)
-    else:
-        active_user = user_qs
-    active_section = active_context.get("active_timeline_section")
-    if active_section:
-        from orbat.models import Section
-        active_section = Section.objects.get(id=active_section)
-    else:
-        active_section = section
-
-    entries = get_recent_training_timeline(user_qs=active_user, section=active_section)
-    context = build_timeline_context(entries)
-    context.update(get_active_context(context))
-    context["entries"] = group_timeline_entries(entries)
-    return context
-
-@register.inclusion_tag("timeline_list.html")
+    active_context = get_active_context(context.get("request"))
+    active_user = get_user_query(user_qs, active_context["active_timeline_user"])
+    active_section = get_section_query(section, active_context["active_timeline_section"])
+    start_date = timezone.now() - timedelta(days=180)
+
+    def render():
+        context = build_timeline_context("training", active_user, active_section, start_date)
+        context.update(active_context)
+        context.update(get_timeline_feed_context("training", active_user, active_section, start_date))
+        return _render_timeline_list(context)
+
+    # The window moves with the clock, so key it by day rather than by the exact start time
+    scope = (*active_context.values(), active_user, active_section, start_date.date())
+    return get_or_render_fragment("training", scope, render)
+
+@register.simple_tag
 def render_timeline(user_qs=None, section=None, start_date=None, end_date=None):
-    User = get_user_model()
-    if user_qs is None:
-        user_qs = User.objects.all()
-    elif isinstance(user_qs, User):
-        user_qs = User.objects.filter(pk=user_qs.pk)
-    elif isinstance(user_qs, list):
-        user_qs = User.objects.filter(pk__in=[u.pk for u in user_qs])
-    entries = get_timeline_entries(user_qs, section, start_date, end_date)
-    return {"entries": group_timeline_entries(entries)}
\ No newline at end of file
+    if isinstance(user_qs, list):
+        user_qs = [user.pk for user in user_qs]
+
+    def render():
+        return _render_timeline_list(get_timeline_feed_context("all", user_qs, section, start_date, end_date))
+
+    return get_or_render_fragment("all", (user_qs, section, start_date, end_date), render)
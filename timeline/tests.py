@@ -1,3 +1,380 @@
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import QuerySet
+from django.template import Context, Template
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from orbat.models import Section, SectionAssignment, Role, HistoryRoleAssignment, HistorySectionAssignment, HistoryUsername, \
+    HistoryUserStatus
+from timeline.archive import archive_timeline
+from timeline.fragments import reset_fragment_stats
+from timeline.models import TimelineEntry, TimelineTypes, TimelineDailyCount, ArchivedTimelineEntry
+from timeline.rollup import get_daily_activity, rebuild_daily_counts, update_daily_counts
+from timeline.search import search_timeline, rebuild_search_index
+from timeline.templatetags.timeline_tags import object_link
+from timeline.writer import TimelineWriter, record_entry
+from timeline.utils import get_timeline_entries, get_user_query, get_timeline_facets, get_timeline_feed_context, TIMELINE_PAGE_SIZE, \
+    get_timeline_page, invalidate_timeline_caches, refresh_timeline_snapshots
+from users.models import UserStatus
+
+
+class TimelineFeedTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create(username="feed", display_name="Feed")
+        self.other = User.objects.create(username="other", display_name="Other")
+        now = timezone.now()
+        TimelineEntry.objects.bulk_create(
+            TimelineEntry(user=self.user, event_type=TimelineTypes.SECTION_JOINED, timestamp=now - timedelta(hours=i))
+            for i in range(TIMELINE_PAGE_SIZE + 5)
+        )
+        TimelineEntry.objects.create(user=self.other, event_type=TimelineTypes.TRAINING_COMPLETED, timestamp=now)
+
+    def test_no_user_filter_without_user_scope(self):
+        self.assertNotIn("IN (SELECT", str(get_timeline_entries().query))
+
+    def test_feed_pages_follow_on_without_gaps(self):
+        self.client.force_login(self.user)
+        first = get_timeline_feed_context("orbat")
+        first_ids = [entry.id for _, entries in first["entries"] for entry in entries]
+        self.assertEqual(len(first_ids), TIMELINE_PAGE_SIZE)
+
+        response = self.client.get(f"{reverse('timeline_feed')}?{first['next_page_query']}")
+        next_ids = [entry.id for _, entries in response.context["entries"] for entry in entries]
+        self.assertEqual(len(next_ids), 5)
+        self.assertIsNone(response.context["next_page_query"])
+        self.assertFalse(set(first_ids) & set(next_ids))
+
+    def test_next_page_does_not_repeat_the_header_of_a_day_split_across_pages(self):
+        busy = get_user_model().objects.create(username="busy", display_name="Busy")
+        noon = timezone.make_aware(timezone.datetime(2024, 5, 1, 12))
+        TimelineEntry.objects.bulk_create(
+            TimelineEntry(user=busy, event_type=TimelineTypes.SECTION_JOINED, timestamp=noon - timedelta(minutes=i))
+            for i in range(TIMELINE_PAGE_SIZE + 5)
+        )
+        self.client.force_login(busy)
+
+        first = get_timeline_feed_context("all", user_qs=busy)
+        self.assertIn("day=2024-05-01", first["next_page_query"])
+        response = self.client.get(f"{reverse('timeline_feed')}?{first['next_page_query']}")
+        self.assertEqual(len(response.context["entries"][0][1]), 5)
+        self.assertNotContains(response, "<time")
+
+        response = self.client.get(reverse("timeline_feed"), {"feed": "all", "user": busy.pk, "day": "2024-05-02"})
+        self.assertContains(response, "<time", count=1)
+        self.assertEqual(self.client.get(reverse("timeline_feed"), {"day": "May 1st"}).status_code, 400)
+
+    def test_user_feed_query_carries_the_user_filter(self):
+        self.client.force_login(self.user)
+        with self.assertNumQueries(2):
+            first = get_timeline_feed_context("all", user_qs=get_user_query(self.user))
+        self.assertIn(f"user={self.user.pk}", first["next_page_query"])
+
+        response = self.client.get(f"{reverse('timeline_feed')}?{first['next_page_query']}")
+        users = {entry.user_id for _, entries in response.context["entries"] for entry in entries}
+        self.assertEqual(users, {self.user.pk})
+
+    def test_malformed_feed_parameters_are_rejected(self):
+        self.client.force_login(self.user)
+        for query in ("start=yesterday", "end=2024-13-45T00:00:00", "user=not-a-uuid", "section=abc"):
+            response = self.client.get(f"{reverse('timeline_feed')}?feed=all&{query}")
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_cursor_keeps_microseconds_for_burst_entries(self):
+        burst = get_user_model().objects.create(username="burst", display_name="Burst")
+        moment = timezone.now().replace(microsecond=500000)
+        # Four entries sharing a timestamp, then six a few microseconds apart within the same millisecond
+        timestamps = [moment] * 4 + [moment + timedelta(microseconds=i) for i in range(1, 7)]
+        created = TimelineEntry.objects.bulk_create(
+            TimelineEntry(user=burst, event_type=TimelineTypes.SECTION_JOINED, timestamp=timestamp)
+            for timestamp in timestamps
+        )
+
+        seen, cursor = [], None
+        while True:
+            entries, cursor = get_timeline_page(TimelineEntry.objects.filter(user=burst), cursor=cursor, page_size=3)
+            seen += [entry.id for entry in entries]
+            if not cursor:
+                break
+        self.assertEqual(sorted(seen), sorted(entry.id for entry in created))
+
+    def test_related_objects_resolve_in_one_query_per_type(self):
+        section = Section.objects.create(name="Alpha", shorthand="A", type="infantry", max_size=8)
+        TimelineEntry.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            for user in (self.user, self.other):
+                SectionAssignment.objects.create(user=user, section=section)
+
+        entries = get_timeline_entries().filter(event_type=TimelineTypes.SECTION_JOINED)
+        # The page, then one query for the section assignments with their users and section
+        with self.assertNumQueries(2):
+            page, _ = get_timeline_page(entries)
+            links = [object_link(entry.related_object) for entry in page]
+        self.assertEqual(len(links), 2)
+        self.assertTrue(all(link.startswith("<a href=") for link in links))
+
+    def test_backfilled_history_objects_resolve_in_one_query_per_type(self):
+        TimelineEntry.objects.all().delete()
+        for user in (self.user, self.other):
+            status = HistoryUserStatus.objects.create(user=user, status=UserStatus.ACTIVE, start_date=date(2024, 1, 1))
+            TimelineEntry.objects.create(user=user, event_type=TimelineTypes.UNIT_JOINED, related_object=status)
+
+        # The page, then one query for the status rows with their users
+        with self.assertNumQueries(2):
+            page, _ = get_timeline_page(get_timeline_entries())
+            labels = [str(entry.related_object) for entry in page]
+        self.assertEqual(len(labels), 2)
+
+    def test_facets_are_counted_and_refreshed_on_new_entries(self):
+        self.assertEqual(
+            [(user["display_name"], user["count"]) for user in get_timeline_facets()["users"]],
+            [("Feed", TIMELINE_PAGE_SIZE + 5), ("Other", 1)],
+        )
+        with self.assertNumQueries(0):
+            get_timeline_facets()
+
+        TimelineEntry.objects.create(user=self.other, event_type=TimelineTypes.UNIT_JOINED)
+        users = get_timeline_facets()["users"]
+        self.assertEqual(users[1]["count"], 2)
+
+    def test_facets_for_a_moving_window_are_cached_for_the_day(self):
+        start = timezone.localtime().replace(hour=12) - timedelta(days=90)
+        facets = get_timeline_facets("orbat", user_qs=self.user, start_date=start)
+        self.assertEqual([user["display_name"] for user in facets["users"]], ["Feed"])
+        with self.assertNumQueries(0):
+            get_timeline_facets("orbat", user_qs=get_user_query(self.user), start_date=start + timedelta(minutes=5))
+
+    def test_facets_count_archived_entries(self):
+        ArchivedTimelineEntry.objects.create(
+            id=10 ** 6, user=self.other, event_type=TimelineTypes.SECTION_JOINED,
+            timestamp=timezone.now() - timedelta(days=400), merged_count=3,
+        )
+        invalidate_timeline_caches()
+        users = {user["display_name"]: user["count"] for user in get_timeline_facets()["users"]}
+        self.assertEqual(users, {"Feed": TIMELINE_PAGE_SIZE + 5, "Other": 4})
+
+
+class TimelineSnapshotTests(TestCase):
+    def test_snapshots_use_name_and_section_on_the_day(self):
+        user = get_user_model().objects.create(username="renamed", display_name="New Name")
+        section = Section.objects.create(name="Alpha", shorthand="A", type="infantry", max_size=8)
+        HistoryUsername.objects.create(user=user, username="Old Name", start_date=date(2024, 1, 1), end_date=date(2024, 12, 31))
+        HistorySectionAssignment.objects.create(user=user, section=section, start_date=date(2024, 1, 1))
+        old = TimelineEntry.objects.create(
+            user=user, event_type=TimelineTypes.ROLE_ASSIGNED, timestamp=timezone.make_aware(timezone.datetime(2024, 5, 1))
+        )
+
+        refresh_timeline_snapshots(TimelineEntry.objects.filter(pk=old.pk))
+        old.refresh_from_db()
+        self.assertEqual((old.snapshot_name, old.snapshot_section), ("Old Name", "A"))
+
+
+class TimelineWriterTests(TestCase):
+    def test_batch_queues_one_flush_and_drops_rolled_back_savepoints(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            user = get_user_model().objects.create(username="batch", display_name="Batch")
+            for i in range(50):
+                record_entry(TimelineTypes.ROLE_ASSIGNED, user, description=f"Role {i}")
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                record_entry(TimelineTypes.ROLE_ASSIGNED, user, description="Rolled back")
+                raise RuntimeError
+            with transaction.atomic():
+                # Already queued by the enclosing level
+                record_entry(TimelineTypes.ROLE_ASSIGNED, user, description="Role 0")
+            record_entry(TimelineTypes.AWARD_RECEIVED, user, description="After rollback")
+
+        flushes = [callback for callback in callbacks if getattr(callback, "__self__", None).__class__ is TimelineWriter]
+        self.assertLessEqual(len(flushes), 3)
+        descriptions = set(TimelineEntry.objects.filter(user=user).values_list("description", flat=True))
+        self.assertIn("Role 49", descriptions)
+        self.assertNotIn("Rolled back", descriptions)
+        self.assertIn("After rollback", descriptions)
+        self.assertEqual(TimelineEntry.objects.filter(user=user, description="Role 0").count(), 1)
+
+
+class TimelineBackfillTests(TestCase):
+    def test_backfill_skips_events_the_live_timeline_already_has(self):
+        section = Section.objects.create(name="Alpha", shorthand="A", type="infantry", max_size=8)
+        medic = Role.objects.create(name="Medic", shorthand="MED")
+        at = Role.objects.create(name="Anti-Tank", shorthand="AT")
+        with self.captureOnCommitCallbacks(execute=True):
+            user = get_user_model().objects.create(username="backfill", display_name="Backfill")
+            assignment = SectionAssignment.objects.create(user=user, section=section)
+        today = timezone.localdate(assignment.start_date)
+        HistorySectionAssignment.objects.create(user=user, section=section, start_date=today)
+        for role in (medic, at):
+            HistoryRoleAssignment.objects.create(
+                user=user, section=section, role=role, role_name_at_assignment=role.name, start_date=today,
+            )
+
+        call_command("backfill_timeline", stdout=StringIO())
+        call_command("backfill_timeline", stdout=StringIO())
+
+        entries = TimelineEntry.objects.filter(user=user)
+        self.assertEqual(entries.filter(event_type=TimelineTypes.SECTION_JOINED).count(), 1)
+        self.assertEqual(
+            sorted(entries.filter(event_type=TimelineTypes.ROLE_ASSIGNED).values_list("description", flat=True)),
+            ["Anti-Tank", "Medic"],
+        )
+
+
+class TimelineRollupTests(TestCase):
+    def test_incremental_counts_match_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            user = get_user_model().objects.create(username="busy", display_name="Busy")
+            record_entry(TimelineTypes.ROLE_ASSIGNED, user, description="Medic")
+            record_entry(TimelineTypes.ROLE_ASSIGNED, user, description="Anti-Tank")
+        TimelineEntry.objects.filter(description="Medic").delete()
+
+        today = timezone.localdate()
+        incremental = get_daily_activity(today, today)
+        rebuild_daily_counts()
+        self.assertEqual(incremental, get_daily_activity(today, today))
+        self.assertEqual(get_daily_activity(today, today, user=user), {today: TimelineEntry.objects.count()})
+        self.assertEqual(TimelineDailyCount.objects.filter(event_type=TimelineTypes.ROLE_ASSIGNED).get().count, 1)
+
+    def test_activity_api_rejects_years_out_of_range(self):
+        self.client.force_login(get_user_model().objects.create(username="viewer", display_name="Viewer"))
+        for year in ("0", "10000", "last"):
+            response = self.client.get("/api/timeline/activity/", {"year": year})
+            self.assertEqual(response.status_code, 400, year)
+        response = self.client.get("/api/timeline/activity/", {"year": "2024"})
+        self.assertEqual(response.json()["start"], "2024-01-01")
+
+    def test_concurrent_first_write_of_a_day_is_merged(self):
+        user = get_user_model().objects.create(username="racer", display_name="Racer")
+        entry = TimelineEntry(user=user, event_type=TimelineTypes.ROLE_ASSIGNED, timestamp=timezone.now())
+        update = QuerySet.update
+        raced = []
+
+        def racing_update(queryset, **kwargs):
+            if not raced:
+                # Another flush creates the day's row right after our update found nothing
+                raced.append(TimelineDailyCount.objects.create(
+                    date=timezone.localdate(entry.timestamp), event_type=entry.event_type, count=1,
+                ))
+                return 0
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, "update", racing_update):
+            update_daily_counts([entry])
+        self.assertEqual(TimelineDailyCount.objects.get(event_type=TimelineTypes.ROLE_ASSIGNED).count, 2)
+
+
+class TimelineSearchTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = get_user_model().objects.create(username="medic", display_name="Doc Holliday")
+            record_entry(TimelineTypes.TRAINING_COMPLETED, self.user, description="Combat Medic certification")
+            record_entry(TimelineTypes.AWARD_RECEIVED, self.user, description="Operation Thunder & Lightning")
+
+    def test_search_is_ranked_paged_and_kept_up_to_date(self):
+        results, has_next = search_timeline("medic cert")
+        self.assertEqual([entry.description for entry in results], ["Combat Medic certification"])
+        self.assertFalse(has_next)
+
+        self.assertEqual(len(search_timeline("holliday", page_size=1)[0]), 1)
+        self.assertTrue(search_timeline("holliday", page_size=1)[1])
+
+        TimelineEntry.objects.filter(description__startswith="Combat").delete()
+        self.assertEqual(search_timeline("medic")[0], [])
+        self.assertEqual(rebuild_search_index(), TimelineEntry.objects.count())
+
+    def test_renamed_users_and_sections_are_found_by_their_new_name(self):
+        section = Section.objects.create(name="Alpha", shorthand="A", type="infantry", max_size=8)
+        with self.captureOnCommitCallbacks(execute=True):
+            record_entry(TimelineTypes.SECTION_JOINED, self.user, section=section)
+
+        self.user.display_name = "Wyatt Earp"
+        self.user.save()
+        section.name = "Tombstone"
+        section.save()
+
+        # Joined the unit, two records and the section join; the old name stays in each snapshot
+        self.assertEqual(len(search_timeline("wyatt")[0]), 4)
+        self.assertEqual([entry.event_type for entry in search_timeline("tombstone")[0]], [TimelineTypes.SECTION_JOINED])
+        self.assertEqual(search_timeline("alpha")[0], [])
+
+    def test_search_page_highlights_matches(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("timeline_search"), {"q": "thunder"})
+        self.assertContains(response, "Operation <mark>Thunder</mark> &amp; Lightning", html=False)
+
+
+class TimelineFragmentTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = get_user_model().objects.create(username="frag", display_name="Fragment", is_staff=True)
+            record_entry(TimelineTypes.SECTION_JOINED, self.user, description="First posting")
+        reset_fragment_stats()
+
+    def render(self):
+        return Template("{% load timeline_tags %}{% render_timeline user_qs=user %}").render(Context({"user": self.user}))
+
+    def test_fragment_is_cached_until_an_entry_is_written(self):
+        self.assertIn("First posting", self.render())
+        with self.assertNumQueries(0):
+            self.assertIn("First posting", self.render())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record_entry(TimelineTypes.SECTION_LEFT, self.user, description="Second posting")
+        self.assertIn("Second posting", self.render())
+
+        self.client.force_login(self.user)
+        stats = self.client.get("/api/timeline/fragment_stats/").json()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+
+
+class TimelineArchiveTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="veteran", display_name="Veteran")
+        self.section = Section.objects.create(name="Alpha", shorthand="A", type="infantry", max_size=8)
+        old = timezone.now() - timedelta(days=400)
+        TimelineEntry.objects.all().delete()
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(user=self.user, section=self.section, event_type=event_type,
+                              timestamp=old + timedelta(minutes=i), description=f"Flip {i}")
+                for i, event_type in enumerate([TimelineTypes.SECTION_JOINED, TimelineTypes.SECTION_LEFT] * 2
+                                               + [TimelineTypes.SECTION_JOINED])
+            ]
+            + [TimelineEntry(user=self.user, event_type=TimelineTypes.AWARD_RECEIVED, timestamp=old, description="Medal")]
+            + [TimelineEntry(user=self.user, event_type=TimelineTypes.ROLE_ASSIGNED, description="Recent")]
+        )
+        rebuild_daily_counts()
+        rebuild_search_index()
+
+    def test_old_entries_are_compacted_and_still_read(self):
+        moved, archived = archive_timeline(chunk_size=2)
+        self.assertEqual((moved, archived), (6, 2))
+        self.assertEqual(TimelineEntry.objects.count(), 1)
+
+        # Two join/leave pairs cancel out, leaving the final join standing for all five
+        joined = ArchivedTimelineEntry.objects.get(event_type=TimelineTypes.SECTION_JOINED)
+        self.assertEqual((joined.merged_count, joined.description), (5, "Flip 4"))
+        self.assertFalse(ArchivedTimelineEntry.objects.filter(event_type=TimelineTypes.SECTION_LEFT).exists())
+
+        feed = get_timeline_feed_context("all", user_qs=get_user_query(self.user))
+        descriptions = [entry.description for _, entries in feed["entries"] for entry in entries]
+        self.assertEqual(descriptions, ["Recent", "Flip 4", "Medal"])
+
+        self.assertEqual([entry.description for entry in search_timeline("medal")[0]], ["Medal"])
+        day = timezone.localdate(joined.timestamp)
+        self.assertEqual(get_daily_activity(day, day, user=self.user)[day], 6)
+        rebuild_daily_counts()
+        self.assertEqual(get_daily_activity(day, day)[day], 6)
 
-# Create your tests here.
+    def test_a_day_that_ends_where_it_started_is_dropped(self):
+        TimelineEntry.objects.filter(description="Flip 4").delete()
+        moved, archived = archive_timeline()
+        self.assertEqual((moved, archived), (5, 1))
+        self.assertEqual(
+            list(ArchivedTimelineEntry.objects.values_list("event_type", flat=True)), [TimelineTypes.AWARD_RECEIVED],
+        )
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from timeline.views import TimelineFeedView, TimelineSearchView
+
+
+urlpatterns = [
+    path("feed/", TimelineFeedView.as_view(), name="timeline_feed"),
+    path("search/", TimelineSearchView.as_view(), name="timeline_search"),
+]
@@ -1,26 +1,44 @@
-from collections import defaultdict
-from datetime import timedelta, datetime
+import hashlib
+from datetime import timedelta, datetime, time
+from urllib.parse import urlencode
 from uuid import UUID
 
 from django.contrib.auth import get_user_model
-from django.contrib.contenttypes.models import ContentType
+from django.contrib.contenttypes.prefetch import GenericPrefetch
+from django.core.cache import cache
+from django.db.models import Count, F, Q, OuterRef, QuerySet, Subquery, Sum, prefetch_related_objects
+from django.db.models.functions import Coalesce, TruncDate
 from django.utils import timezone
 
-from timeline.models import TimelineEntry, TimelineTypes
+from core.cache import bump_cache_version, versioned_key
+from core.pagination import encode_cursor, keyset_paginate
+from timeline.models import TimelineEntry, TimelineTypes, ArchivedTimelineEntry
+from timeline.search import index_entries
 
 
-def add_entry(event_type, user, section=None, description="", related_object=None, created_by=None, timestamp=None):
-    entry = TimelineEntry(
-        event_type=event_type,
-        user=user,
+TIMELINE_NAMESPACE = "timeline"
+TIMELINE_ORDERING = ["-timestamp", "-id"]
+TIMELINE_PAGE_SIZE = 50
+
+# Event filters for each feed that can be paged through the timeline feed endpoint
+TIMELINE_FEEDS = {
+    "all": {},
+    "orbat": {"exclude_types": [TimelineTypes.TRAINING_COMPLETED]},
+    "training": {"event_types": [TimelineTypes.TRAINING_COMPLETED]},
+}
+
+
+def add_entry(event_type, user, section=None, description="", related_object=None, timestamp=None):
+    """Queue a timeline entry, written in bulk when the current transaction commits."""
+    from timeline.writer import record_entry
+    return record_entry(
+        event_type,
+        user,
         section=section,
         description=description,
-        created_by=created_by,
-        timestamp=timestamp or timezone.now()
+        related_object=related_object,
+        timestamp=timestamp,
     )
-    if related_object:
-        entry.content_type = ContentType.objects.get_for_model(related_object)
-        entry.object_id = related_object.id
 
 def get_recent_orbat_timeline(user_qs=None, section=None):
     three_months_ago = timezone.now() - timedelta(days=90)
@@ -41,18 +59,19 @@ def get_recent_training_timeline(user_qs=None, section=None):
         event_types=[TimelineTypes.TRAINING_COMPLETED],
     )
 
-def get_timeline_entries(user_qs=None, section=None, start_date=None, end_date=None, event_types=None, exclude_types=None):
+def get_timeline_entries(user_qs=None, section=None, start_date=None, end_date=None, event_types=None, exclude_types=None,
+                         model=TimelineEntry):
     """
     Get timeline entries scoped to users and optionally a section and date range.
+    user_qs=None means every user, so no user filter is applied at all.
+    Pass model=ArchivedTimelineEntry for the same filters on the archive.
     """
-    from django.contrib.auth import get_user_model
-    User = get_user_model()
-
-    if not user_qs or not user_qs.exists():
-        user_qs = User.objects.all()
-
-    qs = TimelineEntry.objects.filter(user__in=user_qs)
+    qs = model.objects.all()
 
+    if isinstance(user_qs, (get_user_model(), UUID, str)):
+        qs = qs.filter(user=user_qs)
+    elif user_qs is not None:
+        qs = qs.filter(user__in=user_qs)
     if section:
         qs = qs.filter(section=section)
     if start_date:
@@ -65,22 +84,203 @@ def get_timeline_entries(user_qs=None, section=None, start_date=None, end_date=N
         qs = qs.exclude(event_type__in=exclude_types)
     return qs
 
-def build_timeline_context(timeline_qs):
+def _related_object_querysets():
+    """Querysets for related objects whose __str__ follows foreign keys, so labels don't add queries."""
+    from orbat.models import (
+        SectionAssignment, RoleSlotAssignment, HistorySectionAssignment, HistoryRoleAssignment, HistoryUserStatus,
+    )
+    from training.models import UserQualification
+
+    return [
+        SectionAssignment.objects.select_related("user", "section"),
+        RoleSlotAssignment.objects.select_related("role", "section_slot__section"),
+        UserQualification.objects.select_related("user", "qualification"),
+        # Backfilled entries point at the history rows
+        HistorySectionAssignment.objects.select_related("user"),
+        HistoryRoleAssignment.objects.select_related("user"),
+        HistoryUserStatus.objects.select_related("user"),
+    ]
+
+def prefetch_related_objects_for(entries):
+    """
+    Resolve related_object for a list of entries with one query per content type
+    instead of one per entry. Deleted objects resolve to None.
+    """
+    prefetch_related_objects(entries, GenericPrefetch("related_object", _related_object_querysets()))
+    return entries
+
+def get_archive_boundary():
+    """Timestamp of the newest archived entry, or None if nothing has been archived."""
+    key = versioned_key(TIMELINE_NAMESPACE, "archive_boundary")
+    cached = cache.get(key)
+    if cached is None:
+        newest = ArchivedTimelineEntry.objects.order_by("-timestamp").values_list("timestamp", flat=True).first()
+        cached = (newest,)
+        cache.set(key, cached, timeout=None)
+    return cached[0]
+
+def get_timeline_page(entries_qs, cursor=None, page_size=TIMELINE_PAGE_SIZE, archive_qs=None):
+    """
+    One page of entries, newest first, keyset-paginated on (timestamp, id).
+    With archive_qs, pages that reach back past the newest archived entry are merged
+    with the archive, so paging continues across the cutoff. Archived entries keep their
+    ids, so the same cursor works on both tables.
+    Returns (entries, next_cursor).
+    """
+    entries_qs = entries_qs.select_related("user", "section")
+    entries, next_cursor = keyset_paginate(entries_qs, TIMELINE_ORDERING, cursor=cursor, page_size=page_size)
+
+    boundary = get_archive_boundary() if archive_qs is not None else None
+    if boundary is not None and not (next_cursor and entries[-1].timestamp > boundary):
+        archive_qs = archive_qs.select_related("user", "section")
+        archived, archive_cursor = keyset_paginate(archive_qs, TIMELINE_ORDERING, cursor=cursor, page_size=page_size)
+        merged = sorted(entries + archived, key=lambda entry: (entry.timestamp, entry.id), reverse=True)
+        has_more = len(merged) > page_size or next_cursor or archive_cursor
+        entries = merged[:page_size]
+        next_cursor = encode_cursor([entries[-1].timestamp, entries[-1].id]) if has_more else None
+
+    return prefetch_related_objects_for(entries), next_cursor
+
+def group_entries_by_date(entries):
+    """Group an already ordered list of entries into [(date, [entries]), ...]."""
+    grouped = []
+    for entry in entries:
+        date = entry.timestamp.date()
+        if not grouped or grouped[-1][0] != date:
+            grouped.append((date, []))
+        grouped[-1][1].append(entry)
+    return grouped
+
+def get_timeline_feed_query(feed, user_qs=None, section=None, start_date=None, end_date=None, cursor=None,
+                            last_date=None):
+    """
+    Query string for the timeline feed endpoint that continues the same timeline from cursor.
+    last_date is the day the previous page ended on, so the next page doesn't repeat its header.
+    Users are passed on as given, so scope by a user, their pks or a section rather than a
+    queryset: a queryset has no compact form and puts every pk it matches in the URL.
+    """
+    User = get_user_model()
+    params = [("feed", feed)]
+
+    if isinstance(user_qs, User):
+        params.append(("user", user_qs.pk))
+    elif isinstance(user_qs, (UUID, str)):
+        params.append(("user", user_qs))
+    elif isinstance(user_qs, QuerySet):
+        params.extend(("user", user_id) for user_id in user_qs.values_list("pk", flat=True))
+    elif user_qs is not None:
+        params.extend(("user", getattr(user, "pk", user)) for user in user_qs)
+
+    if section:
+        params.append(("section", getattr(section, "pk", section)))
+    if start_date:
+        params.append(("start", start_date.isoformat()))
+    if end_date:
+        params.append(("end", end_date.isoformat()))
+    if cursor:
+        params.append(("cursor", cursor))
+    if last_date:
+        params.append(("day", last_date.isoformat()))
+    return urlencode(params)
+
+def get_timeline_feed_context(feed="all", user_qs=None, section=None, start_date=None, end_date=None, cursor=None,
+                              continued_date=None):
+    """
+    Context for one page of a timeline feed: grouped entries plus the query for the next page.
+    Used by the timeline inclusion tags for the first page and by TimelineFeedView after that.
+    continued_date is the day the previous page ended on; a first group on that day gets no header.
+    """
+    entries_qs = get_timeline_entries(user_qs, section, start_date, end_date, **TIMELINE_FEEDS[feed])
+    archive_qs = get_timeline_entries(
+        user_qs, section, start_date, end_date, model=ArchivedTimelineEntry, **TIMELINE_FEEDS[feed],
+    )
+    entries, next_cursor = get_timeline_page(entries_qs, cursor=cursor, archive_qs=archive_qs)
+
+    grouped = group_entries_by_date(entries)
+    next_page_query = None
+    if next_cursor:
+        next_page_query = get_timeline_feed_query(
+            feed, user_qs, section, start_date, end_date, next_cursor, last_date=grouped[-1][0],
+        )
+
+    return {
+        "entries": grouped,
+        "continued_date": continued_date,
+        "next_page_query": next_page_query,
+    }
+
+def _local_day(value):
+    """The local calendar day of a date or datetime, None for None."""
+    if isinstance(value, datetime):
+        return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+    return value
+
+def _facet_scope(user_qs):
+    """A stable string for a user scope, whatever form it was given in."""
+    if user_qs is None:
+        return "all"
+    if isinstance(user_qs, QuerySet):
+        return str(user_qs.query)
+    if isinstance(user_qs, (get_user_model(), UUID, str)):
+        user_qs = [user_qs]
+    return ",".join(sorted(str(getattr(user, "pk", user)) for user in user_qs))
+
+def get_timeline_facets(feed="all", user_qs=None, section=None, start_date=None, end_date=None):
+    """
+    Users and sections appearing in a timeline feed, with entry counts, for the filter dropdowns.
+    Takes the same filters as get_timeline_feed_context, widened to whole days so a window
+    that moves with the clock keeps hitting the cache, and counts archived entries too.
+    Two grouped queries per table, cached until the timeline version changes.
+    """
+    start_day, end_day = _local_day(start_date), _local_day(end_date)
+    scope = "|".join(str(part) for part in (
+        feed, _facet_scope(user_qs), getattr(section, "pk", section), start_day, end_day,
+    ))
+    key = versioned_key(TIMELINE_NAMESPACE, "facets", hashlib.md5(scope.encode()).hexdigest())
+    facets = cache.get(key)
+    if facets is not None:
+        return facets
+
+    start = timezone.make_aware(datetime.combine(start_day, time.min)) if start_day else None
+    end = timezone.make_aware(datetime.combine(end_day, time.max)) if end_day else None
+    # Archived rows stand for merged_count entries each
+    sources = [(TimelineEntry, Count("id"))]
+    if get_archive_boundary() is not None:
+        sources.append((ArchivedTimelineEntry, Sum("merged_count")))
+
+    users, sections = {}, {}
+    for model, count in sources:
+        timeline_qs = get_timeline_entries(user_qs, section, start, end, model=model, **TIMELINE_FEEDS[feed]).order_by()
+        for row in timeline_qs.values("user", "user__display_name").annotate(count=count):
+            user = users.setdefault(row["user"], {"pk": row["user"], "display_name": row["user__display_name"], "count": 0})
+            user["count"] += row["count"]
+        for row in timeline_qs.filter(section__isnull=False).values("section", "section__name").annotate(count=count):
+            section_facet = sections.setdefault(row["section"], {"pk": row["section"], "name": row["section__name"], "count": 0})
+            section_facet["count"] += row["count"]
+
+    facets = {
+        "users": sorted(users.values(), key=lambda user: user["display_name"] or ""),
+        "sections": sorted(sections.values(), key=lambda section_facet: section_facet["name"] or ""),
+    }
+    cache.set(key, facets, timeout=60 * 60)
+    return facets
+
+def invalidate_timeline_caches():
+    bump_cache_version(TIMELINE_NAMESPACE)
+
+def build_timeline_context(feed="all", user_qs=None, section=None, start_date=None, end_date=None):
     """
     Build context for timeline filters: available users, sections, and date ranges.
     Returns a dict to merge into the template context.
     """
-    # Unique users and sections from the timeline queryset
-    timeline_qs = timeline_qs.select_related('user', 'section')
-    users = sorted({entry.user for entry in timeline_qs}, key=lambda u: getattr(u, 'display_name', str(u)))
-    sections = sorted({entry.section for entry in timeline_qs if entry.section}, key=lambda s: s.name)
+    facets = get_timeline_facets(feed, user_qs, section, start_date, end_date)
 
     context = {}
 
-    if len(users) > 1:
-        context["timeline_scope_users"] = users
-    if len(sections) > 1:
-        context["timeline_scope_sections"] = sections
+    if len(facets["users"]) > 1:
+        context["timeline_scope_users"] = facets["users"]
+    if len(facets["sections"]) > 1:
+        context["timeline_scope_sections"] = facets["sections"]
 
     # Date range buttons
     now = timezone.now().date()
@@ -95,14 +295,8 @@ def build_timeline_context(timeline_qs):
     return context
 
 def group_timeline_entries(entries_qs):
-    entries_qs = entries_qs.select_related('user', 'section').order_by('-timestamp')
-
-    grouped = defaultdict(list)
-    for entry in entries_qs.order_by('-timestamp'):
-        grouped[entry.timestamp.date()].append(entry)
-
-    # sorted by date descending
-    return sorted(grouped.items(), key=lambda x: x[0], reverse=True)
+    entries_qs = entries_qs.select_related('user', 'section').order_by(*TIMELINE_ORDERING)
+    return group_entries_by_date(entries_qs)
 
 def get_active_context(request):
     active_user = request.GET.get("timeline_user") if request else None
@@ -115,36 +309,45 @@ def get_active_context(request):
         "active_timeline_range": active_range,
     }
 
+def parse_uuid(value):
+    """The UUID in value, or None if it isn't one."""
+    try:
+        return UUID(str(value))
+    except ValueError:
+        return None
+
 def get_user_query(user_qs, active_timeline_user=None):
+    """
+    The user scope for get_timeline_entries. Kept as a user, a pk or a list of pks where
+    possible so the feed query for the next page stays short.
+    """
     User = get_user_model()
 
     # If an active user is set via the query param
     if active_timeline_user:
-        return User.objects.filter(pk=active_timeline_user)
+        return parse_uuid(active_timeline_user) or User.objects.none()
 
-    # If a single User instance
-    if isinstance(user_qs, User):
-        return User.objects.filter(pk=user_qs.pk)
+    # If a single User instance or UUID
+    if isinstance(user_qs, (User, UUID)):
+        return user_qs
 
-    # If a single UUID
-    if isinstance(user_qs, UUID) or isinstance(user_qs, str):
-        return User.objects.filter(pk=user_qs)
+    if isinstance(user_qs, str):
+        return parse_uuid(user_qs) or User.objects.none()
 
-    # If None, return all users
+    # If None, don't scope by user at all
     if user_qs is None:
-
-        return User.objects.all()
+        return None
 
     # If it's already a queryset or iterable of PKs
     try:
         # If it's a queryset, return as-is
         if hasattr(user_qs, "exists"):
             return user_qs
-        # If it's an iterable of UUIDs/PKs, wrap in queryset
-        return User.objects.filter(pk__in=list(user_qs))
+        # If it's an iterable of users or UUIDs/PKs, keep their pks
+        return [getattr(user, "pk", user) for user in user_qs]
     except Exception:
         # Fallback to all users
-        return User.objects.all()
+        return None
 
 
 def get_section_query(section_qs, active_timeline_section=None):
@@ -164,4 +367,48 @@ def get_start_date_query(default_start, range_str):
         return timezone.make_aware(datetime.combine(dt, datetime.min.time()))
     except ValueError:
         # If parsing fails, fallback to default
-        return default_start
\ No newline at end of file
+        return default_start
+
+def historical_snapshots(entries_qs):
+    """
+    Annotate entries with the member's name (hist_name) and section shorthand (hist_section)
+    on the day of the entry, resolved by joining against the history intervals in SQL.
+    """
+    from orbat.models import HistoryUsername, HistorySectionAssignment
+
+    entry_date = OuterRef("entry_date")
+    active_on_date = Q(start_date__lte=entry_date) & (Q(end_date__isnull=True) | Q(end_date__gte=entry_date))
+
+    names = HistoryUsername.objects.filter(active_on_date, user=OuterRef("user")).order_by("-start_date")
+    sections = HistorySectionAssignment.objects.filter(active_on_date, user=OuterRef("user")).order_by("-start_date")
+
+    return entries_qs.annotate(entry_date=TruncDate("timestamp")).annotate(
+        hist_name=Coalesce(Subquery(names.values("username")[:1]), F("user__display_name")),
+        hist_section=Coalesce(Subquery(sections.values("section__shorthand")[:1]), F("section__shorthand")),
+    )
+
+def refresh_timeline_snapshots(entries_qs, chunk_size=1000):
+    """
+    Rewrite snapshot_name/snapshot_section from history for entries_qs,
+    walking the table by id in chunks of one select and one bulk update each.
+    Returns the number of entries updated.
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        chunk = list(
+            historical_snapshots(entries_qs.filter(id__gt=last_id))
+            .order_by("id")
+            .only("id", "snapshot_name", "snapshot_section")[:chunk_size]
+        )
+        if not chunk:
+            break
+        for entry in chunk:
+            entry.snapshot_name = entry.hist_name
+            entry.snapshot_section = entry.hist_section
+        updated += TimelineEntry.objects.bulk_update(chunk, ["snapshot_name", "snapshot_section"])
+        index_entries(TimelineEntry.objects.select_related("user", "section").filter(id__in=[e.id for e in chunk]))
+        last_id = chunk[-1].id
+    if updated:
+        invalidate_timeline_caches()
+    return updated
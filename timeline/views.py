@@ -1,3 +1,84 @@
-from django.shortcuts import render
+from urllib.parse import urlencode
 
-# Create your views here.
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import BadRequest
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.decorators import method_decorator
+from django.views.generic import TemplateView
+
+from core.views import UnitHubBaseView
+from timeline.search import search_timeline
+from timeline.utils import get_timeline_feed_context, parse_uuid, TIMELINE_FEEDS
+
+
+@method_decorator(login_required, name="dispatch")
+class TimelineFeedView(TemplateView):
+    """
+    The next page of a timeline, fetched by the "load more" row at the bottom of each page.
+    Takes the query string built by get_timeline_feed_query; anything else is a 400.
+    """
+    template_name = "partials/timeline_entries.html"
+
+    def _get_date_param(self, name, parse=parse_datetime):
+        value = self.request.GET.get(name)
+        if not value:
+            return None
+        try:
+            parsed = parse(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise BadRequest(f"Invalid {name} date")
+        return parsed
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        params = self.request.GET
+
+        feed = params.get("feed")
+        if feed not in TIMELINE_FEEDS:
+            feed = "all"
+
+        user_ids = [parse_uuid(user_id) for user_id in params.getlist("user")]
+        if None in user_ids:
+            raise BadRequest("Invalid user")
+        section = params.get("section")
+        if section and not section.isdigit():
+            raise BadRequest("Invalid section")
+
+        context.update(get_timeline_feed_context(
+            feed,
+            user_qs=user_ids or None,
+            section=int(section) if section else None,
+            start_date=self._get_date_param("start"),
+            end_date=self._get_date_param("end"),
+            cursor=params.get("cursor"),
+            continued_date=self._get_date_param("day", parse=parse_date),
+        ))
+        return context
+
+
+@method_decorator(login_required, name="dispatch")
+class TimelineSearchView(UnitHubBaseView):
+    """Full-text search over timeline descriptions, names and sections, best match first."""
+    template_name = "timeline_search.html"
+    title = "Timeline search"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        query = self.request.GET.get("q", "").strip()
+        page = self.request.GET.get("page", "1")
+        page = int(page) if page.isdigit() and int(page) > 0 else 1
+
+        results, has_next = search_timeline(query, page=page) if query else ([], False)
+
+        context["breadcrumbs"] = [
+            {"name": "Timeline", "url": None},
+            {"name": "Search", "url": None},
+        ]
+        context["query"] = query
+        context["results"] = results
+        context["page"] = page
+        context["previous_page_query"] = urlencode({"q": query, "page": page - 1}) if page > 1 else None
+        context["next_page_query"] = urlencode({"q": query, "page": page + 1}) if has_next else None
+        return context
@@ -0,0 +1,105 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.transactions import get_commit_buffer
+from timeline.models import TimelineEntry
+from timeline.rollup import update_daily_counts
+from timeline.search import index_entries
+from timeline.utils import invalidate_timeline_caches
+
+
+SNAPSHOT_NAME_LENGTH = TimelineEntry._meta.get_field("snapshot_name").max_length
+
+
+class TimelineWriter:
+    """
+    Collects TimelineEntry rows and writes them in a single bulk_create.
+    The same event for the same user and object is only kept once per flush,
+    so several signals describing one change produce one entry.
+    snapshot_name and snapshot_section record the member's name and section at write time,
+    so rendering never has to look them up in the history tables.
+    bulk_create skips post_save, so flush() updates the daily rollup and search index and
+    bumps the timeline cache version itself.
+    """
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+        self.entries = []
+        self.seen = set()
+        # Writer of the enclosing savepoint, whose entries also count as already queued
+        self.parent = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, event_type, user, section=None, description="", related_object=None, timestamp=None,
+            snapshot_name=None, snapshot_section=None):
+        entry = TimelineEntry(
+            event_type=event_type,
+            user=user,
+            section=section,
+            description=description,
+            timestamp=timestamp or timezone.now(),
+            snapshot_name=(snapshot_name or user.display_name)[:SNAPSHOT_NAME_LENGTH],
+            snapshot_section=snapshot_section or getattr(section, "shorthand", None),
+        )
+        if related_object is not None:
+            # get_for_model is cached per model class, so this is one lookup per model per process
+            entry.content_type = ContentType.objects.get_for_model(related_object)
+            entry.object_id = related_object.pk
+
+        key = (event_type, user.pk, entry.section_id, entry.content_type_id, entry.object_id, description)
+        writer = self
+        while writer is not None:
+            if key in writer.seen:
+                return None
+            writer = writer.parent
+        self.seen.add(key)
+        self.entries.append(entry)
+        return entry
+
+    def _fill_snapshot_sections(self, entries):
+        """Entries without a section get the member's current section, in one query for the batch."""
+        from orbat.models import SectionAssignment
+
+        missing = {entry.user_id for entry in entries if entry.snapshot_section is None}
+        if not missing:
+            return
+        current = dict(
+            SectionAssignment.objects
+            .filter(Q(end_date__isnull=True) | Q(end_date__gt=timezone.now()), user_id__in=missing)
+            .values_list("user_id", "section__shorthand")
+        )
+        for entry in entries:
+            if entry.snapshot_section is None:
+                entry.snapshot_section = current.get(entry.user_id)
+
+    def flush(self):
+        entries, self.entries = self.entries, []
+        self.seen = set()
+        if not entries:
+            return []
+        self._fill_snapshot_sections(entries)
+        created = TimelineEntry.objects.bulk_create(entries, batch_size=self.batch_size)
+        update_daily_counts(created)
+        index_entries(created)
+        invalidate_timeline_caches()
+        return created
+
+
+def record_entry(event_type, user, **kwargs):
+    """
+    Queue a timeline entry.
+    Inside a transaction every queued entry is written with one bulk_create when it commits,
+    and entries queued inside a savepoint that is rolled back are dropped with it;
+    outside of one the entry is written straight away.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        writer = TimelineWriter()
+        entry = writer.add(event_type, user, **kwargs)
+        writer.flush()
+        return entry
+    return get_commit_buffer("_timeline_writers", TimelineWriter).add(event_type, user, **kwargs)
@@ -1,12 +1,35 @@
 from django.contrib import admin
+from django.forms import ModelForm
 
-from training.models import Qualification, UserQualification
+from training.models import Qualification, UserQualification, SectionQualificationCoverage
+from training.prerequisites import validate_prerequisites
+
+
+class QualificationForm(ModelForm):
+    """Rejects prerequisites that would make a qualification (indirectly) require itself."""
+    class Meta:
+        model = Qualification
+        fields = "__all__"
+
+    def clean_prerequisites(self):
+        prerequisites = self.cleaned_data["prerequisites"]
+        if self.instance.pk:
+            validate_prerequisites(self.instance.pk, {qual.pk for qual in prerequisites})
+        return prerequisites
 
 
 @admin.register(Qualification)
 class QualificationAdmin(admin.ModelAdmin):
-    list_display = ('name',)
+    form = QualificationForm
+    list_display = ('name', 'validity_days')
+    filter_horizontal = ('prerequisites',)
 
 @admin.register(UserQualification)
 class UserQualificationAdmin(admin.ModelAdmin):
-    list_display = ('user', 'qualification')
\ No newline at end of file
+    list_display = ('user', 'qualification', 'latest_passed', 'expires_on', 'lapsed')
+    list_filter = ('lapsed',)
+
+@admin.register(SectionQualificationCoverage)
+class SectionQualificationCoverageAdmin(admin.ModelAdmin):
+    list_display = ('section', 'qualification', 'qualified_count', 'member_count')
+    list_filter = ('section',)
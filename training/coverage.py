@@ -0,0 +1,120 @@
+from django.db import transaction
+from django.db.models import Count
+
+from core.transactions import get_commit_buffer
+from orbat.models import SectionAssignment
+from training.models import SectionQualificationCoverage
+
+
+def _active_assignments():
+    return SectionAssignment.objects.filter(end_date__isnull=True, user__is_active=True)
+
+
+def _compute_coverage(section_ids=None):
+    """Coverage rows for some sections (None for all), in two grouped queries."""
+    assignments = _active_assignments()
+    if section_ids is not None:
+        assignments = assignments.filter(section_id__in=section_ids)
+
+    member_counts = dict(
+        assignments.values_list("section_id").annotate(members=Count("user_id", distinct=True)).order_by()
+    )
+    # Both conditions in one filter() so they apply to the same UserQualification row
+    qualified = (
+        assignments
+        .filter(
+            user__userqualification__latest_passed__isnull=False,
+            user__userqualification__lapsed=False,
+            user__userqualification__qualification__is_active=True,
+        )
+        .values_list("section_id", "user__userqualification__qualification_id")
+        .annotate(qualified=Count("user_id", distinct=True))
+        .order_by()
+    )
+    return [
+        SectionQualificationCoverage(
+            section_id=section_id,
+            qualification_id=qual_id,
+            qualified_count=count,
+            member_count=member_counts.get(section_id, 0),
+        )
+        for section_id, qual_id, count in qualified
+    ]
+
+
+def refresh_section_coverage(section_ids=None):
+    """
+    Recompute the coverage rows of the given sections, or of every section for None.
+    Returns the number of rows written.
+    """
+    if section_ids is not None:
+        section_ids = list(section_ids)
+        if not section_ids:
+            return 0
+    rows = _compute_coverage(section_ids)
+    with transaction.atomic():
+        stale = SectionQualificationCoverage.objects.all()
+        if section_ids is not None:
+            stale = stale.filter(section_id__in=section_ids)
+        stale.delete()
+        SectionQualificationCoverage.objects.bulk_create(rows)
+    return len(rows)
+
+
+def rebuild_section_coverage():
+    return refresh_section_coverage()
+
+
+class CoverageRefresh:
+    """
+    Sections and members whose coverage changed in the current transaction.
+    Members are resolved to their sections when the transaction commits, so a
+    batch of awards refreshes each affected section once.
+    """
+
+    def __init__(self):
+        self.section_ids = set()
+        self.user_ids = set()
+        self.everything = False
+
+    def __bool__(self):
+        return bool(self.section_ids or self.user_ids or self.everything)
+
+    def flush(self):
+        section_ids, user_ids, everything = self.section_ids, self.user_ids, self.everything
+        self.section_ids, self.user_ids, self.everything = set(), set(), False
+        if everything:
+            return refresh_section_coverage()
+        if user_ids:
+            section_ids |= set(_active_assignments().filter(user_id__in=user_ids).values_list("section_id", flat=True))
+        return refresh_section_coverage(section_ids)
+
+
+def schedule_coverage_refresh(section_ids=(), user_ids=(), everything=False):
+    """
+    Refresh the coverage of these sections and of the sections these members are in.
+    Inside a transaction the refresh runs once, when it commits; outside of one straight away.
+    """
+    in_transaction = transaction.get_connection().in_atomic_block
+    pending = get_commit_buffer("_coverage_refreshes", CoverageRefresh) if in_transaction else CoverageRefresh()
+    pending.section_ids.update(section_id for section_id in section_ids if section_id is not None)
+    pending.user_ids.update(user_ids)
+    pending.everything |= everything
+    if not in_transaction:
+        pending.flush()
+
+
+def get_section_coverage(section_ids=None):
+    """
+    {section_id: [{"qualification", "qualified", "members"}]} from the rollup, in one query.
+    Qualifications are in their display order.
+    """
+    rows = SectionQualificationCoverage.objects.filter(qualification__is_active=True)
+    if section_ids is not None:
+        rows = rows.filter(section_id__in=section_ids)
+    coverage = {}
+    for section_id, name, qualified, members in rows.order_by("qualification__order", "qualification__name").values_list(
+        "section_id", "qualification__name", "qualified_count", "member_count",
+    ):
+        coverage.setdefault(section_id, []).append({"qualification": name, "qualified": qualified, "members": members})
+    return coverage
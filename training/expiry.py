@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+
+def compute_expiry(latest_passed, validity_days):
+    """The day a pass stops being valid, or None if it never expires or hasn't been passed."""
+    if latest_passed is None or validity_days is None:
+        return None
+    return latest_passed + timedelta(days=validity_days)
+
+
+def refresh_qualification_expiry(qualification, chunk_size=1000):
+    """
+    Recompute expires_on and lapsed for every pass of a qualification after its validity changes.
+    Returns the number of rows updated.
+    """
+    from training.models import UserQualification
+
+    today = timezone.localdate()
+    passes = UserQualification.objects.filter(qualification=qualification, latest_passed__isnull=False)
+    batch = []
+    updated = 0
+    for user_qual in passes.only("id", "latest_passed").iterator(chunk_size=chunk_size):
+        user_qual.expires_on = compute_expiry(user_qual.latest_passed, qualification.validity_days)
+        user_qual.lapsed = user_qual.expires_on is not None and user_qual.expires_on < today
+        batch.append(user_qual)
+        if len(batch) >= chunk_size:
+            updated += UserQualification.objects.bulk_update(batch, ["expires_on", "lapsed"])
+            batch = []
+    if batch:
+        updated += UserQualification.objects.bulk_update(batch, ["expires_on", "lapsed"])
+    return updated
+
+
+def get_due_for_recertification(within_days, today=None):
+    """
+    Passes that are still valid but expire within the next within_days days, soonest first.
+    A range scan on the expires_on index.
+    """
+    from training.models import UserQualification
+
+    today = today or timezone.localdate()
+    return (
+        UserQualification.objects
+        .filter(expires_on__gte=today, expires_on__lte=today + timedelta(days=within_days), lapsed=False)
+        .select_related("user", "qualification")
+        .order_by("expires_on")
+    )
+
+
+def flag_lapsed_qualifications(today=None):
+    """Mark every pass that expired before today as lapsed, in one update. Returns how many were flagged."""
+    from training.coverage import schedule_coverage_refresh
+    from training.matrix import invalidate_training_caches
+    from training.models import UserQualification
+
+    today = today or timezone.localdate()
+    expired = UserQualification.objects.filter(expires_on__lt=today, lapsed=False)
+    user_ids = set(expired.values_list("user_id", flat=True))
+    flagged = expired.update(lapsed=True)
+    if flagged:
+        invalidate_training_caches()
+        schedule_coverage_refresh(user_ids=user_ids)
+    return flagged
@@ -0,0 +1,88 @@
+import csv
+
+from django.contrib.auth import get_user_model
+
+from orbat.models import SectionAssignment
+from training.models import Qualification, UserQualification
+
+
+EXPORT_HEADER = [
+    "user_id", "username", "display_name", "section", "qualification", "status", "date_awarded", "latest_passed",
+    "expires_on",
+]
+
+
+class _Echo:
+    """File-like object for csv.writer that hands each row back instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def get_export_users(section=None):
+    """Active members, optionally only those in a section id or "unassigned"."""
+    users = get_user_model().objects.filter(is_active=True)
+    active_assignments = SectionAssignment.objects.filter(end_date__isnull=True)
+    if section == "unassigned":
+        users = users.exclude(id__in=active_assignments.values("user_id"))
+    elif section is not None:
+        users = users.filter(id__in=active_assignments.filter(section_id=section).values("user_id"))
+    return users
+
+
+def _status(user_qual):
+    if user_qual is None:
+        return "not started"
+    if user_qual.lapsed:
+        return "lapsed"
+    return "passed" if user_qual.latest_passed else "in progress"
+
+
+def iter_matrix_rows(section=None, qualification_ids=None, chunk_size=500):
+    """
+    Yield one row per member x qualification, header first.
+    Members and their qualifications are both streamed in user id order and merged,
+    so memory stays flat however large the unit is.
+    """
+    qualifications = Qualification.objects.filter(is_active=True).order_by("order", "id")
+    if qualification_ids:
+        qualifications = qualifications.filter(id__in=qualification_ids)
+    qualifications = list(qualifications.values_list("id", "name"))
+
+    users = get_export_users(section).order_by("id").values_list("id", "username", "display_name", "section_name")
+    user_quals = (
+        UserQualification.objects
+        .filter(user__in=get_export_users(section), qualification_id__in=[qual_id for qual_id, _ in qualifications])
+        .order_by("user_id")
+        .only("user_id", "qualification_id", "date_awarded", "latest_passed", "expires_on", "lapsed")
+        .iterator(chunk_size=chunk_size)
+    )
+
+    yield EXPORT_HEADER
+    pending = next(user_quals, None)
+    for user_id, username, display_name, section_name in users.iterator(chunk_size=chunk_size):
+        held = {}
+        while pending is not None and pending.user_id == user_id:
+            held[pending.qualification_id] = pending
+            pending = next(user_quals, None)
+
+        for qual_id, qual_name in qualifications:
+            user_qual = held.get(qual_id)
+            yield [
+                user_id,
+                username,
+                display_name,
+                section_name or "",
+                qual_name,
+                _status(user_qual),
+                user_qual.date_awarded.isoformat() if user_qual and user_qual.date_awarded else "",
+                user_qual.latest_passed.isoformat() if user_qual and user_qual.latest_passed else "",
+                user_qual.expires_on.isoformat() if user_qual and user_qual.expires_on else "",
+            ]
+
+
+def iter_matrix_csv(section=None, qualification_ids=None, chunk_size=500):
+    """The training matrix as CSV, one line at a time."""
+    writer = csv.writer(_Echo())
+    for row in iter_matrix_rows(section, qualification_ids, chunk_size):
+        yield writer.writerow(row)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from training.export import iter_matrix_csv
+
+
+class Command(BaseCommand):
+    help = "Export the training matrix (member x qualification status and dates) as CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--section", help="Section id, or 'unassigned'.")
+        parser.add_argument("--qualification", type=int, action="append", help="Qualification id; repeatable.")
+        parser.add_argument("--output", help="File to write to. Defaults to stdout.")
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        section = options["section"]
+        if section and section.isdigit():
+            section = int(section)
+        elif section not in (None, "unassigned"):
+            raise CommandError("--section must be a section id or 'unassigned'.")
+
+        lines = iter_matrix_csv(section, options["qualification"], chunk_size=options["chunk_size"])
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8", newline="") as handle:
+                handle.writelines(lines)
+            self.stdout.write(self.style.SUCCESS(f"Training matrix written to {options['output']}"))
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
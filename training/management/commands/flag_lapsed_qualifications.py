@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from training.expiry import flag_lapsed_qualifications, get_due_for_recertification
+
+
+class Command(BaseCommand):
+    help = "Mark expired qualification passes as lapsed and report those due for recertification."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--warn-days", type=int, default=30, help="Report passes expiring within this many days.")
+
+    def handle(self, *args, **options):
+        flagged = flag_lapsed_qualifications()
+        due = get_due_for_recertification(options["warn_days"]).count()
+        self.stdout.write(self.style.SUCCESS(
+            f"Flagged {flagged} lapsed qualification(s); {due} due for recertification within {options['warn_days']} days."
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from training.coverage import rebuild_section_coverage
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-section qualification coverage rollup from current assignments and passes."
+
+    def handle(self, *args, **options):
+        rows = rebuild_section_coverage()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt section coverage with {rows} rows."))
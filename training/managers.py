@@ -1,7 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
-from training.models import UserQualification, UserQualificationCriterion
+from timeline.models import TimelineTypes
+from timeline.utils import add_entry
 
 
 class QualificationManager(models.Manager):
@@ -18,22 +19,10 @@ class QualificationManager(models.Manager):
         """
         Award a qualification to a user and automatically mark all criteria completed.
         """
-        uq, created = UserQualification.objects.get_or_create(
-            user=user,
-            qualification=qualification,
-            defaults={
-                "event": event,
-                "date_awarded": timezone.now().date(),
-                "awarded_by": awarded_by,
-            }
-        )
+        from training.models import UserQualification
 
-        # Create UserQualificationCriterion entries if not already present
-        existing_criteria_ids = set(uq.criteria_status.values_list('criterion_id', flat=True))
-        for criterion in qualification.criteria.exclude(id__in=existing_criteria_ids):
-            UserQualificationCriterion.objects.create(user_qualification=uq, criterion=criterion)
-
-        return uq
+        results = UserQualification.objects.award_bulk([user], qualification, event=event, awarded_by=awarded_by)
+        return results[0]["user_qualification"]
 
 
 class UserQualificationManager(models.Manager):
@@ -44,19 +33,84 @@ class UserQualificationManager(models.Manager):
 
     def missing_criteria(self, user):
         """Return a list of criteria not yet awarded for this user's qualifications."""
-        missing = []
-        for uq in self.filter(user=user):
-            completed_ids = set(uq.criteria_status.values_list("criterion_id", flat=True))
-            all_ids = set(uq.qualification.criteria.values_list("id", flat=True))
-            missing.extend(uq.qualification.criteria.filter(id__in=all_ids - completed_ids))
-        return missing
-
-    def award_bulk(self, users, qualification, event=None, awarded_by=None):
-        """Award the same qualification to multiple users at once."""
-        results = []
-        for user in users:
-            uq = self.model.objects.award_to_user(user, qualification, event=event, awarded_by=awarded_by)
-            results.append(uq)
+        from training.models import QualificationCriterion
+        from training.services import get_training_progress
+
+        missing_ids = [criterion_id for row in get_training_progress([user.pk]) for criterion_id in row["missing"]]
+        return list(
+            QualificationCriterion.objects.filter(id__in=missing_ids)
+            .select_related("qualification")
+            .order_by("qualification__order", "qualification_id", "order")
+        )
+
+    def award_bulk(self, users, qualification, event=None, awarded_by=None, awarded_on=None):
+        """
+        Award the same qualification to multiple users at once and mark all its criteria completed.
+        Upserts the UserQualification rows and inserts the missing criteria rows in one transaction,
+        a fixed number of queries however many users or criteria there are.
+        date_awarded is kept for users who already had it; latest_passed is set to awarded_on (default today).
+        expires_on follows from the qualification's validity_days and lapsed is cleared.
+        Returns [{"user", "user_qualification", "status"}] in the order given, status being
+        "awarded" for a first pass or a pass after lapsing and "renewed" otherwise.
+        """
+        from training.coverage import schedule_coverage_refresh
+        from training.expiry import compute_expiry
+        from training.matrix import invalidate_training_caches
+        from training.models import UserQualificationCriterion
+
+        # A user listed twice would hit the same row twice in one upsert
+        users = list({user.pk: user for user in users}.values())
+        user_ids = [user.pk for user in users]
+        awarded_on = awarded_on or timezone.localdate()
+
+        with transaction.atomic():
+            existing = {uq.user_id: uq for uq in self.filter(qualification=qualification, user_id__in=user_ids)}
+            self.bulk_create(
+                [
+                    self.model(
+                        user=user,
+                        qualification=qualification,
+                        date_awarded=getattr(existing.get(user.pk), "date_awarded", None) or awarded_on,
+                        latest_passed=awarded_on,
+                        awarded_by_id=getattr(existing.get(user.pk), "awarded_by_id", None) or getattr(awarded_by, "pk", None),
+                        expires_on=compute_expiry(awarded_on, qualification.validity_days),
+                        lapsed=False,
+                    )
+                    for user in users
+                ],
+                update_conflicts=True,
+                unique_fields=["user", "qualification"],
+                update_fields=["date_awarded", "latest_passed", "awarded_by", "expires_on", "lapsed"],
+            )
+            user_quals = {uq.user_id: uq for uq in self.filter(qualification=qualification, user_id__in=user_ids)}
+
+            criterion_ids = list(qualification.criteria.values_list("id", flat=True))
+            UserQualificationCriterion.objects.bulk_create(
+                [
+                    UserQualificationCriterion(user_qualification=user_quals[user_id], criterion_id=criterion_id)
+                    for user_id in user_quals
+                    for criterion_id in criterion_ids
+                ],
+                ignore_conflicts=True,
+            )
+
+            results = []
+            for user in users:
+                uq = user_quals[user.pk]
+                previous = existing.get(user.pk)
+                first_pass = previous is None or previous.latest_passed is None or previous.lapsed
+                if first_pass:
+                    add_entry(
+                        TimelineTypes.TRAINING_COMPLETED,
+                        user,
+                        description=qualification.name,
+                        related_object=uq,
+                    )
+                results.append({"user": user, "user_qualification": uq, "status": "awarded" if first_pass else "renewed"})
+
+            # bulk_create skips post_save, so the matrix cache and coverage rollup are updated here
+            transaction.on_commit(invalidate_training_caches)
+            schedule_coverage_refresh(user_ids=user_ids)
         return results
 
 
@@ -68,6 +122,8 @@ class QualificationEventManager(models.Manager):
 
     def get_users_awarded(self, qualification):
         """Return all users who earned this qualification via events."""
+        from training.models import UserQualification
+
         return UserQualification.objects.filter(
             qualification=qualification,
             event__in=self.filter(qualification=qualification)
@@ -0,0 +1,170 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from core.cache import get_cache_version, bump_cache_version, versioned_key
+from orbat.export import ORBAT_NAMESPACE
+from orbat.models import SectionAssignment
+from orbat.role_catalogue import iter_bits
+from training.models import Qualification, UserQualification
+from training.prerequisites import compute_closure, get_prerequisite_edges
+
+
+TRAINING_NAMESPACE = "training"
+
+# Per-process copy so a request doesn't unpickle the matrix from the cache backend every time
+_local_matrix = {"key": None, "matrix": None}
+
+
+class TrainingMatrix:
+    """
+    Active members x active qualifications compiled into integer bitsets.
+    Each member row is a qualification mask and each qualification column a member mask,
+    so section filtering is an AND on the columns and coverage is a popcount.
+    Prerequisites are compiled to a transitive-closure mask per qualification, so
+    eligibility is a subset test against a member's row.
+    """
+
+    def __init__(self, users, qualifications, passed_pairs, section_pairs, prerequisite_closure=None):
+        self.users = users
+        self.qualifications = qualifications
+        self.user_index = {user["id"]: index for index, user in enumerate(users)}
+        self.qual_index = {qual["id"]: index for index, qual in enumerate(qualifications)}
+
+        self.rows = [0] * len(users)
+        self.columns = [0] * len(qualifications)
+        for user_id, qual_id in passed_pairs:
+            row, column = self.user_index.get(user_id), self.qual_index.get(qual_id)
+            if row is not None and column is not None:
+                self.rows[row] |= 1 << column
+                self.columns[column] |= 1 << row
+
+        self.all_rows = (1 << len(users)) - 1
+        self.section_rows = {}
+        for section_id, user_id in section_pairs:
+            row = self.user_index.get(user_id)
+            if row is not None:
+                self.section_rows[section_id] = self.section_rows.get(section_id, 0) | 1 << row
+        assigned = 0
+        for mask in self.section_rows.values():
+            assigned |= mask
+        self.unassigned_rows = self.all_rows & ~assigned
+
+        # Inactive prerequisites can't be earned any more, so they don't block anyone
+        self.prerequisites = [0] * len(qualifications)
+        for qual_id, needed in (prerequisite_closure or {}).items():
+            column = self.qual_index.get(qual_id)
+            if column is not None:
+                for prerequisite_id in needed:
+                    if prerequisite_id in self.qual_index:
+                        self.prerequisites[column] |= 1 << self.qual_index[prerequisite_id]
+
+    @classmethod
+    def build(cls):
+        users = [
+            {"id": str(user_id), "username": username}
+            for user_id, username in get_user_model().objects.filter(is_active=True)
+            .order_by("username").values_list("id", "username")
+        ]
+        qualifications = list(Qualification.objects.filter(is_active=True).order_by("order", "id").values("id", "name"))
+        passed_pairs = (
+            UserQualification.objects
+            .filter(latest_passed__isnull=False, lapsed=False, user__is_active=True, qualification__is_active=True)
+            .values_list("user_id", "qualification_id")
+        )
+        section_pairs = SectionAssignment.objects.filter(end_date__isnull=True).values_list("section_id", "user_id")
+        return cls(
+            users,
+            qualifications,
+            [(str(user_id), qual_id) for user_id, qual_id in passed_pairs],
+            [(section_id, str(user_id)) for section_id, user_id in section_pairs],
+            compute_closure(get_prerequisite_edges()),
+        )
+
+    # --- Slicing ---
+    def rows_mask(self, section=None):
+        """Members in a section id, "unassigned", or everyone for None."""
+        if section is None:
+            return self.all_rows
+        if section == "unassigned":
+            return self.unassigned_rows
+        return self.section_rows.get(section, 0)
+
+    def qualification_ids(self, row):
+        return [self.qualifications[index]["id"] for index in iter_bits(self.rows[row])]
+
+    def members(self, rows_mask):
+        """The selected members with the ids of the qualifications they hold."""
+        return [
+            {**self.users[row], "qualifications": self.qualification_ids(row)}
+            for row in iter_bits(rows_mask)
+        ]
+
+    def has(self, user_id, qualification_id):
+        row, column = self.user_index.get(str(user_id)), self.qual_index.get(qualification_id)
+        return row is not None and column is not None and bool(self.rows[row] >> column & 1)
+
+    # --- Coverage ---
+    def coverage(self, rows_mask=None):
+        """{qualification_id: members holding it} among the selected members."""
+        rows_mask = self.all_rows if rows_mask is None else rows_mask
+        return {
+            qual["id"]: (self.columns[index] & rows_mask).bit_count()
+            for index, qual in enumerate(self.qualifications)
+        }
+
+    # --- Eligibility ---
+    def eligible_mask(self, row):
+        """Qualifications a member doesn't hold yet but holds every prerequisite for."""
+        held = self.rows[row]
+        eligible = 0
+        for column, needed in enumerate(self.prerequisites):
+            if not held >> column & 1 and needed & ~held == 0:
+                eligible |= 1 << column
+        return eligible
+
+    def eligible_qualifications(self, user_id):
+        """Ids of the qualifications a member can start next."""
+        row = self.user_index.get(str(user_id))
+        if row is None:
+            return []
+        return [self.qualifications[index]["id"] for index in iter_bits(self.eligible_mask(row))]
+
+    def eligible_rows(self, qualification_id, rows_mask=None):
+        """Members (of rows_mask) who hold every prerequisite of a qualification but not the qualification itself."""
+        rows_mask = self.all_rows if rows_mask is None else rows_mask
+        column = self.qual_index.get(qualification_id)
+        if column is None:
+            return 0
+        eligible = rows_mask & ~self.columns[column]
+        for index in iter_bits(self.prerequisites[column]):
+            eligible &= self.columns[index]
+        return eligible
+
+
+def get_training_matrix():
+    """
+    Return the compiled matrix for the current training and ORBAT versions.
+    Membership and user changes bump the ORBAT version, so both are part of the key.
+    """
+    key = versioned_key(TRAINING_NAMESPACE, "matrix", f"orbat-{get_cache_version(ORBAT_NAMESPACE)}")
+    if _local_matrix["key"] == key:
+        return _local_matrix["matrix"]
+
+    matrix = cache.get(key)
+    if matrix is None:
+        matrix = TrainingMatrix.build()
+        cache.set(key, matrix, timeout=None)
+
+    _local_matrix["key"] = key
+    _local_matrix["matrix"] = matrix
+    return matrix
+
+
+def get_eligible_members(qualification_id, section=None):
+    """Members of a section (id, "unassigned" or None for everyone) who can start a qualification."""
+    matrix = get_training_matrix()
+    return matrix.members(matrix.eligible_rows(qualification_id, matrix.rows_mask(section)))
+
+
+def invalidate_training_caches():
+    bump_cache_version(TRAINING_NAMESPACE)
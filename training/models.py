@@ -1,7 +1,10 @@
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 from events.models import Event
+from training.expiry import compute_expiry
+from training.managers import QualificationManager, UserQualificationManager, QualificationEventManager
 
 
 class Qualification(models.Model):
@@ -9,6 +12,15 @@ class Qualification(models.Model):
     description = models.TextField(blank=True)
     is_active = models.BooleanField(default=True)
     order = models.PositiveIntegerField(default=0)
+    validity_days = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Days a pass stays valid before recertification. Leave empty to never expire."
+    )
+    prerequisites = models.ManyToManyField(
+        "self", symmetrical=False, blank=True, related_name="required_for",
+        help_text="Qualifications a member must hold before starting this one.",
+    )
+
+    objects = QualificationManager()
 
     def __str__(self):
         return self.name
@@ -35,6 +47,8 @@ class QualificationEvent(models.Model):
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name="qualification_events")
     qualification = models.ForeignKey("training.Qualification", on_delete=models.CASCADE, related_name="qualification_events")
 
+    objects = QualificationEventManager()
+
     class Meta:
         unique_together = ("event", "qualification")
 
@@ -50,9 +64,25 @@ class UserQualification(models.Model):
     date_awarded = models.DateField(null=True, blank=True)
     latest_passed = models.DateField(null=True, blank=True)
     awarded_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name="qualifications_awarded")
+    # Denormalized from latest_passed + Qualification.validity_days so due-date queries are index range scans
+    expires_on = models.DateField(null=True, blank=True)
+    lapsed = models.BooleanField(default=False)
+
+    objects = UserQualificationManager()
 
     class Meta:
         unique_together = ("user", "qualification")
+        indexes = [
+            models.Index(fields=["expires_on"], name="training_uq_expires_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.expires_on = compute_expiry(self.latest_passed, self.qualification.validity_days)
+        self.lapsed = self.lapsed and self.expires_on is not None and self.expires_on < timezone.localdate()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "expires_on", "lapsed"}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.user.display_name} - {self.qualification.name}"
@@ -82,4 +112,21 @@ class QualificationTrainer(models.Model):
     qualification = models.ForeignKey(Qualification, on_delete=models.CASCADE)
     is_manager = models.BooleanField(default=False)
     is_senior = models.BooleanField(default=False)
-    is_trainer = models.BooleanField(default=True)
\ No newline at end of file
+    is_trainer = models.BooleanField(default=True)
+
+class SectionQualificationCoverage(models.Model):
+    """
+    How many of a section's current members hold each qualification, for coverage badges.
+    Only non-zero counts are stored. Kept up to date by awards, revocations and section
+    moves; rebuild with the rebuild_section_coverage command.
+    """
+    section = models.ForeignKey("orbat.Section", on_delete=models.CASCADE, related_name="qualification_coverage")
+    qualification = models.ForeignKey(Qualification, on_delete=models.CASCADE, related_name="section_coverage")
+    qualified_count = models.PositiveIntegerField(default=0)
+    member_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("section", "qualification")
+
+    def __str__(self):
+        return f"{self.section} - {self.qualification.name}: {self.qualified_count}/{self.member_count}"
@@ -0,0 +1,53 @@
+from django.core.exceptions import ValidationError
+
+
+def get_prerequisite_edges():
+    """{qualification_id: {direct prerequisite ids}}, in one query."""
+    from training.models import Qualification
+
+    edges = {}
+    through = Qualification.prerequisites.through.objects.values_list("from_qualification_id", "to_qualification_id")
+    for qual_id, prerequisite_id in through:
+        edges.setdefault(qual_id, set()).add(prerequisite_id)
+    return edges
+
+
+def compute_closure(edges):
+    """
+    {qualification_id: every prerequisite it needs, direct or not} for a prerequisite graph.
+    Raises ValidationError naming the loop if the graph has a cycle.
+    """
+    closure = {}
+    visiting = []
+
+    def visit(qual_id):
+        if qual_id in closure:
+            return closure[qual_id]
+        if qual_id in visiting:
+            loop = visiting[visiting.index(qual_id):] + [qual_id]
+            raise ValidationError(f"Prerequisites form a cycle: {' -> '.join(str(pk) for pk in loop)}.")
+        visiting.append(qual_id)
+        needed = set()
+        for prerequisite_id in edges.get(qual_id, ()):
+            needed.add(prerequisite_id)
+            needed |= visit(prerequisite_id)
+        visiting.pop()
+        closure[qual_id] = needed
+        return needed
+
+    for qual_id in list(edges):
+        visit(qual_id)
+    return closure
+
+
+def validate_prerequisites(qualification_id, prerequisite_ids, edges=None):
+    """
+    Check that giving a qualification these direct prerequisites keeps the graph acyclic.
+    Shared by the admin form and the m2m_changed guard. Raises ValidationError.
+    """
+    prerequisite_ids = set(prerequisite_ids)
+    if qualification_id in prerequisite_ids:
+        raise ValidationError("A qualification can't be its own prerequisite.")
+    edges = dict(get_prerequisite_edges() if edges is None else edges)
+    edges[qualification_id] = prerequisite_ids
+    compute_closure(edges)
@@ -0,0 +1,184 @@
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from timeline.models import TimelineTypes
+from timeline.utils import add_entry
+from training.coverage import schedule_coverage_refresh
+from training.expiry import compute_expiry
+from training.matrix import invalidate_training_caches
+from training.models import QualificationCriterion, UserQualification, UserQualificationCriterion
+from training.trainers import get_trainer_rights
+
+
+def can_grade_qualification(user, qualification):
+    """Staff, trainers of the qualification and holders of a training.grantqualification grant may grade it."""
+    if not user.is_authenticated:
+        return False
+    if user.is_staff or user.is_superuser:
+        return True
+    return get_trainer_rights(user).can_grade(qualification.pk)
+
+
+def get_grading_grid(qualification, user_ids=None):
+    """
+    {user_id: [completed criterion ids]} for a qualification, in one query.
+    Defaults to everyone who has started it.
+    """
+    user_quals = UserQualification.objects.filter(qualification=qualification)
+    if user_ids is not None:
+        user_quals = user_quals.filter(user_id__in=user_ids)
+
+    grid = {}
+    for user_id, criterion_id in user_quals.values_list("user_id", "criteria_status__criterion_id"):
+        completed = grid.setdefault(user_id, [])
+        if criterion_id is not None:
+            completed.append(criterion_id)
+    return grid
+
+
+def grade_criteria(qualification, grid, graded_by=None, graded_on=None):
+    """
+    Apply a student x criterion grid for one qualification: {user_id: {completed criterion ids}}.
+    Each listed student's completed criteria become exactly the given set, so only the
+    difference is written. Students with every criterion complete who hadn't passed yet
+    (or whose pass lapsed) are promoted, setting date_awarded (if missing), latest_passed and expires_on.
+    Raises ValidationError for unknown students or criteria that don't belong to the qualification.
+    Returns {"added", "removed", "promoted"}, promoted being the promoted user ids.
+    """
+    graded_on = graded_on or timezone.localdate()
+    criterion_ids = set(qualification.criteria.values_list("id", flat=True))
+
+    unknown_criteria = set().union(*grid.values()) - criterion_ids if grid else set()
+    if unknown_criteria:
+        raise ValidationError(f"Unknown criteria for {qualification.name}: {sorted(unknown_criteria)}.")
+
+    users = get_user_model().objects.in_bulk(list(grid))
+    unknown_users = [user_id for user_id in grid if user_id not in users]
+    if unknown_users:
+        raise ValidationError(f"Unknown users: {', '.join(str(user_id) for user_id in unknown_users)}.")
+
+    with transaction.atomic():
+        # Students being ticked for the first time need a UserQualification to hang criteria from
+        UserQualification.objects.bulk_create(
+            [UserQualification(user=users[user_id], qualification=qualification) for user_id, ticked in grid.items() if ticked],
+            ignore_conflicts=True,
+        )
+        user_quals = {
+            uq.user_id: uq for uq in UserQualification.objects.filter(qualification=qualification, user_id__in=list(grid))
+        }
+
+        existing = {}
+        for row in UserQualificationCriterion.objects.filter(user_qualification__in=user_quals.values()):
+            existing[row.user_qualification_id, row.criterion_id] = row.id
+        wanted = {
+            (user_quals[user_id].id, criterion_id)
+            for user_id, ticked in grid.items()
+            for criterion_id in ticked
+        }
+
+        to_add = wanted - existing.keys()
+        to_remove = [row_id for key, row_id in existing.items() if key not in wanted]
+        UserQualificationCriterion.objects.bulk_create(
+            [UserQualificationCriterion(user_qualification_id=uq_id, criterion_id=criterion_id) for uq_id, criterion_id in to_add],
+            ignore_conflicts=True,
+        )
+        if to_remove:
+            UserQualificationCriterion.objects.filter(id__in=to_remove).delete()
+
+        promoted = [
+            user_id for user_id, ticked in grid.items()
+            if criterion_ids and criterion_ids <= set(ticked)
+            and (user_quals[user_id].latest_passed is None or user_quals[user_id].lapsed)
+        ]
+        if promoted:
+            promoted_quals = [user_quals[user_id] for user_id in promoted]
+            for uq in promoted_quals:
+                uq.date_awarded = uq.date_awarded or graded_on
+                uq.latest_passed = graded_on
+                uq.expires_on = compute_expiry(graded_on, qualification.validity_days)
+                uq.lapsed = False
+                if uq.awarded_by_id is None:
+                    uq.awarded_by = graded_by
+            UserQualification.objects.bulk_update(
+                promoted_quals, ["date_awarded", "latest_passed", "expires_on", "lapsed", "awarded_by"],
+            )
+            for user_id in promoted:
+                add_entry(
+                    TimelineTypes.TRAINING_COMPLETED,
+                    users[user_id],
+                    description=qualification.name,
+                    related_object=user_quals[user_id],
+                )
+            schedule_coverage_refresh(user_ids=promoted)
+
+        # bulk_create and bulk_update skip post_save, so the matrix cache is invalidated here
+        transaction.on_commit(invalidate_training_caches)
+
+    return {"added": len(to_add), "removed": len(to_remove), "promoted": promoted}
+
+
+def get_training_progress(user_ids, qualification_ids=None, include_unstarted=False):
+    """
+    Criteria progress for a set of users, in three queries however many users or qualifications.
+    Returns one dict per user and qualification they've started (every active qualification
+    with include_unstarted): user_id, qualification_id, passed, completed, total and
+    missing, the ids of the criteria still to do.
+    """
+    criteria = QualificationCriterion.objects.filter(qualification__is_active=True)
+    if qualification_ids is not None:
+        criteria = criteria.filter(qualification_id__in=qualification_ids)
+    criteria_by_qual = {}
+    for qual_id, criterion_id in criteria.order_by("qualification_id", "order").values_list("qualification_id", "id"):
+        criteria_by_qual.setdefault(qual_id, []).append(criterion_id)
+
+    user_quals = UserQualification.objects.filter(user_id__in=user_ids, qualification__is_active=True)
+    completed_rows = UserQualificationCriterion.objects.filter(
+        user_qualification__user_id__in=user_ids,
+        user_qualification__qualification__is_active=True,
+    )
+    if qualification_ids is not None:
+        user_quals = user_quals.filter(qualification_id__in=qualification_ids)
+        completed_rows = completed_rows.filter(user_qualification__qualification_id__in=qualification_ids)
+
+    passed = {}
+    for user_id, qual_id, latest_passed, lapsed in user_quals.values_list(
+        "user_id", "qualification_id", "latest_passed", "lapsed",
+    ):
+        passed[user_id, qual_id] = latest_passed is not None and not lapsed
+    completed = {}
+    for user_id, qual_id, criterion_id in completed_rows.values_list(
+        "user_qualification__user_id", "user_qualification__qualification_id", "criterion_id",
+    ):
+        completed.setdefault((user_id, qual_id), set()).add(criterion_id)
+
+    if include_unstarted:
+        keys = [(user_id, qual_id) for user_id in user_ids for qual_id in criteria_by_qual]
+    else:
+        keys = list(passed)
+
+    progress = []
+    for user_id, qual_id in keys:
+        qual_criteria = criteria_by_qual.get(qual_id, [])
+        done = completed.get((user_id, qual_id), set())
+        missing = [criterion_id for criterion_id in qual_criteria if criterion_id not in done]
+        progress.append({
+            "user_id": user_id,
+            "qualification_id": qual_id,
+            "passed": passed.get((user_id, qual_id), False),
+            "completed": len(qual_criteria) - len(missing),
+            "total": len(qual_criteria),
+            "missing": missing,
+        })
+    return progress
+
+
+def get_closest_to_qualifying(user_ids, qualification_ids=None, limit=None):
+    """Unpassed progress rows for the given users, fewest missing criteria first."""
+    progress = [
+        row for row in get_training_progress(user_ids, qualification_ids)
+        if not row["passed"] and row["total"]
+    ]
+    progress.sort(key=lambda row: (len(row["missing"]), -row["completed"]))
+    return progress[:limit] if limit else progress
@@ -0,0 +1,71 @@
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from orbat.models import SectionAssignment
+from permissions.models import PermissionGrant, PermissionGroupMembership
+from training.coverage import schedule_coverage_refresh
+from training.expiry import refresh_qualification_expiry
+from training.matrix import invalidate_training_caches
+from training.models import Qualification, QualificationTrainer, UserQualification
+from training.prerequisites import get_prerequisite_edges, validate_prerequisites
+from training.trainers import invalidate_trainer_rights
+
+
+@receiver(pre_save, sender=Qualification)
+def remember_validity(sender, instance, **kwargs):
+    instance._previous_validity_days = (
+        Qualification.objects.filter(pk=instance.pk).values_list("validity_days", flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Qualification)
+def refresh_expiry_on_validity_change(sender, instance, created, **kwargs):
+    if not created and instance.validity_days != getattr(instance, "_previous_validity_days", instance.validity_days):
+        refresh_qualification_expiry(instance)
+
+
+@receiver([post_save, post_delete], sender=Qualification)
+@receiver([post_save, post_delete], sender=UserQualification)
+def invalidate_training_on_change(sender, **kwargs):
+    invalidate_training_caches()
+
+
+@receiver(m2m_changed, sender=Qualification.prerequisites.through)
+def guard_prerequisite_cycles(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_add":
+        edges = get_prerequisite_edges()
+        if reverse:
+            # instance.required_for.add(...): instance becomes a prerequisite of each pk
+            for qual_id in pk_set:
+                edges[qual_id] = edges.get(qual_id, set()) | {instance.pk}
+            for qual_id in pk_set:
+                validate_prerequisites(qual_id, edges[qual_id], edges)
+        else:
+            validate_prerequisites(instance.pk, edges.get(instance.pk, set()) | pk_set, edges)
+    elif action in ("post_add", "post_remove", "post_clear"):
+        invalidate_training_caches()
+
+
+# Connected after refresh_expiry_on_validity_change so a validity change is reflected in the rollup
+@receiver(post_save, sender=Qualification)
+def refresh_coverage_on_qualification_change(sender, instance, created, **kwargs):
+    if not created:
+        schedule_coverage_refresh(everything=True)
+
+
+@receiver([post_save, post_delete], sender=UserQualification)
+def refresh_coverage_on_award(sender, instance, **kwargs):
+    schedule_coverage_refresh(user_ids=[instance.user_id])
+
+
+@receiver([post_save, post_delete], sender=SectionAssignment)
+def refresh_coverage_on_assignment(sender, instance, **kwargs):
+    schedule_coverage_refresh(section_ids=[instance.section_id])
+
+
+@receiver([post_save, post_delete], sender=QualificationTrainer)
+@receiver([post_save, post_delete], sender=PermissionGrant)
+@receiver([post_save, post_delete], sender=PermissionGroupMembership)
+def invalidate_trainer_rights_on_change(sender, **kwargs):
+    invalidate_trainer_rights()
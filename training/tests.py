@@ -1,3 +1,302 @@
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from orbat.models import Section, SectionAssignment
+from orbat.utils import move_users_to_section
+from permissions.models import PermissionGrant, PermissionGroup, PermissionGroupMembership
+from timeline.models import TimelineEntry, TimelineTypes
+from training.coverage import get_section_coverage, rebuild_section_coverage
+from training.expiry import flag_lapsed_qualifications, get_due_for_recertification
+from training.export import EXPORT_HEADER, iter_matrix_rows
+from training.matrix import get_eligible_members, get_training_matrix
+from training.services import can_grade_qualification, get_closest_to_qualifying
+from training.trainers import get_trainer_rights
+from training.models import Qualification, QualificationCriterion, QualificationTrainer, UserQualification, \
+    UserQualificationCriterion
+
+
+class TrainingMatrixTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.alpha = Section.objects.create(name="Alpha", shorthand="A", type="infantry", max_size=8)
+        self.medic = Qualification.objects.create(name="Medic", order=1)
+        self.pilot = Qualification.objects.create(name="Pilot", order=2)
+        self.users = [User.objects.create(username=f"trainee_{i}", display_name=f"Trainee {i}") for i in range(3)]
+        SectionAssignment.objects.create(user=self.users[0], section=self.alpha)
+        SectionAssignment.objects.create(user=self.users[1], section=self.alpha)
+        UserQualification.objects.create(user=self.users[0], qualification=self.medic, latest_passed=date.today())
+        UserQualification.objects.create(user=self.users[2], qualification=self.medic, latest_passed=date.today())
+        UserQualification.objects.create(user=self.users[1], qualification=self.pilot)
+
+    def test_slices_and_coverage_follow_changes(self):
+        matrix = get_training_matrix()
+        self.assertEqual(matrix.coverage(), {self.medic.id: 2, self.pilot.id: 0})
+        self.assertEqual(matrix.coverage(matrix.rows_mask(self.alpha.id)), {self.medic.id: 1, self.pilot.id: 0})
+        self.assertEqual([member["username"] for member in matrix.members(matrix.rows_mask("unassigned"))],
+                         ["trainee_2"])
+        with self.assertNumQueries(0):
+            self.assertIs(get_training_matrix(), matrix)
+
+        UserQualification.objects.filter(qualification=self.pilot).update(latest_passed=date.today())
+        UserQualification.objects.get(qualification=self.pilot).save()
+        self.assertTrue(get_training_matrix().has(self.users[1].id, self.pilot.id))
+
+    def test_prerequisites_drive_eligibility_and_reject_cycles(self):
+        advanced = Qualification.objects.create(name="Combat Lifesaver", order=3)
+        advanced.prerequisites.add(self.medic)
+        self.assertEqual(get_training_matrix().eligible_qualifications(self.users[0].id), [self.pilot.id, advanced.id])
+        self.assertEqual(get_training_matrix().eligible_qualifications(self.users[1].id), [self.medic.id, self.pilot.id])
+        self.assertEqual([member["username"] for member in get_eligible_members(advanced.id, self.alpha.id)],
+                         ["trainee_0"])
+
+        self.pilot.prerequisites.add(advanced)
+        # The guard raises inside add()'s atomic block, so each attempt gets its own savepoint
+        with self.assertRaises(ValidationError), transaction.atomic():
+            self.medic.prerequisites.add(self.pilot)
+        with self.assertRaises(ValidationError), transaction.atomic():
+            self.pilot.required_for.add(self.medic)
+        self.assertFalse(self.medic.prerequisites.exists())
+
+
+class TrainingExportTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.medic = Qualification.objects.create(name="Medic", order=1)
+        self.pilot = Qualification.objects.create(name="Pilot", order=2)
+        self.users = [User.objects.create(username=f"export_{i}", display_name=f"Export {i}") for i in range(3)]
+        UserQualification.objects.create(
+            user=self.users[1], qualification=self.medic, date_awarded=date(2025, 1, 2), latest_passed=date(2025, 3, 4),
+        )
+        UserQualification.objects.create(user=self.users[2], qualification=self.pilot)
+
+    def test_rows_cover_every_member_and_qualification(self):
+        rows = list(iter_matrix_rows(chunk_size=1))
+        self.assertEqual(rows[0], EXPORT_HEADER)
+        self.assertEqual(len(rows), 1 + len(self.users) * 2)
+        statuses = {(row[1], row[4]): row[5:] for row in rows[1:]}
+        self.assertEqual(statuses["export_1", "Medic"], ["passed", "2025-01-02", "2025-03-04", ""])
+        self.assertEqual(statuses["export_2", "Pilot"], ["in progress", "", "", ""])
+        self.assertEqual(statuses["export_0", "Medic"], ["not started", "", "", ""])
+
+        only_pilot = list(iter_matrix_rows(qualification_ids=[self.pilot.id]))
+        self.assertEqual({row[4] for row in only_pilot[1:]}, {"Pilot"})
+
+
+class UserTrainingViewTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.trainee = User.objects.create(username="trainee", display_name="Trainee")
+        self.trainer = User.objects.create(username="trainer", display_name="Trainer")
+        self.client.force_login(self.trainer)
+
+    def add_qualification(self, index):
+        qualification = Qualification.objects.create(name=f"Qualification {index}", order=index)
+        first = QualificationCriterion.objects.create(qualification=qualification, name="Theory", order=1)
+        QualificationCriterion.objects.create(qualification=qualification, name="Practical", order=2)
+        user_qual = UserQualification.objects.create(user=self.trainee, qualification=qualification)
+        UserQualificationCriterion.objects.create(user_qualification=user_qual, criterion=first)
+        QualificationTrainer.objects.create(user=self.trainer, qualification=qualification)
+
+    def get_training(self):
+        return self.client.get(reverse("user_profile_training", args=[self.trainee.id]))
+
+    def test_queries_do_not_grow_with_qualifications(self):
+        self.add_qualification(1)
+        with CaptureQueriesContext(connection) as one:
+            self.get_training()
+        for index in range(2, 6):
+            self.add_qualification(index)
+        with self.assertNumQueries(len(one)):
+            response = self.get_training()
+
+        cert = response.context["training_data"][0]
+        self.assertEqual([criterion["completed"] for criterion in cert["criteria"]], [True, False])
+        self.assertEqual(cert["completed_count"], 1)
+        self.assertTrue(cert["can_manage_cert"])
+
+
+class AwardBulkTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.qualification = Qualification.objects.create(name="Marksman")
+        for order in range(10):
+            QualificationCriterion.objects.create(qualification=self.qualification, name=f"Shoot {order}", order=order)
+        self.users = [User.objects.create(username=f"course_{i}", display_name=f"Course {i}") for i in range(40)]
+        UserQualification.objects.create(
+            user=self.users[0], qualification=self.qualification, date_awarded=date(2024, 1, 1), latest_passed=date(2024, 1, 1),
+        )
+
+    def test_award_bulk_runs_in_constant_queries(self):
+        ContentType.objects.clear_cache()
+        with self.captureOnCommitCallbacks(execute=True):
+            # Savepoint, existing rows, upsert, reload, criteria, criteria insert, content type, release
+            with self.assertNumQueries(8):
+                results = UserQualification.objects.award_bulk(self.users, self.qualification, awarded_on=date(2025, 6, 1))
+
+        self.assertEqual([result["status"] for result in results[:2]], ["renewed", "awarded"])
+        renewed = results[0]["user_qualification"]
+        self.assertEqual((renewed.date_awarded, renewed.latest_passed), (date(2024, 1, 1), date(2025, 6, 1)))
+        self.assertEqual(UserQualificationCriterion.objects.count(), 400)
+        self.assertEqual(TimelineEntry.objects.filter(event_type=TimelineTypes.TRAINING_COMPLETED).count(), 39)
+
+
+class GradingAPITests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.qualification = Qualification.objects.create(name="Rifleman")
+        self.criteria = [
+            QualificationCriterion.objects.create(qualification=self.qualification, name=f"Drill {order}", order=order)
+            for order in range(3)
+        ]
+        self.students = [User.objects.create(username=f"student_{i}", display_name=f"Student {i}") for i in range(2)]
+        self.trainer = User.objects.create(username="instructor", display_name="Instructor")
+        self.url = f"/api/training/qualification/{self.qualification.id}/grades/"
+
+    def post_grades(self, grades):
+        return self.client.post(self.url, {"grades": grades}, content_type="application/json")
+
+    def test_only_trainers_can_grade(self):
+        self.client.force_login(self.trainer)
+        self.assertEqual(self.post_grades({}).status_code, 403)
+
+    def test_grid_diff_is_applied_and_complete_students_promoted(self):
+        QualificationTrainer.objects.create(user=self.trainer, qualification=self.qualification)
+        self.client.force_login(self.trainer)
+        all_ids = [criterion.id for criterion in self.criteria]
+        first, second = (str(student.id) for student in self.students)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = self.post_grades({first: all_ids[:2], second: all_ids}).json()
+        self.assertEqual((result["added"], result["removed"], result["promoted"]), (5, 0, [second]))
+
+        result = self.post_grades({first: all_ids[1:]}).json()
+        self.assertEqual((result["added"], result["removed"], result["promoted"]), (1, 1, []))
+
+        grades = self.client.get(self.url).json()["grades"]
+        self.assertEqual(grades[first], all_ids[1:])
+        passed = UserQualification.objects.get(user=self.students[1])
+        self.assertEqual((passed.latest_passed, passed.awarded_by), (date.today(), self.trainer))
+        self.assertEqual(self.post_grades({first: [0]}).status_code, 400)
+
+
+class TrainingProgressTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.qualification = Qualification.objects.create(name="Signaller")
+        self.criteria = [
+            QualificationCriterion.objects.create(qualification=self.qualification, name=f"Radio {order}", order=order)
+            for order in range(3)
+        ]
+        self.users = [User.objects.create(username=f"signal_{i}", display_name=f"Signal {i}") for i in range(3)]
+        for user, done in zip(self.users, (1, 2, 0)):
+            user_qual = UserQualification.objects.create(user=user, qualification=self.qualification)
+            for criterion in self.criteria[:done]:
+                UserQualificationCriterion.objects.create(user_qualification=user_qual, criterion=criterion)
+
+    def test_progress_for_many_users_in_three_queries(self):
+        user_ids = [user.id for user in self.users]
+        with self.assertNumQueries(3):
+            closest = get_closest_to_qualifying(user_ids)
+        self.assertEqual([row["user_id"] for row in closest], [self.users[1].id, self.users[0].id, self.users[2].id])
+        self.assertEqual((closest[0]["completed"], closest[0]["total"], closest[0]["missing"]), (2, 3, [self.criteria[2].id]))
+
+        missing = UserQualification.objects.missing_criteria(self.users[0])
+        self.assertEqual(missing, self.criteria[1:])
+
+
+class QualificationExpiryTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.qualification = Qualification.objects.create(name="First Aid", validity_days=365)
+        self.users = [User.objects.create(username=f"medic_{i}", display_name=f"Medic {i}") for i in range(3)]
+        for user, passed_on in zip(self.users, (date(2024, 1, 1), date(2024, 6, 1), date(2025, 3, 1))):
+            UserQualification.objects.create(
+                user=user, qualification=self.qualification, date_awarded=passed_on, latest_passed=passed_on,
+            )
+
+    def test_expiry_due_and_lapsed(self):
+        today = date(2025, 5, 1)
+        self.assertEqual(UserQualification.objects.get(user=self.users[0]).expires_on, date(2024, 12, 31))
+        due = get_due_for_recertification(60, today=today)
+        self.assertEqual([uq.user for uq in due], [self.users[1]])
+
+        self.assertEqual(flag_lapsed_qualifications(today=today), 1)
+        self.assertFalse(get_training_matrix().has(self.users[0].id, self.qualification.id))
+
+        # Re-awarding a lapsed pass counts as a fresh pass
+        results = UserQualification.objects.award_bulk([self.users[0]], self.qualification, awarded_on=today)
+        self.assertEqual(results[0]["status"], "awarded")
+        renewed = UserQualification.objects.get(user=self.users[0])
+        self.assertEqual((renewed.lapsed, renewed.expires_on), (False, date(2026, 5, 1)))
+
+    def test_changing_validity_refreshes_expiry(self):
+        self.qualification.validity_days = None
+        self.qualification.save()
+        self.assertFalse(UserQualification.objects.filter(expires_on__isnull=False).exists())
+
+
+class SectionCoverageTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.alpha = Section.objects.create(name="Alpha", shorthand="A", type="infantry", max_size=8)
+        self.bravo = Section.objects.create(name="Bravo", shorthand="B", type="infantry", max_size=8)
+        self.medic = Qualification.objects.create(name="Medic")
+        self.users = [User.objects.create(username=f"cover_{i}", display_name=f"Cover {i}") for i in range(3)]
+        for user in self.users:
+            SectionAssignment.objects.create(user=user, section=self.alpha)
+
+    def badges(self, section):
+        return [(row["qualification"], row["qualified"], row["members"]) for row in get_section_coverage().get(section.id, [])]
+
+    def test_rollup_follows_awards_revocations_and_moves(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            UserQualification.objects.award_bulk(self.users[:2], self.medic)
+        self.assertEqual(self.badges(self.alpha), [("Medic", 2, 3)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            move_users_to_section([self.users[0]], self.bravo)
+        self.assertEqual(self.badges(self.alpha), [("Medic", 1, 2)])
+        self.assertEqual(self.badges(self.bravo), [("Medic", 1, 1)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UserQualification.objects.get(user=self.users[1]).delete()
+        self.assertEqual(self.badges(self.alpha), [])
+
+        incremental = get_section_coverage()
+        rebuild_section_coverage()
+        self.assertEqual(get_section_coverage(), incremental)
+        with self.assertNumQueries(1):
+            get_section_coverage()
+
+
+class TrainerRightsTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create(username="mentor", display_name="Mentor")
+        self.medic, self.pilot, self.diver = (Qualification.objects.create(name=name) for name in ("Medic", "Pilot", "Diver"))
+        QualificationTrainer.objects.create(user=self.user, qualification=self.medic, is_senior=True)
+        group = PermissionGroup.objects.create(name="Flight instructors")
+        PermissionGroupMembership.objects.create(user=self.user, group=group)
+        PermissionGrant.objects.create(
+            group=group, permission="grantqualification", module="training", effect=PermissionGrant.ALLOW,
+            content_type=ContentType.objects.get_for_model(Qualification), object_id=self.pilot.id,
+        )
+
+    def test_rights_combine_trainer_rows_and_grants_and_follow_changes(self):
+        rights = get_trainer_rights(self.user)
+        self.assertEqual((rights.trainer, rights.senior, rights.manager), ({self.medic.id}, {self.medic.id}, set()))
+        with self.assertNumQueries(0):
+            self.assertTrue(can_grade_qualification(self.user, self.pilot))
+            self.assertFalse(can_grade_qualification(self.user, self.diver))
 
-# Create your tests here.
+        QualificationTrainer.objects.create(user=self.user, qualification=self.diver, is_manager=True)
+        rights = get_trainer_rights(self.user)
+        self.assertEqual(rights.manager, {self.diver.id})
+        self.assertTrue(rights.can_grade(self.diver.id))
@@ -0,0 +1,96 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+
+from core.cache import bump_cache_version, versioned_key
+from permissions.models import PermissionGrant
+from training.models import Qualification, QualificationTrainer
+
+
+TRAINER_NAMESPACE = "trainers"
+TRAINER_RIGHTS_TIMEOUT = 60 * 60
+
+
+class TrainerRights:
+    """
+    The qualifications a user trains, is senior on or manages, plus those a
+    training.grantqualification grant lets them grade. Built once per user and cached.
+    """
+
+    def __init__(self, trainer=(), senior=(), manager=(), assigned=(), granted=(), grant_all=False, denied=(), deny_all=False):
+        self.trainer = frozenset(trainer)
+        self.senior = frozenset(senior)
+        self.manager = frozenset(manager)
+        # Every qualification with a QualificationTrainer row, whichever flags it has
+        self.assigned = frozenset(assigned)
+        self.granted = frozenset(granted)
+        self.grant_all = grant_all
+        self.denied = frozenset(denied)
+        self.deny_all = deny_all
+
+    @classmethod
+    def build(cls, user):
+        """Two queries: the user's QualificationTrainer rows and their training grants."""
+        rights = {"trainer": set(), "senior": set(), "manager": set(), "assigned": set()}
+        for qual_id, is_trainer, is_senior, is_manager in QualificationTrainer.objects.filter(user=user).values_list(
+            "qualification_id", "is_trainer", "is_senior", "is_manager",
+        ):
+            rights["assigned"].add(qual_id)
+            for name, flag in (("trainer", is_trainer), ("senior", is_senior), ("manager", is_manager)):
+                if flag:
+                    rights[name].add(qual_id)
+
+        qualification_type = ContentType.objects.get_for_model(Qualification)
+        granted, denied = set(), set()
+        grant_all = deny_all = False
+        grants = PermissionGrant.objects.filter(
+            group__memberships__user=user,
+            module="training",
+            permission__in=["grantqualification", "*"],
+        ).values_list("effect", "content_type_id", "object_id", "scope_key")
+        for effect, content_type_id, object_id, scope_key in grants:
+            # Same matching as user_has_permission with a Qualification scope
+            if scope_key is not None or content_type_id not in (None, qualification_type.id):
+                continue
+            if content_type_id is None and object_id is not None:
+                continue
+            if effect == PermissionGrant.DENY:
+                if object_id is None:
+                    deny_all = True
+                else:
+                    denied.add(object_id)
+            elif effect == PermissionGrant.ALLOW:
+                if object_id is None:
+                    grant_all = True
+                else:
+                    granted.add(object_id)
+
+        return cls(granted=granted, grant_all=grant_all, denied=denied, deny_all=deny_all, **rights)
+
+    def has_grant(self, qualification_id):
+        if self.deny_all or qualification_id in self.denied:
+            return False
+        return self.grant_all or qualification_id in self.granted
+
+    def can_grade(self, qualification_id):
+        return qualification_id in self.assigned or self.has_grant(qualification_id)
+
+    @property
+    def is_trainer(self):
+        """Whether the user has trainer rights on any qualification."""
+        return bool(self.assigned) or (not self.deny_all and (self.grant_all or bool(self.granted - self.denied)))
+
+
+def get_trainer_rights(user):
+    """The user's TrainerRights, from the cache when their rights haven't changed."""
+    if not user.is_authenticated:
+        return TrainerRights()
+    key = versioned_key(TRAINER_NAMESPACE, "user", user.pk)
+    rights = cache.get(key)
+    if rights is None:
+        rights = TrainerRights.build(user)
+        cache.set(key, rights, timeout=TRAINER_RIGHTS_TIMEOUT)
+    return rights
+
+
+def invalidate_trainer_rights():
+    bump_cache_version(TRAINER_NAMESPACE)
@@ -1,9 +1,10 @@
 from django.urls import path
 
-from training.views import TrainingHomeView, TrainingMatrixView
+from training.views import TrainingHomeView, TrainingMatrixView, TrainingMatrixExportView
 
 
 urlpatterns = [
     path("", TrainingHomeView.as_view(), name="training_home"),
     path("matrix/", TrainingMatrixView.as_view(), name="training_matrix"),
+    path("matrix/export/", TrainingMatrixExportView.as_view(), name="training_matrix_export"),
 ]
\ No newline at end of file
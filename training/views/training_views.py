@@ -1,11 +1,19 @@
 from django.contrib.auth import get_user_model
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
+from django.http import StreamingHttpResponse
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.decorators import method_decorator
 
-from orbat.models import Section, SectionAssignment
+from orbat.models import Section
 from users.views import ProfileBaseView
 from . import TrainingBaseView
-from users.backends import User
-from ..models import Qualification, QualificationTrainer, UserQualification
+from ..export import iter_matrix_csv
+from ..matrix import get_training_matrix
+from ..models import Qualification, QualificationCriterion, UserQualification, UserQualificationCriterion
+from ..trainers import get_trainer_rights
 
 
 class TrainingHomeView(TrainingBaseView):
@@ -36,48 +44,45 @@ class TrainingMatrixView(TrainingBaseView):
         ]
 
         section_filter = self.request.GET.get("section")
+        if section_filter and section_filter.isdigit():
+            section_filter = int(section_filter)
+        elif section_filter != "unassigned":
+            section_filter = None
+        context["current_section_id"] = section_filter
 
-        if not section_filter:
-            base_users = User.objects.filter(is_active=True)
-            context["current_section_id"] = None
-        elif section_filter == "unassigned":
-            active_assignments = SectionAssignment.objects.filter(end_date__isnull=True)
-            assigned_user_ids = active_assignments.values_list('user_id', flat=True)
-            base_users = User.objects.filter(is_active=True).exclude(id__in=assigned_user_ids)
-            context["current_section_id"] = 'unassigned'
-        else:
-            base_users = User.objects.filter(
-                id__in=SectionAssignment.objects.filter(
-                    section_id=section_filter, end_date__isnull=True
-                ).values_list("user_id", flat=True)
-            )
-            context["current_section_id"] = int(section_filter)
-
-        # Build map: {user_id: [qualification_ids]}
-        user_quals = (
-            UserQualification.objects
-            .filter(user__in=base_users, latest_passed__isnull=False)
-            .values("user_id", "qualification_id")
-        )
-
-        user_qual_map = {}
-        for uq in UserQualification.objects.all().values("user_id", "qualification_id"):
-            user_qual_map.setdefault(str(uq["user_id"]), []).append(uq["qualification_id"])
-
-        context["users"] = [
-            {
-                "id": str(user.id),  # cast to string so keys match
-                "username": user.username,
-                "qualifications": user_qual_map.get(str(user.id), []),
-            }
-            for user in base_users
-        ]
+        matrix = get_training_matrix()
+        rows_mask = matrix.rows_mask(section_filter)
+        coverage = matrix.coverage(rows_mask)
 
+        context["users"] = matrix.members(rows_mask)
         context["sections"] = Section.objects.all().order_by("name")
-        context["qualifications"] = Qualification.objects.filter(is_active=True).order_by("order")
+        context["qualifications"] = [{**qual, "coverage": coverage[qual["id"]]} for qual in matrix.qualifications]
 
         return context
 
+@method_decorator(login_required, name="dispatch")
+class TrainingMatrixExportView(TrainingBaseView):
+    """Streams the matrix as CSV. ?section=<id>|unassigned and repeated ?qualification=<id> filter it."""
+
+    def get(self, request, *args, **kwargs):
+        user = request.user
+        if not (user.is_staff or get_trainer_rights(user).is_trainer):
+            raise PermissionDenied
+
+        section = request.GET.get("section")
+        if section and section.isdigit():
+            section = int(section)
+        elif section != "unassigned":
+            section = None
+        qualification_ids = [int(qual_id) for qual_id in request.GET.getlist("qualification") if qual_id.isdigit()]
+
+        response = StreamingHttpResponse(
+            iter_matrix_csv(section, qualification_ids),
+            content_type="text/csv",
+        )
+        response["Content-Disposition"] = f'attachment; filename="training-matrix-{timezone.localdate()}.csv"'
+        return response
+
 class UserTrainingView(ProfileBaseView):
     template_name = "training_user_overview.html"
     def get_context_data(self, **kwargs):
@@ -86,57 +91,54 @@ class UserTrainingView(ProfileBaseView):
         profile_user = get_object_or_404(get_user_model(), pk=user_id)
         request_user = self.request.user
 
-        # Fetch all active qualifications, ordered
-        qualifications = Qualification.objects.filter(is_active=True).order_by("order")
+        # Active qualifications with their criteria, in two queries
+        qualifications = (
+            Qualification.objects.filter(is_active=True)
+            .order_by("order")
+            .prefetch_related(Prefetch("criteria", queryset=QualificationCriterion.objects.order_by("order")))
+        )
+
+        user_qual_map = {uq.qualification_id: uq for uq in UserQualification.objects.filter(user=profile_user)}
+        completed_criteria = set(
+            UserQualificationCriterion.objects
+            .filter(user_qualification__user=profile_user)
+            .values_list("criterion_id", flat=True)
+        )
 
-        # Prefetch user qualifications for efficiency
-        user_quals = UserQualification.objects.filter(user=profile_user).select_related('qualification')
-        user_qual_map = {uq.qualification_id: uq for uq in user_quals}
+        # Trainer rights of the current user, cached per user
+        trainer_rights = get_trainer_rights(request_user)
 
         training_data = []
 
         for qual in qualifications:
             user_qual = user_qual_map.get(qual.id)
-            passed = user_qual.latest_passed is not None if user_qual else False
-            first_passed = user_qual.date_awarded if user_qual else None
-            latest_passed = user_qual.latest_passed if user_qual else None
-
-            # Get criteria for this qualification
-            criteria_qs = qual.criteria.all().order_by("order")
-            criteria_list = []
-            for crit in criteria_qs:
-                crit_passed = False
-                if user_qual:
-                    # Here you can add a model UserQualificationCriterion if you track individual criterion passes
-                    # For now we assume criterion is passed if qualification is passed
-                    crit_passed = passed
-                criteria_list.append({
+
+            criteria_list = [
+                {
                     "id": crit.id,
                     "name": crit.name,
                     "order": crit.order,
-                    "passed": crit_passed,
-                })
-
-            # Determine if current user can manage this qualification
-            can_manage = False
-            if request_user.is_authenticated:
-                is_trainer = QualificationTrainer.objects.filter(
-                    user=request_user,
-                    qualification=qual
-                ).exists()
-                can_manage = is_trainer or request_user.is_staff
+                    "completed": crit.id in completed_criteria,
+                }
+                for crit in qual.criteria.all()
+            ]
 
             training_data.append({
                 "id": qual.id,
                 "name": qual.name,
                 "description": qual.description,
-                "passed": passed,
-                "first_passed": first_passed,
-                "latest_passed": latest_passed,
+                "passed": bool(user_qual and user_qual.latest_passed and not user_qual.lapsed),
+                "lapsed": bool(user_qual and user_qual.lapsed),
+                "first_passed": user_qual.date_awarded if user_qual else None,
+                "latest_passed": user_qual.latest_passed if user_qual else None,
+                "expires_on": user_qual.expires_on if user_qual else None,
                 "criteria": criteria_list,
-                "can_manage_cert": can_manage,
+                "completed_count": sum(criterion["completed"] for criterion in criteria_list),
+                "can_manage_cert": request_user.is_authenticated and (
+                    request_user.is_staff or trainer_rights.can_grade(qual.id)
+                ),
             })
 
         context["training_data"] = training_data
         context["profile_user"] = profile_user
-        return context
\ No newline at end of file
+        return context
@@ -72,6 +72,11 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         ordering = ('display_name',)
         verbose_name = 'User'
         verbose_name_plural = 'Users'
+        indexes = [
+            models.Index(fields=["status", "display_name"], name="user_status_name_idx"),
+            models.Index(fields=["section_name", "display_name"], name="user_section_name_idx"),
+            models.Index(fields=["rank", "display_name"], name="user_rank_name_idx"),
+        ]
 
     def __str__(self):
         return self.get_name_with_callsign()